@@ -0,0 +1,291 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from datetime import datetime
+
+import bucketing
+import connection
+import data_generation
+import indexes
+import rollups
+import text_pools
+import validation_runner
+
+# Benchmark suite: for each dataset size, measures pure generation speed
+# (documents built per second, nothing written), the bulk load (overall and per
+# collection, from the time each writer spends in insert_many), the post-load
+# index and rollup builds and the latency of every validation check, detection
+# included. Results go to a JSON file; --compare diffs two of them and fails on
+# regressions.
+#
+# Runs against a mongod (a separate database, dropped at the end) or in-process
+# against mongomock. mongomock does not implement several operators the checks
+# and the rollup use (see MOCKED_OUT); those are recorded with their ERROR
+# outcome rather than a latency, so a mongomock run cannot gate them, detection
+# included. Benchmark those against a mongod.
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_DATABASE = 'village_bench'
+DEFAULT_SEED = 42  # Same data on every run, so two runs are comparable
+DEFAULT_AS_OF = '2025-01-01T00:00:00'  # Generation date, fixed for the same reason
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10  # Relative change reported as a regression
+
+# What mongomock cannot run, and the operator it lacks
+MOCKED_OUT = {
+    'rollup': '$merge',
+    'control_activity_dates': '$lookup sub-pipelines',
+    'names_length': '$strLenCP',
+    'illegal_well_and_owner': '$stdDevPop',
+}
+
+
+class NullWriter:
+    # Counts documents instead of writing them
+    def __init__(self):
+        self.inserted = 0
+        self.insert_seconds = 0.0
+        self.raw_bson = True
+
+    def add(self, document):
+        self.inserted += 1
+
+    def extend(self, documents):
+        for document in documents:
+            self.add(document)
+
+    def close(self):
+        pass
+
+
+def rate(docs, seconds):
+    return docs / seconds if seconds else 0.0
+
+
+def use_backend(backend, uri, database):
+    connection.DATABASE = database
+    if backend == 'mongomock':
+        import mongomock  # Only needed for the in-process backend
+        connection.use_client(mongomock.MongoClient())
+    elif uri:
+        connection.MONGO_URI = uri
+
+# Phases
+
+
+def bench_generation(plan):
+    writers = {name: NullWriter() for name in data_generation.collection_names(plan['consumption_layout'])}
+    started = time.perf_counter()
+    for chunk_index in range(data_generation.num_chunks(plan)):
+        data_generation.load_chunk(writers, plan, chunk_index, data_generation.fake)
+    seconds = time.perf_counter() - started
+    docs = sum(writer.inserted for writer in writers.values())
+    return {'docs': docs, 'seconds': seconds, 'docs_per_s': rate(docs, seconds)}
+
+
+def bench_load(db, plan, batch_size):
+    writers = data_generation.open_writers(db, batch_size, plan['consumption_layout'])
+    started = time.perf_counter()
+    try:
+        for chunk_index in range(data_generation.num_chunks(plan)):
+            data_generation.load_chunk(writers, plan, chunk_index, data_generation.fake)
+    finally:
+        data_generation.close_writers(writers)
+    seconds = time.perf_counter() - started
+    docs = sum(writer.inserted for writer in writers.values())
+    inserts = {
+        name: {
+            'docs': writer.inserted,
+            'seconds': writer.insert_seconds,
+            'docs_per_s': rate(writer.inserted, writer.insert_seconds)
+        }
+        for name, writer in writers.items()
+    }
+    return {'docs': docs, 'seconds': seconds, 'docs_per_s': rate(docs, seconds)}, inserts
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def bench_checks(repeat):
+    checks = {}
+    for unit in validation_runner.CHECKS:
+        runs = [validation_runner.run_check(unit, out=lambda line: None) for _ in range(repeat)]
+        last = runs[-1]
+        wall_ms = [run['wall_ms'] for run in runs]
+        checks[unit['name']] = {
+            'outcome': last['outcome'],
+            'violations': last['violations'],
+            'error': last.get('error'),
+            'wall_ms': wall_ms,
+            'median_ms': statistics.median(wall_ms),
+            'min_ms': min(wall_ms),
+            'db_median_ms': statistics.median(run['db_ms'] for run in runs),
+        }
+    return checks
+
+
+def bench_size(users, args, out=print):
+    db = connection.get_database('bulk_load')
+    data_generation.reset_collections(db)
+    plan = data_generation.make_plan(users, args.readings, args.seed, args.engine, args.text,
+                                     consumption_layout=args.layout, as_of=datetime.fromisoformat(args.as_of))
+
+    out(f"\n== {users} users ==")
+    if args.text == 'pools':
+        # Build the on-disk pools before timing, as load_village does: a cold
+        # cache would otherwise be charged to the first generation phase
+        text_pools.load_pools(data_generation.LOCALE, plan['text_seed'], plan['pool_size'])
+    result = {'users': users}
+    result['generation'] = bench_generation(plan)
+    out(f"generation: {result['generation']['docs']} docs, {result['generation']['docs_per_s']:,.0f} docs/s")
+
+    result['load'], result['inserts'] = bench_load(db, plan, args.batch_size)
+    out(f"load: {result['load']['docs_per_s']:,.0f} docs/s")
+    for name, insert in result['inserts'].items():
+        out(f"  {name}: {insert['docs']} docs, {insert['docs_per_s']:,.0f} docs/s in insert_many")
+
+    result['indexes_s'] = timed(lambda: indexes.create_indexes(connection.get_database(), out=lambda line: None))
+    result['rollup_s'] = None
+    if 'water_consumption' in bucketing.LAYOUTS[args.layout]:
+        try:
+            result['rollup_s'] = timed(
+                lambda: rollups.rebuild(connection.get_database(), out=lambda line: None, grace=0))
+        except Exception as exc:
+            out(f"rollup: {exc!r}")
+    out(f"indexes: {result['indexes_s']:.2f}s, rollup: "
+        f"{'-' if result['rollup_s'] is None else format(result['rollup_s'], '.2f') + 's'}")
+
+    result['checks'] = bench_checks(args.repeat)
+    for name, check in result['checks'].items():
+        if check['outcome'] in ('ERROR', 'TIMEOUT'):
+            out(f"  {name}: {check['outcome']} {check['error']}")
+        else:
+            out(f"  {name}: {check['median_ms']:.1f} ms median (database {check['db_median_ms']:.1f} ms)")
+    return result
+
+
+def run(args):
+    use_backend(args.backend, args.uri, args.database)
+    if args.backend == 'mongomock':
+        print("WARN: mongomock cannot run these, so this run does not measure or gate them: " +
+              ", ".join(f"{name} ({operator})" for name, operator in MOCKED_OUT.items()))
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'backend': args.backend,
+        'config': {
+            'readings': args.readings,
+            'seed': args.seed,
+            'as_of': args.as_of,
+            'engine': args.engine,
+            'text': args.text,
+            'layout': args.layout,
+            'batch_size': args.batch_size,
+            'repeat': args.repeat,
+        },
+        'runs': [],
+    }
+    try:
+        for users in args.sizes:
+            report['runs'].append(bench_size(users, args))
+    finally:
+        connection.get_client().drop_database(args.database)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nResults written to {args.output}")
+
+# Comparing two result files
+
+
+def metrics(run):
+    # name -> (value, higher is better, why there is no value); a value of None
+    # is a metric the run could not measure
+    values = {
+        'generation docs/s': (run['generation']['docs_per_s'], True, None),
+        'load docs/s': (run['load']['docs_per_s'], True, None),
+        'indexes s': (run['indexes_s'], False, None),
+        'rollup s': (run['rollup_s'], False, 'not built' if run['rollup_s'] is None else None),
+    }
+    for name, insert in run['inserts'].items():
+        values[f"insert {name} docs/s"] = (insert['docs_per_s'], True, None)
+    for name, check in run['checks'].items():
+        if check['outcome'] in ('ERROR', 'TIMEOUT'):
+            values[f"check {name} ms"] = (None, False, check['outcome'])
+        else:
+            values[f"check {name} ms"] = (check['median_ms'], False, None)
+    return values
+
+
+def compare(baseline_path, current_path, threshold=DEFAULT_THRESHOLD):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {run['users']: run for run in json.load(f)['runs']}
+    with open(current_path, encoding='utf-8') as f:
+        current = {run['users']: run for run in json.load(f)['runs']}
+
+    regressions = 0
+    for users in sorted(set(baseline) & set(current)):
+        print(f"\n== {users} users ==")
+        before, after = metrics(baseline[users]), metrics(current[users])
+        for name, (old, higher_is_better, _) in before.items():
+            new, _, missing = after.get(name, (None, higher_is_better, 'missing'))
+            if old is None:
+                continue  # Nothing measured to regress from
+            if new is None:
+                # Measured before, not now (ERROR, TIMEOUT, gone): the worst regression
+                regressions += 1
+                print(f"{name:<52} {old:>14,.2f} {missing:>14} {'':>9}  REGRESSION")
+                continue
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            elif -worse > threshold:
+                flag = 'improved'
+            print(f"{name:<52} {old:>14,.2f} {new:>14,.2f} {change * 100:>+8.1f}%  {flag}")
+    missing = sorted(set(baseline) ^ set(current))
+    if missing:
+        print(f"\nSizes only in one of the files: {missing}")
+    print(f"\n{regressions} regression(s) beyond {threshold * 100:.0f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generation throughput and validation latency.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Dataset sizes (users)')
+    parser.add_argument('--readings', type=int, default=50, help='Weekly readings per user')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Dataset seed')
+    parser.add_argument('--as-of', default=DEFAULT_AS_OF, help='ISO date-time the dataset is generated as of')
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python', help='Generation engine')
+    parser.add_argument('--text', choices=['faker', 'pools'], default='faker', help='Text source')
+    parser.add_argument('--layout', choices=list(bucketing.LAYOUTS), default='readings', help='Consumption layout')
+    parser.add_argument('--batch-size', type=int, default=data_generation.DEFAULT_BATCH_SIZE,
+                        help='Documents per bulk insert')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per validation check')
+    parser.add_argument('--backend', choices=['mongod', 'mongomock'], default='mongod',
+                        help='A running mongod (see --uri) or an in-process mongomock')
+    parser.add_argument('--uri', default=None, help='MongoDB URI (defaults to the connection settings)')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='Scratch database, dropped at the end')
+    parser.add_argument('--output', default='benchmark.json', help='JSON results path')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None,
+                        help='Compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, threshold=args.threshold) else 0)
+    if args.database == connection.DATABASE:
+        parser.error(f"--database {args.database} is the working database; the benchmark drops it")
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+from pymongo import ASCENDING, IndexModel
+import argparse
+import time
+
+from datetime import datetime
+
+import connection
+
+# Bucketed storage for water_consumption: one document per user per month
+# holding the reading dates and meter readings as compact arrays, plus the
+# reading before the first one and precomputed totals. consumption_m3,
+# variation and previous_reading of every reading can be derived from the
+# arrays, and user_id / _id are stored once per month instead of once per
+# reading.
+#
+#   {user_id, month, dates: [...], readings: [...], start_reading, count, total_m3}
+#
+# A reading i consumed readings[i] - (readings[i - 1] or start_reading).
+
+BUCKET_COLLECTION = 'water_consumption_buckets'
+
+# Collections holding the readings for each consumption layout
+LAYOUTS = {
+    'readings': ['water_consumption'],
+    'buckets': [BUCKET_COLLECTION],
+    'both': ['water_consumption', BUCKET_COLLECTION],
+}
+
+BUCKET_INDEXES = [
+    IndexModel([('user_id', ASCENDING), ('month', ASCENDING)], name='user_id_month', unique=True),
+]
+
+
+def loaded_layout(db):
+    # 'buckets' when the readings only exist as buckets (a buckets-only load, or
+    # migrate with drop_source), else 'readings'
+    if db.water_consumption.find_one({}, {'_id': 1}) is None and \
+            db[BUCKET_COLLECTION].find_one({}, {'_id': 1}) is not None:
+        return 'buckets'
+    return 'readings'
+
+
+def month_of(date):
+    return datetime(date.year, date.month, 1)
+
+# Building buckets from reading documents (generation time)
+
+
+def bucket_readings(readings):
+    # `readings` are one user's reading documents in date order
+    buckets = []
+    bucket = None
+    for reading in readings:
+        month = month_of(reading['date'])
+        if bucket is None or bucket['month'] != month:
+            bucket = {
+                'user_id': reading['user_id'],
+                'month': month,
+                'dates': [],
+                'readings': [],
+                'start_reading': reading['previous_reading'],
+                'count': 0,
+                'total_m3': 0.0
+            }
+            buckets.append(bucket)
+        bucket['dates'].append(reading['date'])
+        bucket['readings'].append(reading['current_reading'])
+        bucket['count'] += 1
+        bucket['total_m3'] += reading['consumption_m3']
+    return buckets
+
+
+def expand_bucket(bucket):
+    # Back to the one-document-per-reading shape
+    previous_reading = bucket['start_reading']
+    for date, current_reading in zip(bucket['dates'], bucket['readings']):
+        yield {
+            'user_id': bucket['user_id'],
+            'date': date,
+            'consumption_m3': current_reading - previous_reading,
+            'previous_reading': previous_reading,
+            'current_reading': current_reading,
+            'variation': current_reading - previous_reading
+        }
+        previous_reading = current_reading
+
+def reading_update(reading):
+    # (filter, update) appending one new reading to its month's bucket; the
+    # first reading of a month creates the bucket
+    return (
+        { 'user_id': reading['user_id'], 'month': month_of(reading['date']) },
+        {
+            '$push': { 'dates': reading['date'], 'readings': reading['current_reading'] },
+            '$inc': { 'count': 1, 'total_m3': reading['consumption_m3'] },
+            '$setOnInsert': { 'start_reading': reading['previous_reading'] }
+        }
+    )
+
+# Reading the buckets
+
+
+def user_totals_stages():
+    # Total consumption per user from the buckets, as {_id: user_id, total}
+    return [
+        {
+            '$group': {
+                '_id': "$user_id",
+                'total': { '$sum': "$total_m3" }
+            }
+        }
+    ]
+
+# Migration from the one-document-per-reading layout, done on the server
+
+
+def migration_pipeline():
+    return [
+        { '$sort': { 'user_id': 1, 'date': 1 } },
+        {
+            '$group': {
+                '_id': {
+                    'user_id': "$user_id",
+                    'month': {
+                        '$dateFromParts': { 'year': { '$year': "$date" }, 'month': { '$month': "$date" } }
+                    }
+                },
+                'dates': { '$push': "$date" },
+                'readings': { '$push': "$current_reading" },
+                'start_reading': { '$first': "$previous_reading" },
+                'count': { '$sum': 1 },
+                'total_m3': { '$sum': "$consumption_m3" }
+            }
+        },
+        {
+            '$project': {
+                '_id': 0,
+                'user_id': "$_id.user_id",
+                'month': "$_id.month",
+                'dates': 1,
+                'readings': 1,
+                'start_reading': 1,
+                'count': 1,
+                'total_m3': 1
+            }
+        },
+        # Rerunning the migration replaces the buckets it wrote before
+        { '$merge': { 'into': BUCKET_COLLECTION, 'on': ["user_id", "month"], 'whenMatched': "replace" } }
+    ]
+
+
+def migrate(db, drop_source=False, out=print):
+    started = time.perf_counter()
+    db[BUCKET_COLLECTION].create_indexes(BUCKET_INDEXES)  # $merge on user_id/month needs the unique index
+    db.water_consumption.aggregate(migration_pipeline(), allowDiskUse=True)
+    readings = db.water_consumption.estimated_document_count()
+    buckets = db[BUCKET_COLLECTION].estimated_document_count()
+    out(f"Migrated {readings} readings into {buckets} buckets ({time.perf_counter() - started:.1f}s)")
+    if drop_source:
+        db.water_consumption.drop()
+        out("Dropped water_consumption")
+
+# Side-by-side comparison of the two layouts
+
+
+def layout_stats(db, collection):
+    stats = db.command('collStats', collection)
+    return {
+        'count': stats.get('count', 0),
+        'size': stats.get('size', 0),
+        'avg_obj_size': stats.get('avgObjSize', 0),
+        'storage_size': stats.get('storageSize', 0),
+        'total_index_size': stats.get('totalIndexSize', 0),
+    }
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(db, out=print):
+    sample = db[BUCKET_COLLECTION].find_one({}, {'user_id': 1}) or db.water_consumption.find_one({}, {'user_id': 1})
+    user_id = sample['user_id'] if sample else None
+    layouts = {
+        'readings': {
+            'collection': 'water_consumption',
+            'totals': lambda: list(db.water_consumption.aggregate(
+                [{ '$group': { '_id': "$user_id", 'total': { '$sum': "$consumption_m3" } } }], allowDiskUse=True)),
+            'history': lambda: list(db.water_consumption.find({ 'user_id': user_id }).sort('date', 1)),
+        },
+        'buckets': {
+            'collection': BUCKET_COLLECTION,
+            'totals': lambda: list(db[BUCKET_COLLECTION].aggregate(user_totals_stages(), allowDiskUse=True)),
+            'history': lambda: [reading for bucket in db[BUCKET_COLLECTION].find({ 'user_id': user_id }).sort('month', 1)
+                                for reading in expand_bucket(bucket)],
+        },
+    }
+
+    results = {}
+    for name, layout in layouts.items():
+        stats = layout_stats(db, layout['collection'])
+        stats['user_totals_s'] = timed(layout['totals'])
+        stats['user_history_s'] = timed(layout['history']) if user_id else None
+        results[name] = stats
+
+    out(f"{'':<22}{'readings':>16}{'buckets':>16}")
+    for key in ('count', 'size', 'avg_obj_size', 'storage_size', 'total_index_size', 'user_totals_s', 'user_history_s'):
+        row = [results[name][key] for name in ('readings', 'buckets')]
+        cells = ''.join(f"{'-' if value is None else (f'{value:.4f}' if isinstance(value, float) else value):>16}"
+                        for value in row)
+        out(f"{key:<22}{cells}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bucketed water_consumption layout tools.')
+    parser.add_argument('command', choices=['migrate', 'compare'])
+    parser.add_argument('--drop-source', action='store_true', help='Drop water_consumption after migrating')
+    args = parser.parse_args()
+
+    db = connection.get_database()
+    if args.command == 'migrate':
+        migrate(db, args.drop_source)
+    else:
+        compare(db)
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from connection import primary
+
+# Checkpoint store: one document per key in village.checkpoints, recording how
+# far an incremental process (a validation check, a rollup, a change stream)
+# has got, e.g. the last _id it processed or a change stream resume token.
+
+COLLECTION = 'checkpoints'
+
+
+def load_checkpoint(db, key):
+    return primary(db)[COLLECTION].find_one({'_id': key}) or {}
+
+
+def save_checkpoint(db, key, **fields):
+    fields['updated_at'] = datetime.now()
+    db[COLLECTION].update_one({'_id': key}, {'$set': fields}, upsert=True)
+
+
+def replace_checkpoint(db, key, expected, upsert=False, **fields):
+    # Compare-and-set: saves `fields` only while the checkpoint still holds the
+    # `expected` values (None matches a missing field). Returns whether it did;
+    # with upsert, a checkpoint that does not exist yet counts as matching.
+    fields['updated_at'] = datetime.now()
+    try:
+        result = db[COLLECTION].update_one(dict(expected, _id=key), {'$set': fields}, upsert=upsert)
+    except DuplicateKeyError:
+        return False  # The checkpoint exists but no longer holds `expected`
+    return bool(result.matched_count or result.upserted_id is not None)
+
+
+def reset_checkpoints(db, prefix=''):
+    return db[COLLECTION].delete_many({'_id': {'$regex': f"^{prefix}"}}).deleted_count
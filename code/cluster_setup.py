@@ -0,0 +1,91 @@
+import argparse
+
+from contextlib import contextmanager
+
+import connection
+
+# Sharding setup for the docker-compose cluster: enables sharding on the
+# village database, shards the collections on hashed keys with chunks split
+# and distributed up front (so the bulk load hits every shard from the first
+# insert) and pauses the balancer while the load runs.
+
+DATABASE = connection.DATABASE
+
+SHARD_KEYS = {
+    'users': {'user_id': 'hashed'},
+    'water_consumption': {'user_id': 'hashed'},
+    'registered_wells': {'well_id': 'hashed'},
+    'control_activities': {'well_id': 'hashed'},
+}
+
+# Collections used as the 'from' side of a $lookup (validation and detection).
+# Before MongoDB 5.1 those must stay unsharded.
+LOOKUP_TARGETS = {'users', 'registered_wells', 'control_activities'}
+SHARDED_LOOKUP_VERSION = (5, 1)
+
+DEFAULT_CHUNKS_PER_SHARD = 4
+
+
+def server_version(client):
+    return tuple(client.server_info()['versionArray'][:2])
+
+
+def shardable_collections(client):
+    if server_version(client) >= SHARDED_LOOKUP_VERSION:
+        return list(SHARD_KEYS)
+    return [name for name in SHARD_KEYS if name not in LOOKUP_TARGETS]
+
+
+def setup_sharding(client, chunks_per_shard=DEFAULT_CHUNKS_PER_SHARD, out=print):
+    shards = client.admin.command('listShards')['shards']
+    client.admin.command('enableSharding', DATABASE)
+    collections = shardable_collections(client)
+    for name, key in SHARD_KEYS.items():
+        if name not in collections:
+            out(f"Leaving {name} unsharded: $lookup needs it unsharded before MongoDB 5.1")
+            continue
+        # Only empty collections can be pre-split, so this runs right after the reset
+        client.admin.command('shardCollection', f"{DATABASE}.{name}", key=key,
+                             numInitialChunks=len(shards) * chunks_per_shard)
+        out(f"Sharded {name} on {key} ({len(shards) * chunks_per_shard} chunks over {len(shards)} shards)")
+    return collections
+
+
+@contextmanager
+def balancer_paused(client, out=print):
+    # Chunks are already distributed; migrations during the load only compete
+    # with the inserts
+    client.admin.command('balancerStop')
+    out("Balancer stopped for the bulk load")
+    try:
+        yield
+    finally:
+        client.admin.command('balancerStart')
+        out("Balancer restarted")
+
+
+def shard_distribution(client, out=print):
+    db = client[DATABASE]
+    for name in SHARD_KEYS:
+        stats = db.command('collStats', name)
+        total = stats.get('count', 0)
+        if not stats.get('sharded'):
+            out(f"{name}: {total} docs (unsharded, primary shard {stats.get('primary', '?')})")
+            continue
+        shares = ', '.join(
+            f"{shard}: {shard_stats['count']} ({shard_stats['count'] / total * 100 if total else 0:.1f}%)"
+            for shard, shard_stats in sorted(stats['shards'].items()))
+        out(f"{name}: {total} docs [{shares}]")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shard the village collections.')
+    parser.add_argument('--chunks-per-shard', type=int, default=DEFAULT_CHUNKS_PER_SHARD,
+                        help='Initial chunks per shard for each hashed collection')
+    parser.add_argument('--status', action='store_true', help='Only print the per-shard document distribution')
+    args = parser.parse_args()
+
+    client = connection.get_client()
+    if not args.status:
+        setup_sharding(client, args.chunks_per_shard)
+    shard_distribution(client)
@@ -0,0 +1,122 @@
+from pymongo import MongoClient, ReadPreference
+import atexit
+import os
+import threading
+
+# Shared connection layer. Clients are created on first use (importing a module
+# never opens a connection), cached per profile and URI so every caller in a
+# process shares one pool, and closed at exit.
+#
+# Profiles tune a client for one kind of work:
+#   bulk_load    acknowledged by the primary only, without waiting for the
+#                journal; the loader sends large unordered batches
+#   validation   reads from secondaries when there are any, so the checks do
+#                not compete with the writes on the primaries
+#   healthcheck  direct connection to a single member with short timeouts
+#
+# Configuration comes from the environment:
+#   VILLAGE_MONGO_URI       default URI (mongodb://localhost:27017)
+#   VILLAGE_DATABASE        database name (village)
+#   VILLAGE_MAX_POOL_SIZE   connections per server for every profile
+#   VILLAGE_MIN_POOL_SIZE   connections kept open per server
+# Profile options win over options given in the URI.
+
+MONGO_URI = os.environ.get('VILLAGE_MONGO_URI', 'mongodb://localhost:27017')
+DATABASE = os.environ.get('VILLAGE_DATABASE', 'village')
+
+PROFILES = {
+    'default': {},
+    'bulk_load': {
+        'w': 1,
+        'journal': False,
+    },
+    'validation': {
+        'readPreference': 'secondaryPreferred',
+        'maxStalenessSeconds': 120,
+        'retryReads': True,
+    },
+    'healthcheck': {
+        'directConnection': True,
+        'serverSelectionTimeoutMS': 2000,
+        'connectTimeoutMS': 2000,
+        'socketTimeoutMS': 5000,
+        'maxPoolSize': 1,
+        'retryReads': False,
+    },
+}
+
+_clients = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def pool_options():
+    options = {}
+    if os.environ.get('VILLAGE_MAX_POOL_SIZE'):
+        options['maxPoolSize'] = int(os.environ['VILLAGE_MAX_POOL_SIZE'])
+    if os.environ.get('VILLAGE_MIN_POOL_SIZE'):
+        options['minPoolSize'] = int(os.environ['VILLAGE_MIN_POOL_SIZE'])
+    return options
+
+
+def client_options(profile):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown connection profile {profile!r}, expected one of {list(PROFILES)}")
+    return {**pool_options(), **PROFILES[profile]}
+
+
+def _forget_inherited_clients():
+    # A forked child inherits the parent's clients, whose sockets and monitor
+    # threads are not usable there; it starts with a fresh cache instead
+    global _pid
+    if os.getpid() != _pid:
+        _clients.clear()
+        _pid = os.getpid()
+
+
+def get_client(profile='default', uri=None):
+    uri = uri or MONGO_URI
+    with _lock:
+        _forget_inherited_clients()
+        key = (profile, uri)
+        if key not in _clients:
+            _clients[key] = MongoClient(uri, **client_options(profile))
+        return _clients[key]
+
+
+def get_database(profile='default', uri=None, name=None):
+    return get_client(profile, uri)[name or DATABASE]
+
+
+def primary(db):
+    # Same database, reading from the primary: for processes that remember how
+    # far they got (checkpoints) and must not read behind their own writes
+    return db.with_options(read_preference=ReadPreference.PRIMARY)
+
+
+def use_client(client, profiles=None, uri=None):
+    # Route profiles to an existing client, e.g. an in-process stand-in for
+    # benchmarks; it is closed like the others
+    with _lock:
+        _forget_inherited_clients()
+        for profile in profiles or PROFILES:
+            _clients[(profile, uri or MONGO_URI)] = client
+
+
+def close_client(profile='default', uri=None):
+    with _lock:
+        client = _clients.pop((profile, uri or MONGO_URI), None)
+    if client is not None:
+        client.close()
+
+
+def close_all():
+    with _lock:
+        _forget_inherited_clients()
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_all)
@@ -1,30 +1,47 @@
-from pymongo import MongoClient
 from faker import Faker
+from pymongo.collection import Collection
+import argparse
+import contextlib
+import multiprocessing
+import queue
 import random
+import threading
+import time
 import uuid
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
+import bucketing
+import cluster_setup
+import connection
+import geo
+import indexes
+import instrumentation
+import rollups
+import text_pools
+from generation_settings import CHUNK_SIZE, CONTROL_COVERAGE, FIVE_YEARS_DAYS, THIRTY_YEARS_DAYS
+
+LOCALE = 'es_ES'  # Use 'es_ES' for Spain or 'es_MX' for Mexico
+
 # Initialize Faker
-fake = Faker('es_ES')  # Use 'es_ES' for Spain or 'es_MX' for Mexico
-
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017')
-db = client['village']
-
-# Clear existing collections if any
-db.users.drop()
-db.water_consumption.drop()
-db.registered_wells.drop()
-db.control_activities.drop()
-db.demography.drop()
-
-# Collections
-users_col = db['users']
-water_consumption_col = db['water_consumption']
-registered_wells_col = db['registered_wells']
-control_activities_col = db['control_activities']
-demography_col = db['demography']
+fake = Faker(LOCALE)
+
+DEFAULT_BATCH_SIZE = 5000  # Documents per unordered insert_many
+MAX_PENDING_BATCHES = 2  # Batches queued behind the one being written
+REPORT_INTERVAL = 5  # Seconds between throughput reports
+
+
+def reset_collections(db):
+    # Clear existing collections if any
+    db.users.drop()
+    db.water_consumption.drop()
+    db.registered_wells.drop()
+    db.control_activities.drop()
+    db.demography.drop()
+    db[rollups.ROLLUP_COLLECTION].drop()
+    db[bucketing.BUCKET_COLLECTION].drop()
+    db.checkpoints.drop()  # Incremental progress refers to the old data
 
 # Helper function to convert date to datetime
 
@@ -32,156 +49,465 @@ demography_col = db['demography']
 def date_to_datetime(d):
     return datetime.combine(d, datetime.min.time())
 
+# Bulk writer: batches are handed to a background thread so the next batch is
+# built while the previous one is still on the wire. The queue is bounded, so
+# the producer blocks instead of piling up documents in memory.
+
+
+class BulkWriter:
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, max_pending=MAX_PENDING_BATCHES):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.insert_seconds = 0.0  # Time spent inside insert_many
+        # pymongo sends RawBSONDocument batches as they are (see vector_engine)
+        self.raw_bson = isinstance(collection, Collection)
+        self._batch = []
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        with instrumentation.tagged(f"load:{self.collection.name}"):
+            self._drain_batches()
+
+    def _drain_batches(self):
+        while True:
+            batch = self._pending.get()
+            if batch is None:
+                return
+            if self._error is not None:
+                continue  # Keep draining so the producer never blocks on a dead writer
+            try:
+                started = time.perf_counter()
+                self.collection.insert_many(batch, ordered=False)
+                self.insert_seconds += time.perf_counter() - started
+                self.inserted += len(batch)
+            except Exception as exc:
+                self._error = exc
+
+    def _submit(self):
+        if self._error is not None:
+            raise self._error
+        if self._batch:
+            self._pending.put(self._batch)
+            self._batch = []
+
+    def add(self, document):
+        self._batch.append(document)
+        if len(self._batch) >= self.batch_size:
+            self._submit()
+
+    def extend(self, documents):
+        for document in documents:
+            self.add(document)
+
+    def close(self):
+        try:
+            self._submit()
+        finally:
+            self._pending.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+# Periodic docs/s report; `counts` returns the inserted documents per collection
+
+
+class Progress:
+    def __init__(self, counts, interval=REPORT_INTERVAL):
+        self.counts = counts
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last_time = self.started
+        self._last_count = 0
+
+    def maybe_report(self):
+        if time.perf_counter() - self._last_time >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        now = time.perf_counter()
+        counts = self.counts()
+        count = sum(counts.values())
+        elapsed = now - self.started
+        overall_rate = count / elapsed if elapsed else 0.0
+        if final:
+            per_collection = ', '.join(f"{name}: {inserted}" for name, inserted in counts.items())
+            print(f"Inserted {count} docs in {elapsed:.1f}s ({overall_rate:,.0f} docs/s) [{per_collection}]")
+        else:
+            window = now - self._last_time
+            rate = (count - self._last_count) / window if window else 0.0
+            print(f"  {count} docs inserted, {rate:,.0f} docs/s (avg {overall_rate:,.0f} docs/s)")
+        self._last_time = now
+        self._last_count = count
+
+# Deterministic randomness: users are generated in fixed-size chunks and every
+# chunk gets its own Random/Faker seeded from (seed, chunk index). The dataset
+# therefore only depends on the seed, never on how chunks are spread over
+# workers.
+
+
+def chunk_seed(seed, chunk_index):
+    return f"{seed}:{chunk_index}"
+
+
+def random_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def days_ago(now, rng, min_days, max_days):
+    return date_to_datetime(now.date() - timedelta(days=rng.randint(min_days, max_days)))
+
 # 1. Generate Users Data
 
 
-def generate_users(num_users):
-    users = []
-    for user_id in range(1, num_users + 1):
-        registration_date = fake.date_between(
-            start_date='-5y', end_date='today')
-        user = {
-            'user_id': str(uuid.uuid4()),
-            'name': fake.name(),
-            'address': fake.address().split('\n')[0].rstrip(),
-            'registration_date': date_to_datetime(registration_date)
+def generate_users(first_index, last_index, rng, text, now):
+    for user_index in range(first_index, last_index):
+        registration_date = days_ago(now, rng, 0, FIVE_YEARS_DAYS)
+        yield {
+            'user_id': random_uuid(rng),
+            'name': text.name(rng, user_index),
+            'address': text.address(rng),
+            'registration_date': registration_date
         }
-        users.append(user)
-    users_col.insert_many(users)
-    return users
-
-def generate_registered_wells(users):
-    wells = []
-    illegal_user = random.choice(users)  # Select one user to be the illegal user
-    illegal_well_id = str(uuid.uuid4())  # Generate a unique well_id for the illegal well
 
+def generate_registered_wells(user, is_illegal_user, rng, now):
     max_lat, max_long = 42.822458, -5.593844
     min_lat, min_long = 42.788357, -5.669483
 
-    for user in users:
-
-        if user == illegal_user:  # Create the illegal well
-            illegal_well = {
-                'well_id': illegal_well_id,
-                'location': {
-                    'latitude': float(random.uniform(min_lat, max_lat)),   # Convert to float
-                    'longitude': float(random.uniform(min_long, max_long))  # Convert to float
-                },
-                'owner_user_id': illegal_user['user_id'],
-                'authorization_date': None,  # No authorization for illegal wells
-                'status': 'Inactive',
-                'last_status_change': None  # No status change date for illegal wells
-            }
-            wells.append(illegal_well)
+    if is_illegal_user:  # Create the illegal well
+        yield {
+            'well_id': random_uuid(rng),
+            # GeoJSON point: [longitude, latitude]
+            'location': geo.point(float(rng.uniform(min_lat, max_lat)), float(rng.uniform(min_long, max_long))),
+            'owner_user_id': user['user_id'],
+            'authorization_date': None,  # No authorization for illegal wells
+            'status': 'Inactive',
+            'last_status_change': None  # No status change date for illegal wells
+        }
+        return
+
+    num_wells_for_user = rng.randint(1, 10)  # Randomly assign between 1 and 10 wells per user
+    for _ in range(num_wells_for_user):
+        # Decide whether the authorization_date should be quite old
+        if rng.random() < 0.5:  # 50% chance
+            # authorization_date between '-30y' and '-5y'
+            authorization_date = days_ago(now, rng, FIVE_YEARS_DAYS, THIRTY_YEARS_DAYS)
         else:
-            num_wells_for_user = random.randint(1, 10)  # Randomly assign between 1 and 10 wells per user
-            for _ in range(num_wells_for_user):
-                # Decide whether the authorization_date should be quite old
-                if random.random() < 0.5:  # 50% chance
-                    # authorization_date between '-30y' and '-5y'
-                    authorization_date = datetime.combine(fake.date_between(start_date='-30y', end_date='-5y'), datetime.min.time())
-                else:
-                    # authorization_date between '-5y' and 'today'
-                    authorization_date = datetime.combine(fake.date_between(start_date='-5y', end_date='today'), datetime.min.time())
-                # Generate last_status_change date after authorization_date and before today
-                delta_days = (datetime.now() - authorization_date).days
-                if delta_days > 0:
-                    last_status_change_date = authorization_date + timedelta(days=random.randint(1, delta_days))
-                else:
-                    last_status_change_date = authorization_date
-
-                well = {
-                    'well_id': str(uuid.uuid4()),
-                    'location': {
-                        'latitude': float(random.uniform(min_lat, max_lat)),   # Convert to float
-                        'longitude': float(random.uniform(min_long, max_long))  # Convert to float
-                    },
-                    'owner_user_id': user['user_id'],
-                    'authorization_date': authorization_date,
-                    'status': random.choice(['Active', 'Inactive']),
-                    'last_status_change': last_status_change_date
-                }
-                wells.append(well)
-    registered_wells_col.insert_many(wells)
-    return wells, illegal_user, illegal_well  # Return the illegal_well too
+            # authorization_date between '-5y' and 'today'
+            authorization_date = days_ago(now, rng, 0, FIVE_YEARS_DAYS)
+        # Generate last_status_change date after authorization_date and before today
+        delta_days = (now - authorization_date).days
+        if delta_days > 0:
+            last_status_change_date = authorization_date + timedelta(days=rng.randint(1, delta_days))
+        else:
+            last_status_change_date = authorization_date
+
+        yield {
+            'well_id': random_uuid(rng),
+            # GeoJSON point: [longitude, latitude]
+            'location': geo.point(float(rng.uniform(min_lat, max_lat)), float(rng.uniform(min_long, max_long))),
+            'owner_user_id': user['user_id'],
+            'authorization_date': authorization_date,
+            'status': rng.choice(['Active', 'Inactive']),
+            'last_status_change': last_status_change_date
+        }
 
 # 2. Generate Water Consumption Data (with abnormal consumption for the illegal user)
 
 
-def generate_water_consumption(users, illegal_user, num_records_per_user=50):
-    consumption_records = []
-    for user in users:
-        previous_reading = random.uniform(0, 100)
-        date = datetime.now() - timedelta(days=365)
-
-        # If the user is the illegal user, give them abnormally high consumption
-        is_illegal_user = user['user_id'] == illegal_user['user_id']
-
-        for _ in range(num_records_per_user):
-            # For the illegal user, increase variation to simulate higher usage
-            consumption_increase = random.uniform(
-                0, 10) if not is_illegal_user else random.uniform(20, 50)
-            current_reading = previous_reading + consumption_increase
-            consumption = {
-                'user_id': user['user_id'],
-                'date': date,
-                'consumption_m3': current_reading - previous_reading,
-                'previous_reading': previous_reading,
-                'current_reading': current_reading,
-                'variation': current_reading - previous_reading
-            }
-            consumption_records.append(consumption)
-            previous_reading = current_reading
-            date += timedelta(days=7)  # Weekly readings
-    water_consumption_col.insert_many(consumption_records)
-    return consumption_records
-
-
-def generate_control_activities(registered_wells, illegal_well):
-    activities = []
-    # Filter out the illegal well and get 90% of the remaining wells
-    legal_wells = [well for well in registered_wells if well['well_id'] != illegal_well['well_id']]
-    num_activities = int(0.9 * len(legal_wells))  # 90% of legal wells
-
-    # Randomly choose 90% of the legal wells
-    selected_wells = random.sample(legal_wells, num_activities)
-
-    for well in selected_wells:
+def reading(user_id, date, previous_reading, current_reading):
+    return {
+        'user_id': user_id,
+        'date': date,
+        'consumption_m3': current_reading - previous_reading,
+        'previous_reading': previous_reading,
+        'current_reading': current_reading,
+        'variation': current_reading - previous_reading
+    }
+
+
+def generate_water_consumption(user, is_illegal_user, rng, now, num_records_per_user=50):
+    previous_reading = rng.uniform(0, 100)
+    date = now - timedelta(days=365)
+
+    for _ in range(num_records_per_user):
+        # For the illegal user, increase variation to simulate higher usage
+        consumption_increase = rng.uniform(
+            0, 10) if not is_illegal_user else rng.uniform(20, 50)
+        current_reading = previous_reading + consumption_increase
+        yield reading(user['user_id'], date, previous_reading, current_reading)
+        previous_reading = current_reading
+        date += timedelta(days=7)  # Weekly readings
+
+
+def generate_control_activities(wells, rng, text, now):
+    for well in wells:
+        # The illegal well is never inspected; ~90% of the legal wells are
+        if well['authorization_date'] is None or rng.random() >= CONTROL_COVERAGE:
+            continue
+
         # Ensure control activity date is after last_status_change and before today
         start_date = well['last_status_change']
-        end_date = datetime.now()
-        delta_days = (end_date - start_date).days
+        delta_days = (now - start_date).days
         if delta_days > 0:
-            control_activity_date = start_date + timedelta(days=random.randint(1, delta_days))
+            control_activity_date = start_date + timedelta(days=rng.randint(1, delta_days))
         else:
             control_activity_date = start_date
 
-        activity = {
-            'control_id': str(uuid.uuid4()),
-            'date': control_activity_date,
-            'control_type': random.choice(['Inspection', 'Verification', 'Audit']),
-            'result': random.choice(['Legal', 'No anomalies']),
-            'observations': fake.sentence(nb_words=10),
-            'well_id': well['well_id']
-        }
-        activities.append(activity)
+        yield control_activity(well['well_id'], control_activity_date, rng, text)
+
+
+def control_activity(well_id, date, rng, text):
+    return {
+        'control_id': random_uuid(rng),
+        'date': date,
+        'control_type': rng.choice(['Inspection', 'Verification', 'Audit']),
+        'result': rng.choice(['Legal', 'No anomalies']),
+        'observations': text.sentence(rng),
+        'well_id': well_id
+    }
 
-    control_activities_col.insert_many(activities)
-    return activities
+# Generation plan shared by every worker: everything that has to agree across
+# chunks is fixed up front.
 
 
-# Main execution
-if __name__ == '__main__':
-    print("Generating Users...")
-    users = generate_users(1000)
+def make_plan(num_users, num_records_per_user=50, seed=None, engine='python', text='faker', text_seed=0,
+              pool_size=text_pools.DEFAULT_POOL_SIZE, unique_names=False, consumption_layout='readings', as_of=None):
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    return {
+        'engine': engine,  # 'python' (record by record) or 'numpy' (see vector_engine)
+        'text': text,  # 'faker' (per-record calls) or 'pools' (see text_pools)
+        'text_seed': text_seed,
+        'pool_size': pool_size,
+        'unique_names': unique_names,
+        'consumption_layout': consumption_layout,  # 'readings', 'buckets' or 'both' (see bucketing)
+        'num_users': num_users,
+        'num_records_per_user': num_records_per_user,
+        'seed': seed,
+        'illegal_index': random.Random(seed).randrange(num_users),  # Exactly one illegal user
+        'now': as_of or datetime.now(),  # Every generated date is relative to it: part of the seed
+    }
+
+
+def make_text(plan, fake):
+    if plan['text'] == 'pools':
+        pools = text_pools.load_pools(LOCALE, plan['text_seed'], plan['pool_size'])
+        return text_pools.PooledText(pools, plan['unique_names'], plan['text_seed'])
+    return text_pools.FakerText(fake)
+
+
+def num_chunks(plan):
+    return (plan['num_users'] + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+def load_chunk(writers, plan, chunk_index, fake):
+    fake.seed_instance(chunk_seed(plan['seed'], chunk_index))
+    text = make_text(plan, fake)
+    if plan['engine'] == 'numpy':
+        import vector_engine  # NumPy is only needed for this engine
+        return vector_engine.load_chunk(writers, plan, chunk_index, text)
+
+    rng = random.Random(chunk_seed(plan['seed'], chunk_index))
+    now = plan['now']
+    first_index = chunk_index * CHUNK_SIZE
+    last_index = min(first_index + CHUNK_SIZE, plan['num_users'])
+
+    illegal_user = illegal_well = None
+    users = generate_users(first_index, last_index, rng, text, now)
+    for index, user in enumerate(users, start=first_index):
+        is_illegal_user = index == plan['illegal_index']
+        writers['users'].add(user)
+
+        wells = list(generate_registered_wells(user, is_illegal_user, rng, now))
+        for well in wells:
+            writers['registered_wells'].add(well)
+        if is_illegal_user:
+            illegal_user, illegal_well = user, wells[0]
+
+        readings = list(generate_water_consumption(user, is_illegal_user, rng, now, plan['num_records_per_user']))
+        if 'water_consumption' in writers:
+            writers['water_consumption'].extend(readings)
+        if bucketing.BUCKET_COLLECTION in writers:
+            writers[bucketing.BUCKET_COLLECTION].extend(bucketing.bucket_readings(readings))
+
+        for activity in generate_control_activities(wells, rng, text, now):
+            writers['control_activities'].add(activity)
+    return illegal_user, illegal_well
+
+
+def collection_names(consumption_layout='readings'):
+    return ['users', 'registered_wells'] + bucketing.LAYOUTS[consumption_layout] + ['control_activities']
+
+
+def open_writers(database, batch_size, consumption_layout='readings'):
+    return {name: BulkWriter(database[name], batch_size) for name in collection_names(consumption_layout)}
+
+
+def close_writers(writers):
+    errors = []
+    for writer in writers.values():
+        try:
+            writer.close()
+        except Exception as exc:
+            errors.append(exc)
+    if errors:
+        raise errors[0]
+    return {name: writer.inserted for name, writer in writers.items()}
+
+# Worker processes: each one owns its client and Faker instance
+
+
+_worker_db = None
+_worker_fake = None
+
+
+def _init_worker(uri, database, locale, instrument=False):
+    global _worker_db, _worker_fake
+    if instrument:
+        instrumentation.install()  # Before the worker's client exists
+    _worker_db = connection.get_database('bulk_load', uri, database)
+    _worker_fake = Faker(locale)
+
+
+def _load_chunk_in_worker(plan, chunk_index, batch_size):
+    writers = open_writers(_worker_db, batch_size, plan['consumption_layout'])
+    try:
+        illegal_user, illegal_well = load_chunk(writers, plan, chunk_index, _worker_fake)
+    finally:
+        counts = close_writers(writers)
+    metrics = instrumentation.take() if instrumentation.installed() else None
+    return counts, illegal_user, illegal_well, metrics
+
+# Streaming load: every user is expanded into its wells, readings and control
+# activities and pushed straight into the bulk writers, so memory stays bounded
+# by the batch size instead of the dataset size. With workers > 1 the chunks
+# are spread over a process pool.
+
+
+def load_village(num_users, num_records_per_user=50, batch_size=DEFAULT_BATCH_SIZE, workers=1, seed=None,
+                 engine='python', text='faker', unique_names=False, consumption_layout='readings', as_of=None):
+    if unique_names and text != 'pools':
+        raise ValueError("Unique names need the 'pools' text source")
+    plan = make_plan(num_users, num_records_per_user, seed, engine, text, unique_names=unique_names,
+                     consumption_layout=consumption_layout, as_of=as_of)
+    print(f"Seed: {plan['seed']}, as of {plan['now'].isoformat()} "
+          f"({num_chunks(plan)} chunks of {CHUNK_SIZE} users, {workers} worker(s), {engine} engine)")
+    if text == 'pools':
+        # Warm the on-disk cache once, before any worker needs it
+        pools = text_pools.load_pools(LOCALE, plan['text_seed'], plan['pool_size'])
+        if unique_names and num_users > text_pools.PooledText(pools).name_capacity:
+            raise ValueError(f"Cannot generate {num_users} unique names from the {LOCALE} text pools")
+    if workers > 1:
+        return _load_village_parallel(plan, batch_size, workers)
+
+    writers = open_writers(connection.get_database('bulk_load'), batch_size, consumption_layout)
+    progress = Progress(lambda: {name: writer.inserted for name, writer in writers.items()})
+    illegal_user = illegal_well = None
+    try:
+        for chunk_index in range(num_chunks(plan)):
+            chunk_illegal_user, chunk_illegal_well = load_chunk(writers, plan, chunk_index, fake)
+            if chunk_illegal_user is not None:
+                illegal_user, illegal_well = chunk_illegal_user, chunk_illegal_well
+            progress.maybe_report()
+    finally:
+        close_writers(writers)
+    progress.report(final=True)
+    return illegal_user, illegal_well
+
+
+def _load_village_parallel(plan, batch_size, workers):
+    totals = {name: 0 for name in collection_names(plan['consumption_layout'])}
+    progress = Progress(lambda: totals)
+    illegal_user = illegal_well = None
+    # spawn, not fork: MongoClient instances are not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(connection.MONGO_URI, connection.DATABASE, LOCALE,
+                                       instrumentation.installed())) as pool:
+        futures = [pool.submit(_load_chunk_in_worker, plan, chunk_index, batch_size)
+                   for chunk_index in range(num_chunks(plan))]
+        for future in as_completed(futures):
+            counts, chunk_illegal_user, chunk_illegal_well, metrics = future.result()
+            if metrics is not None:
+                instrumentation.merge(metrics)
+            for name, inserted in counts.items():
+                totals[name] += inserted
+            if chunk_illegal_user is not None:
+                illegal_user, illegal_well = chunk_illegal_user, chunk_illegal_well
+            progress.maybe_report()
+    progress.report(final=True)
+    return illegal_user, illegal_well
 
-    print("Generating Registered Wells Data...")
-    registered_wells, illegal_user, illegal_well = generate_registered_wells(users)  # Get the illegal well
 
-    print("Generating Water Consumption Data...")
-    water_consumption = generate_water_consumption(users, illegal_user)
-
-    print("Generating Control Activities Data...")
-    control_activities = generate_control_activities(registered_wells, illegal_well)  # Pass illegal well here
+# Main execution
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate and load the village dataset.')
+    parser.add_argument('--users', type=int, default=1000, help='Number of users to generate')
+    parser.add_argument('--readings', type=int, default=50, help='Weekly readings per user')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per bulk insert')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes generating in parallel')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for a reproducible dataset')
+    parser.add_argument('--as-of', default=None,
+                        help="ISO date-time the dataset is generated as of (default: now); reuse it with --seed "
+                             "to reproduce a dataset")
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help="Generation engine ('numpy' draws numeric fields as arrays)")
+    parser.add_argument('--text', choices=['faker', 'pools'], default='faker',
+                        help="Text source ('pools' samples cached Faker output)")
+    parser.add_argument('--unique-names', action='store_true', help='Guarantee unique user names (needs --text pools)')
+    parser.add_argument('--consumption-layout', choices=list(bucketing.LAYOUTS), default='readings',
+                        help="Store readings one per document, in monthly buckets, or both")
+    parser.add_argument('--no-indexes', action='store_true', help='Skip building the indexes after the load')
+    parser.add_argument('--sharded', action='store_true',
+                        help='Shard and pre-split the collections and pause the balancer during the load (mongos only)')
+    parser.add_argument('--chunks-per-shard', type=int, default=cluster_setup.DEFAULT_CHUNKS_PER_SHARD,
+                        help='Initial chunks per shard with --sharded')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.unique_names and args.text != 'pools':
+        parser.error("--unique-names needs --text pools (Faker names are not deduplicated)")
+
+    if instrumentation.enabled(args):
+        instrumentation.install()
+    client = connection.get_client()
+    db = connection.get_database()
+
+    print("Clearing existing collections...")
+    with instrumentation.tagged('reset'):
+        reset_collections(db)
+
+    if args.sharded:
+        print("Sharding collections...")
+        with instrumentation.tagged('sharding'):
+            cluster_setup.setup_sharding(client, args.chunks_per_shard)
+
+    print("Generating Users, Registered Wells, Water Consumption and Control Activities...")
+    with cluster_setup.balancer_paused(client) if args.sharded else contextlib.nullcontext():
+        illegal_user, illegal_well = load_village(args.users, args.readings, args.batch_size, args.workers,
+                                                 args.seed, args.engine, args.text, args.unique_names,
+                                                 args.consumption_layout,
+                                                 datetime.fromisoformat(args.as_of) if args.as_of else None)
+
+    # Indexes are built after the load: one sorted build per index is cheaper
+    # than updating every index on every insert
+    if not args.no_indexes:
+        print("Creating indexes...")
+        with instrumentation.tagged('indexes'):
+            indexes.create_indexes(db)
+
+    # The rollup is derived from the one-document-per-reading layout; buckets
+    # already carry their monthly totals
+    if 'water_consumption' in bucketing.LAYOUTS[args.consumption_layout]:
+        print("Building consumption rollup...")
+        with instrumentation.tagged('rollup'):
+            rollups.rebuild(db, grace=0)  # Every writer has finished: nothing can still commit
+
+    if args.sharded:
+        cluster_setup.shard_distribution(client)
 
     print("Data generation complete.")
+    instrumentation.write_outputs(args)
@@ -1,20 +1,60 @@
-from pymongo import MongoClient
+from pymongo import monitoring
+import argparse
 from datetime import datetime
 from bson.son import SON
+import threading
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017')
-db = client['village']
+import connection
+import detection
+import instrumentation
 
-# Collections
-users_col = db['users']
-water_consumption_col = db['water_consumption']
-registered_wells_col = db['registered_wells']
-control_activities_col = db['control_activities']
+# Time spent in database commands, accumulated per thread so concurrent checks
+# (see validation_runner) each see only their own queries. This is the round
+# trip the driver measures for each command (network included), not the
+# server's execution time.
 
-def check_last_status_change_dates():
-    print("\nChecking that 'last_status_change' dates are after 'authorization_date'...")
-    query = {
+
+class CommandTimer(monitoring.CommandListener):
+    def __init__(self):
+        self._local = threading.local()
+
+    def _add(self, event):
+        self._local.micros = getattr(self._local, 'micros', 0) + event.duration_micros
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._add(event)
+
+    def failed(self, event):
+        self._add(event)
+
+    def reset(self):
+        self._local.micros = 0
+
+    def elapsed_ms(self):
+        return getattr(self._local, 'micros', 0) / 1000
+
+
+command_timer = CommandTimer()
+monitoring.register(command_timer)  # Must happen before the client is created
+
+# The checks read through the validation profile (secondaries preferred); the
+# client is created by the first check that runs
+PROFILE = 'validation'
+
+
+def get_db():
+    return connection.get_database(PROFILE)
+
+# The checks take the database to read as `db`; by default the one above
+def check_db(db):
+    return get_db() if db is None else db
+
+# Check queries, shared with the index verification in indexes.py
+def last_status_change_query():
+    return {
         '$expr': {
             '$and': [
                 { '$ne': ["$authorization_date", None] },
@@ -22,55 +62,39 @@ def check_last_status_change_dates():
             ]
         }
     }
-    wells = list(registered_wells_col.find(query))
-    if not wells:
-        print("PASS: All 'last_status_change' dates are after 'authorization_date'.")
-    else:
-        print("FAIL: Found wells where 'last_status_change' is before 'authorization_date':")
-        for well in wells:
-            print(f" - Well ID: {well['well_id']}, Authorization Date: {well['authorization_date']}, Last Status Change: {well['last_status_change']}")
-
-def check_control_activities_coverage():
-    print("\nChecking control activities coverage (should be ~90%)...")
-    total_legal_wells = registered_wells_col.count_documents({ 'authorization_date': { '$ne': None } })
-    wells_with_activities = len(control_activities_col.distinct('well_id'))
-    coverage_percentage = (wells_with_activities / total_legal_wells) * 100 if total_legal_wells else 0
-    print(f"Total legal wells: {total_legal_wells}")
-    print(f"Wells with control activities: {wells_with_activities}")
-    print(f"Control Activities Coverage: {coverage_percentage:.2f}%")
-    if 85 <= coverage_percentage <= 95:
-        print("PASS: Control activities coverage is within expected range.")
-    else:
-        print("WARN: Control activities coverage is outside expected range.")
-
-def check_no_control_activities_for_illegal_well():
-    print("\nChecking that there are no control activities for the illegal well...")
-    illegal_well = registered_wells_col.find_one({ 'authorization_date': None })
-    if not illegal_well:
-        print("WARN: No illegal well found (no well without 'authorization_date').")
-        return
-    activities = list(control_activities_col.find({ 'well_id': illegal_well['well_id'] }))
-    if not activities:
-        print("PASS: No control activities found for the illegal well.")
-    else:
-        print("FAIL: Found control activities for the illegal well:")
-        for activity in activities:
-            print(f" - Control ID: {activity['control_id']}, Date: {activity['date']}")
-
-def check_control_activity_dates():
-    print("\nChecking that control activity dates are after 'last_status_change' and before today...")
-    pipeline = [
+
+def legal_wells_query():
+    return { 'authorization_date': { '$ne': None } }
+
+def illegal_well_query():
+    return { 'authorization_date': None }
+
+def inspected_wells_pipeline():
+    # Number of distinct wells with control activities, counted on the server
+    return [
+        { '$sort': { 'well_id': 1 } },
+        { '$group': { '_id': "$well_id" } },
+        { '$count': "wells" }
+    ]
+
+def control_activity_dates_pipeline():
+    return [
+        # Only the field the check compares is brought back from the well
         {
             '$lookup': {
                 'from': "registered_wells",
-                'localField': "well_id",
-                'foreignField': "well_id",
+                'let': { 'well_id': "$well_id" },
+                'pipeline': [
+                    { '$match': { '$expr': { '$eq': ["$well_id", "$$well_id"] } } },
+                    { '$project': { '_id': 0, 'last_status_change': 1 } }
+                ],
                 'as': "well_info"
             }
         },
         { '$unwind': "$well_info" },
         {
             '$project': {
+                '_id': 0,
                 'control_id': 1,
                 'date': 1,
                 'well_id': 1,
@@ -82,87 +106,173 @@ def check_control_activity_dates():
         },
         { '$match': { 'dateBeforeLastStatusChange': True } }
     ]
-    issues = list(control_activities_col.aggregate(pipeline))
-    if not issues:
-        print("PASS: All control activity dates are after 'last_status_change' of the wells.")
-    else:
-        print("FAIL: Found control activities with dates before 'last_status_change':")
-        for issue in issues:
-            print(f" - Control ID: {issue['control_id']}, Control Date: {issue['date']}, Last Status Change: {issue['last_status_change']}")
-
-def check_future_user_registration_dates():
-    print("\nChecking for users with 'registration_date' in the future...")
-    future_users = list(users_col.find({ 'registration_date': { '$gt': datetime.now() } }))
-    if not future_users:
-        print("PASS: No users have 'registration_date' in the future.")
-    else:
-        print("FAIL: Found users with 'registration_date' in the future:")
-        for user in future_users:
-            print(f" - User ID: {user['user_id']}, Registration Date: {user['registration_date']}")
-
-def identify_illegal_well_and_owner():
-    print("\nIdentifying the illegal well and its owner...")
-    # Step a: Identify high consumption users
-    high_consumption_users = water_consumption_col.aggregate([
-        {
-            '$group': {
-                '_id': "$user_id",
-                'totalConsumption': { '$sum': "$consumption_m3" }
-            }
-        },
-        { '$sort': { 'totalConsumption': -1 } },
-        { '$limit': 10 }  # Adjust as needed
-    ])
-    high_consumption_user_ids = [u['_id'] for u in high_consumption_users]
-
-    # Step b: Find suspect wells
-    suspect_wells = list(registered_wells_col.find({
-        'owner_user_id': { '$in': high_consumption_user_ids },
-        '$or': [
-            { 'status': "Inactive" },
-            { 'authorization_date': None }
-        ]
-    }))
-    if not suspect_wells:
-        print("No suspect wells found among high consumption users.")
-        return
-    suspect_well_ids = [w['well_id'] for w in suspect_wells]
-
-    # Step c: Filter wells with no control activities
-    wells_with_no_control_activities = []
-    for well_id in suspect_well_ids:
-        activity = control_activities_col.find_one({ 'well_id': well_id })
-        if not activity:
-            wells_with_no_control_activities.append(well_id)
-
-    # Step d: Identify the illegal well and user
-    if wells_with_no_control_activities:
-        illegal_well_id = wells_with_no_control_activities[0]
-        illegal_well = registered_wells_col.find_one({ 'well_id': illegal_well_id })
-        illegal_user = users_col.find_one({ 'user_id': illegal_well['owner_user_id'] })
-
-        print("\n=== Illegal Well and Owner Identified ===")
-        print(f"Illegal Well ID: {illegal_well['well_id']}")
-        print(f"Owner User ID: {illegal_user['user_id']}")
-        print(f"Owner Name: {illegal_user['name']}")
-        print(f"Owner Address: {illegal_user['address']}")
-    else:
-        print("No illegal well found among suspect wells.")
-
-def check_dates_in_future_in_registered_wells():
-    print("\nChecking for wells with 'last_status_change' or 'authorization_date' in the future...")
-    wells_in_future = list(registered_wells_col.find({
+
+def future_registration_query():
+    return { 'registration_date': { '$gt': datetime.now() } }
+
+def future_wells_query():
+    return {
         '$or': [
             { 'last_status_change': { '$gt': datetime.now() } },
             { 'authorization_date': { '$gt': datetime.now() } }
         ]
-    }))
-    if not wells_in_future:
-        print("PASS: No wells have dates in the future.")
-    else:
-        print("FAIL: Found wells with dates in the future:")
-        for well in wells_in_future:
-            print(f" - Well ID: {well['well_id']}, Authorization Date: {well['authorization_date']}, Last Status Change: {well['last_status_change']}")
+    }
+
+def short_names_query():
+    return { '$expr': { '$lt': [{'$strLenCP': "$name"}, 3] } }
+
+# Fields each failing check reports
+WELL_DATES_PROJECTION = { '_id': 0, 'well_id': 1, 'authorization_date': 1, 'last_status_change': 1 }
+ACTIVITY_PROJECTION = { '_id': 0, 'control_id': 1, 'date': 1 }
+REGISTRATION_PROJECTION = { '_id': 0, 'user_id': 1, 'registration_date': 1 }
+NAME_PROJECTION = { '_id': 0, 'user_id': 1, 'name': 1 }
+
+SAMPLE_SIZE = 20  # Violations printed to the console per check
+BATCH_SIZE = 1000  # Cursor batch size when streaming violations
+
+# Every check reports through `out` (print by default) and returns a result
+# dict with its outcome and number of violations. Totals are counted on the
+# server; violations are streamed with a projection to `sink` (see
+# report_sink) and only a capped sample is printed.
+def check_result(violations):
+    return {'outcome': 'FAIL' if violations else 'PASS', 'violations': violations}
+
+# `scope` narrows a per-document check to a subset of its collection (for
+# example the documents added since the last run, see incremental_validation)
+def scoped(query, scope):
+    return { '$and': [scope, query] } if scope else query
+
+def scoped_pipeline(pipeline, scope):
+    return [{ '$match': scope }] + pipeline if scope else pipeline
+
+def report_violations(check, cursor, total, describe, out, sink):
+    shown = 0
+    for doc in cursor:
+        if sink is not None:
+            sink.write(check, doc)
+        if shown < SAMPLE_SIZE:
+            out(describe(doc))
+            shown += 1
+    if total > shown:
+        out(f" ... and {total - shown} more")
+
+def find_violations(collection, query, projection, sink):
+    cursor = collection.find(query, projection, batch_size=BATCH_SIZE)
+    if sink is None:
+        cursor = cursor.limit(SAMPLE_SIZE)  # Nothing to do with the rest
+    return cursor
+
+def count_pipeline(collection, pipeline):
+    counted = list(collection.aggregate(pipeline + [{ '$count': "total" }], allowDiskUse=True))
+    return counted[0]['total'] if counted else 0
+
+def aggregate_violations(collection, pipeline, sink):
+    if sink is None:
+        pipeline = pipeline + [{ '$limit': SAMPLE_SIZE }]
+    return collection.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE)
+
+# What each check prints: its heading, its PASS and FAIL lines and one line per
+# violation. Shared with the offline engine (offline_validation.py), whose output
+# --verify-online compares with this one.
+def describe_well_dates(well):
+    return f" - Well ID: {well['well_id']}, Authorization Date: {well['authorization_date']}, Last Status Change: {well['last_status_change']}"
+
+def describe_activity(activity):
+    return f" - Control ID: {activity['control_id']}, Date: {activity['date']}"
+
+def describe_activity_dates(issue):
+    return f" - Control ID: {issue['control_id']}, Control Date: {issue['date']}, Last Status Change: {issue['last_status_change']}"
+
+def describe_registration(user):
+    return f" - User ID: {user['user_id']}, Registration Date: {user['registration_date']}"
+
+def describe_name(user):
+    return f" - User ID: {user['user_id']}, Name: {user['name']}"
+
+CHECK_MESSAGES = {
+    'last_status_change_dates': {
+        'heading': "Checking that 'last_status_change' dates are after 'authorization_date'...",
+        'pass': "PASS: All 'last_status_change' dates are after 'authorization_date'.",
+        'fail': "FAIL: Found wells where 'last_status_change' is before 'authorization_date':",
+        'describe': describe_well_dates
+    },
+    'control_activities_coverage': {
+        'heading': "Checking control activities coverage (should be ~90%)...",
+        'pass': "PASS: Control activities coverage is within expected range.",
+        'warn': "WARN: Control activities coverage is outside expected range."
+    },
+    'no_control_activities_for_illegal_well': {
+        'heading': "Checking that there are no control activities for the illegal well...",
+        'pass': "PASS: No control activities found for the illegal well.",
+        'fail': "FAIL: Found control activities for the illegal well:",
+        'warn': "WARN: No illegal well found (no well without 'authorization_date').",
+        'describe': describe_activity
+    },
+    'control_activity_dates': {
+        'heading': "Checking that control activity dates are after 'last_status_change' and before today...",
+        'pass': "PASS: All control activity dates are after 'last_status_change' of the wells.",
+        'fail': "FAIL: Found control activities with dates before 'last_status_change':",
+        'describe': describe_activity_dates
+    },
+    'future_user_registration_dates': {
+        'heading': "Checking for users with 'registration_date' in the future...",
+        'pass': "PASS: No users have 'registration_date' in the future.",
+        'fail': "FAIL: Found users with 'registration_date' in the future:",
+        'describe': describe_registration
+    },
+    'dates_in_future_in_registered_wells': {
+        'heading': "Checking for wells with 'last_status_change' or 'authorization_date' in the future...",
+        'pass': "PASS: No wells have dates in the future.",
+        'fail': "FAIL: Found wells with dates in the future:",
+        'describe': describe_well_dates
+    },
+    'names_length': {
+        'heading': "Checking for users with names shorter than 3 characters...",
+        'pass': "PASS: No users have names shorter than 3 characters.",
+        'fail': "FAIL: Found users with names shorter than 3 characters:",
+        'describe': describe_name
+    },
+    'illegal_well_and_owner': {
+        'heading': "Identifying the illegal well and its owner...",
+        'warn': "No illegal well found among high consumption users."
+    },
+}
+
+def start_check(check, out):
+    out(f"\n{CHECK_MESSAGES[check]['heading']}")
+
+def report_check(check, total, violations, out, sink):
+    # Outcome of a per-document check with `total` violations; `violations`
+    # opens the cursor over them, only when there are any
+    messages = CHECK_MESSAGES[check]
+    if not total:
+        out(messages['pass'])
+        return check_result(0)
+    out(messages['fail'])
+    report_violations(check, violations(), total, messages['describe'], out, sink)
+    return check_result(total)
+
+def report_coverage(total_legal_wells, wells_with_activities, out):
+    messages = CHECK_MESSAGES['control_activities_coverage']
+    coverage_percentage = (wells_with_activities / total_legal_wells) * 100 if total_legal_wells else 0
+    out(f"Total legal wells: {total_legal_wells}")
+    out(f"Wells with control activities: {wells_with_activities}")
+    out(f"Control Activities Coverage: {coverage_percentage:.2f}%")
+    in_range = 85 <= coverage_percentage <= 95
+    out(messages['pass'] if in_range else messages['warn'])
+    return {
+        'outcome': 'PASS' if in_range else 'WARN',
+        'violations': 0,
+        'details': {
+            'total_legal_wells': total_legal_wells,
+            'wells_with_activities': wells_with_activities,
+            'coverage_percentage': coverage_percentage
+        }
+    }
+
+def report_no_illegal_well(out):
+    out(CHECK_MESSAGES['no_control_activities_for_illegal_well']['warn'])
+    return {'outcome': 'WARN', 'violations': 0}
 
 def extract_first_syllable(name):
     # Split the full name into parts (first name and surnames)
@@ -180,81 +290,135 @@ def extract_first_syllable(name):
     # Join the syllables into a single string separated by a space
     return ''.join(first_syllables)
 
-def check_names_length():
-    print("\nChecking for users with names shorter than 3 characters...")
-    short_names = list(users_col.find({ '$expr': { '$lt': [{'$strLenCP': "$name"}, 3] } }))
-    if not short_names:
-        print("PASS: No users have names shorter than 3 characters.")
-    else:
-        print("FAIL: Found users with names shorter than 3 characters:")
-        for user in short_names:
-            print(f" - User ID: {user['user_id']}, Name: {user['name']}")
-
-def identify_illegal_well_and_owner():
-    print("\nIdentifying the illegal well and its owner...")
-    # Step a: Identify high consumption users
-    high_consumption_users = water_consumption_col.aggregate([
-        {
-            '$group': {
-                '_id': "$user_id",
-                'totalConsumption': { '$sum': "$consumption_m3" }
-            }
-        },
-        { '$sort': { 'totalConsumption': -1 } },
-        { '$limit': 10 }  # Adjust as needed
-    ])
-    high_consumption_user_ids = [u['_id'] for u in high_consumption_users]
-
-    # Step b: Find suspect wells
-    suspect_wells = list(registered_wells_col.find({
-        'owner_user_id': { '$in': high_consumption_user_ids },
-        '$or': [
-            { 'status': "Inactive" },
-            { 'authorization_date': None }
-        ]
-    }))
-    if not suspect_wells:
-        print("No suspect wells found among high consumption users.")
-        return
-    suspect_well_ids = [w['well_id'] for w in suspect_wells]
-
-    # Step c: Filter wells with no control activities
-    wells_with_no_control_activities = []
-    for well_id in suspect_well_ids:
-        activity = control_activities_col.find_one({ 'well_id': well_id })
-        if not activity:
-            wells_with_no_control_activities.append(well_id)
-
-    # Step d: Identify the illegal well and user
-    if wells_with_no_control_activities:
-        illegal_well_id = wells_with_no_control_activities[0]
-        illegal_well = registered_wells_col.find_one({ 'well_id': illegal_well_id })
-        illegal_user = users_col.find_one({ 'user_id': illegal_well['owner_user_id'] })
-
-        first_syllable = extract_first_syllable(illegal_user['name'])
-
-        print("\n=== Illegal Well and Owner Identified ===")
-        print(f"Illegal Well ID: {illegal_well['well_id']}")
-        print(f"Owner User ID: {illegal_user['user_id']}")
-        print(f"Owner Name: {illegal_user['name']}")
-        print(f"Owner Address: {illegal_user['address']}")
-        print(f"Solution (First syllable of owner name in caps): {first_syllable}")
-    else:
-        print("No illegal well found among suspect wells.")
+def report_detection(candidates, out, sink):
+    # Outcome of the illegal well detection, online or offline
+    if not candidates:
+        out(CHECK_MESSAGES['illegal_well_and_owner']['warn'])
+        return {'outcome': 'WARN', 'violations': 0, 'details': {'candidates': []}}
+
+    if sink is not None:
+        for candidate in candidates:
+            sink.write('illegal_well_and_owner', candidate)
+    best = candidates[0]
+    first_syllable = extract_first_syllable(best['owner_name'] or '')
+
+    out("\n=== Illegal Well and Owner Identified ===")
+    out(f"Illegal Well ID: {best['well_id']}")
+    out(f"Owner User ID: {best['owner_user_id']}")
+    out(f"Owner Name: {best['owner_name']}")
+    out(f"Owner Address: {best['owner_address']}")
+    out(f"Consumption: {best['evidence']['total_consumption']:.1f} m3 (z-score {best['evidence']['z_score']:.2f})")
+    if 'nearby_wells' in best['evidence']:
+        out(f"Wells within {best['evidence']['radius_m']:.0f} m: {best['evidence']['nearby_wells']} "
+            f"({best['evidence']['nearby_owner_wells']} of the same owner)")
+    out(f"Solution (First syllable of owner name in caps): {first_syllable}")
+    if len(candidates) > 1:
+        out(f"Other candidates: {len(candidates) - 1}")
+    return {
+        'outcome': 'PASS',
+        'violations': 0,
+        'details': {
+            'well_id': best['well_id'],
+            'owner_user_id': best['owner_user_id'],
+            'solution': first_syllable,
+            'candidates': candidates
+        }
+    }
+
+# The checks
+
+def check_last_status_change_dates(out=print, sink=None, scope=None, db=None):
+    start_check('last_status_change_dates', out)
+    db = check_db(db)
+    query = scoped(last_status_change_query(), scope)
+    total = db.registered_wells.count_documents(query)
+    return report_check('last_status_change_dates', total,
+                        lambda: find_violations(db.registered_wells, query, WELL_DATES_PROJECTION, sink), out, sink)
+
+def check_control_activities_coverage(out=print, sink=None, db=None):
+    start_check('control_activities_coverage', out)
+    db = check_db(db)
+    total_legal_wells = db.registered_wells.count_documents(legal_wells_query())
+    counted = list(db.control_activities.aggregate(inspected_wells_pipeline(), allowDiskUse=True))
+    return report_coverage(total_legal_wells, counted[0]['wells'] if counted else 0, out)
+
+def check_no_control_activities_for_illegal_well(out=print, sink=None, db=None):
+    start_check('no_control_activities_for_illegal_well', out)
+    db = check_db(db)
+    illegal_well = db.registered_wells.find_one(illegal_well_query(), { '_id': 0, 'well_id': 1 })
+    if not illegal_well:
+        return report_no_illegal_well(out)
+    query = { 'well_id': illegal_well['well_id'] }
+    total = db.control_activities.count_documents(query)
+    return report_check('no_control_activities_for_illegal_well', total,
+                        lambda: find_violations(db.control_activities, query, ACTIVITY_PROJECTION, sink), out, sink)
+
+def check_control_activity_dates(out=print, sink=None, scope=None, db=None):
+    start_check('control_activity_dates', out)
+    db = check_db(db)
+    pipeline = scoped_pipeline(control_activity_dates_pipeline(), scope)
+    total = count_pipeline(db.control_activities, pipeline)
+    return report_check('control_activity_dates', total,
+                        lambda: aggregate_violations(db.control_activities, pipeline, sink), out, sink)
+
+def check_future_user_registration_dates(out=print, sink=None, scope=None, db=None):
+    start_check('future_user_registration_dates', out)
+    db = check_db(db)
+    query = scoped(future_registration_query(), scope)
+    total = db.users.count_documents(query)
+    return report_check('future_user_registration_dates', total,
+                        lambda: find_violations(db.users, query, REGISTRATION_PROJECTION, sink), out, sink)
+
+def check_dates_in_future_in_registered_wells(out=print, sink=None, scope=None, db=None):
+    start_check('dates_in_future_in_registered_wells', out)
+    db = check_db(db)
+    query = scoped(future_wells_query(), scope)
+    total = db.registered_wells.count_documents(query)
+    return report_check('dates_in_future_in_registered_wells', total,
+                        lambda: find_violations(db.registered_wells, query, WELL_DATES_PROJECTION, sink), out, sink)
+
+def check_names_length(out=print, sink=None, scope=None, db=None):
+    start_check('names_length', out)
+    db = check_db(db)
+    query = scoped(short_names_query(), scope)
+    total = db.users.count_documents(query)
+    return report_check('names_length', total,
+                        lambda: find_violations(db.users, query, NAME_PROJECTION, sink), out, sink)
+
+def identify_illegal_well_and_owner(out=print, sink=None, top_n=detection.DEFAULT_TOP_N, min_z=detection.DEFAULT_MIN_Z,
+                                    source=detection.DEFAULT_SOURCE, db=None):
+    start_check('illegal_well_and_owner', out)
+    # One server-side pipeline: consumption outliers (z-score), their
+    # uninspected suspect wells and owners, ranked. Totals come from the
+    # monthly rollup by default, as of its last refresh (detection.refresh_source).
+    candidates = detection.detect_illegal_wells(check_db(db), top_n, min_z, source)
+    return report_detection(candidates, out, sink)
 
 def main():
+    parser = argparse.ArgumentParser(description='Validate the village data and find the illegal well.')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if instrumentation.enabled(args):
+        instrumentation.install()
+
     print("Starting data validation and analysis...\n")
+    detection.refresh_source(get_db())
 
-    check_last_status_change_dates()
-    check_control_activities_coverage()
-    check_no_control_activities_for_illegal_well()
-    check_control_activity_dates()
-    check_future_user_registration_dates()
-    check_dates_in_future_in_registered_wells()
-    check_names_length()  # New validation step for name length
-    identify_illegal_well_and_owner()
+    for check in [
+        check_last_status_change_dates,
+        check_control_activities_coverage,
+        check_no_control_activities_for_illegal_well,
+        check_control_activity_dates,
+        check_future_user_registration_dates,
+        check_dates_in_future_in_registered_wells,
+        check_names_length,  # New validation step for name length
+        identify_illegal_well_and_owner,
+    ]:
+        with instrumentation.tagged(check.__name__):
+            check()
 
     print("\nData validation and analysis complete.")
+    instrumentation.write_outputs(args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,53 +1,211 @@
-import pymongo
+import argparse
+import random
+import sys
+import time
 
-def check_repl_initialized(name, host, port):
+from concurrent.futures import ThreadPoolExecutor
+
+import connection
+import instrumentation
+
+# Cluster readiness probe: every replica set and mongos is probed concurrently,
+# each probe retried with exponential backoff. Besides "is it up", each replica
+# set reports the round trip to the probed member, the ping times it sees to
+# the other members and how far every secondary is behind the primary
+# (replSetGetStatus optimes), so a bulk load can wait for the secondaries to
+# catch up. With --wait the probe repeats until the cluster is ready or the
+# deadline passes; the exit status says which.
+
+SERVICES = [
+    {'name': 'Config Server Replica Set', 'host': 'mongo-config', 'port': 27017},
+    {'name': 'Shard Alpha Replica Set', 'host': 'shard-alpha', 'port': 27018},
+    {'name': 'Shard Beta Replica Set', 'host': 'shard-beta', 'port': 27019},
+    {'name': 'Shard Charlie Replica Set', 'host': 'shard-charlie', 'port': 27020},
+]
+MONGOS = {'name': 'Mongos', 'host': 'mongos', 'port': 27017}
+EXPECTED_SHARDS = 3
+
+DEFAULT_ATTEMPTS = 3  # Tries per probe and round
+BACKOFF_BASE = 0.25  # Seconds before the first retry, doubled on each one
+BACKOFF_MAX = 5.0
+
+
+def service_uri(service):
+    return f"mongodb://{service['host']}:{service['port']}"
+
+
+def backoff(attempt):
+    # Full jitter, so probes that failed together do not retry together
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def with_retry(probe, service, attempts=DEFAULT_ATTEMPTS, deadline=None):
+    result = None
+    for attempt in range(attempts):
+        result = probe(service)
+        if result['ok']:
+            return result
+        pause = backoff(attempt)
+        if attempt == attempts - 1 or (deadline is not None and time.monotonic() + pause >= deadline):
+            break
+        time.sleep(pause)
+    return result
+
+
+def short_error(exc):
+    # Server selection errors append the whole topology description
+    return str(exc).split(', Timeout:')[0]
+
+
+def ping(client):
+    started = time.perf_counter()
+    client.admin.command('ping')
+    return (time.perf_counter() - started) * 1000
+
+# Probes; each returns {'name', 'ok', 'rtt_ms', 'error', ...} and never raises
+
+
+def replication_lag(members):
+    primary = next((member for member in members if member['stateStr'] == 'PRIMARY'), None)
+    lags = []
+    for member in members:
+        lag = None
+        if primary is not None and member['stateStr'] == 'SECONDARY' and member.get('optimeDate'):
+            lag = max(0.0, (primary['optimeDate'] - member['optimeDate']).total_seconds())
+        lags.append({
+            'host': member['name'],
+            'state': member['stateStr'],
+            'healthy': member.get('health') == 1,
+            'lag_s': lag,
+            'ping_ms': member.get('pingMs'),  # As seen by the probed member; absent for itself
+        })
+    return primary is not None, lags
+
+
+def check_repl_initialized(service):
+    result = {'name': service['name'], 'ok': False, 'rtt_ms': None, 'error': None, 'members': [], 'max_lag_s': None}
     try:
-        client = pymongo.MongoClient(host=host, port=port, serverSelectionTimeoutMS=2000)
-        result = client.admin.command('replSetGetStatus')
-        if result.get('ok') == 1:
-            return True
-        else:
-            return False
-    except Exception:
-        return False
+        client = connection.get_client('healthcheck', service_uri(service))
+        result['rtt_ms'] = ping(client)
+        status = client.admin.command('replSetGetStatus')
+        has_primary, members = replication_lag(status['members'])
+        lags = [member['lag_s'] for member in members if member['lag_s'] is not None]
+        result.update({
+            'set': status.get('set'),
+            'members': members,
+            'max_lag_s': max(lags) if lags else 0.0,
+            'ok': has_primary,
+            'error': None if has_primary else 'no primary elected yet'
+        })
+    except Exception as exc:
+        result['error'] = short_error(exc)
+    return result
+
 
-def check_shards_added(host, port):
+def check_shards_added(service, expected=EXPECTED_SHARDS):
+    result = {'name': service['name'], 'ok': False, 'rtt_ms': None, 'error': None, 'shards': 0}
     try:
-        client = pymongo.MongoClient(host=host, port=port, serverSelectionTimeoutMS=2000)
-        result = client.admin.command('listShards')
-        shards = result.get('shards', [])
-        if len(shards) >= 3:
-            return True
-        else:
-            return False
-    except Exception:
+        client = connection.get_client('healthcheck', service_uri(service))
+        result['rtt_ms'] = ping(client)
+        result['shards'] = len(client.admin.command('listShards').get('shards', []))
+        result['ok'] = result['shards'] >= expected
+        if not result['ok']:
+            result['error'] = f"{result['shards']}/{expected} shards added"
+    except Exception as exc:
+        result['error'] = short_error(exc)
+    return result
+
+# One round of concurrent probes
+
+
+def probe_tagged(probe, service, attempts, deadline):
+    with instrumentation.tagged(f"healthcheck:{service['host']}"):
+        return with_retry(probe, service, attempts, deadline)
+
+
+def probe_cluster(services=SERVICES, mongos=MONGOS, attempts=DEFAULT_ATTEMPTS, deadline=None):
+    with ThreadPoolExecutor(max_workers=len(services) + 1) as pool:
+        replsets = [pool.submit(probe_tagged, check_repl_initialized, service, attempts, deadline)
+                    for service in services]
+        shards = pool.submit(probe_tagged, check_shards_added, mongos, attempts, deadline)
+        return [future.result() for future in replsets], shards.result()
+
+
+def is_ready(replsets, shards, max_lag=None):
+    if not shards['ok'] or not all(result['ok'] for result in replsets):
         return False
+    if max_lag is None:
+        return True
+    return all(result['max_lag_s'] <= max_lag for result in replsets)
 
-def main():
-    services = [
-        {'name': 'Config Server Replica Set', 'host': 'mongo-config', 'port': 27017},
-        {'name': 'Shard Alpha Replica Set', 'host': 'shard-alpha', 'port': 27018},
-        {'name': 'Shard Beta Replica Set', 'host': 'shard-beta', 'port': 27019},
-        {'name': 'Shard Charlie Replica Set', 'host': 'shard-charlie', 'port': 27020},
-    ]
-    
-    results = []
-    
-    for service in services:
-        initialized = check_repl_initialized(service['name'], service['host'], service['port'])
-        results.append({'name': service['name'], 'status': initialized})
-        
-    # Check if shards are added to mongos
-    shards_added = check_shards_added('mongos', 27017)
-    
-    # Output the results
+
+def print_report(replsets, shards, max_lag=None):
     print("Cluster Setup Checklist:")
-    for result in results:
-        status = '[✓]' if result['status'] else '[x]'
-        print(f"{status} {result['name']} initialized")
-        
-    status = '[✓]' if shards_added else '[x]'
-    print(f"{status} Shards added to the cluster")
-    
+    for result in replsets:
+        status = '[✓]' if result['ok'] else '[x]'
+        rtt = f"{result['rtt_ms']:.1f} ms" if result['rtt_ms'] is not None else '-'
+        line = f"{status} {result['name']} initialized (rtt {rtt}"
+        if result['max_lag_s'] is not None:
+            lagging = max_lag is not None and result['max_lag_s'] > max_lag
+            line += f", max lag {result['max_lag_s']:.1f} s{' > ' + str(max_lag) + ' s' if lagging else ''}"
+        print(line + ")")
+        if result['error']:
+            print(f"      {result['error']}")
+        for member in result['members']:
+            lag = f"{member['lag_s']:.1f} s" if member['lag_s'] is not None else '-'
+            member_ping = f"{member['ping_ms']} ms" if member['ping_ms'] is not None else '-'
+            print(f"      {member['host']:<24} {member['state']:<10} lag {lag:<8} ping {member_ping}")
+
+    status = '[✓]' if shards['ok'] else '[x]'
+    rtt = f"{shards['rtt_ms']:.1f} ms" if shards['rtt_ms'] is not None else '-'
+    print(f"{status} Shards added to the cluster ({shards['shards']}/{EXPECTED_SHARDS}, rtt {rtt})")
+    if shards['error'] and shards['shards'] == 0:
+        print(f"      {shards['error']}")
+
+
+def wait_until_ready(deadline_s, max_lag=None, attempts=DEFAULT_ATTEMPTS, out=print):
+    # Rounds of probes until everything is ready or the deadline passes;
+    # returns the last round and whether it was ready
+    deadline = time.monotonic() + deadline_s
+    round_number = 0
+    while True:
+        replsets, shards = probe_cluster(attempts=attempts, deadline=deadline)
+        ready = is_ready(replsets, shards, max_lag)
+        remaining = deadline - time.monotonic()
+        if ready or remaining <= 0:
+            return replsets, shards, ready
+        pending = [result['name'] for result in replsets + [shards] if not result['ok']] or ['replication lag']
+        out(f"Not ready yet ({', '.join(pending)}), {remaining:.0f}s left")
+        time.sleep(min(remaining, backoff(round_number) + BACKOFF_BASE))
+        round_number += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the sharded cluster is up and replicated.')
+    parser.add_argument('--wait', type=float, default=None, metavar='SECONDS',
+                        help='Keep probing until the cluster is ready or this many seconds have passed')
+    parser.add_argument('--max-lag', type=float, default=None, metavar='SECONDS',
+                        help='Only report ready once every secondary is at most this far behind its primary')
+    parser.add_argument('--attempts', type=int, default=DEFAULT_ATTEMPTS, help='Tries per probe and round')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if instrumentation.enabled(args):
+        instrumentation.install()
+
+    started = time.monotonic()
+    if args.wait is not None:
+        replsets, shards, ready = wait_until_ready(args.wait, args.max_lag, args.attempts)
+    else:
+        replsets, shards = probe_cluster(attempts=args.attempts)
+        ready = is_ready(replsets, shards, args.max_lag)
+
+    print_report(replsets, shards, args.max_lag)
+    print(f"Cluster {'ready' if ready else 'NOT ready'} after {time.monotonic() - started:.1f}s")
+    instrumentation.write_outputs(args)
+    connection.close_all()
+    return 0 if ready else 1
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import argparse
+
+import bucketing
+import connection
+import geo
+import rollups
+
+# Illegal-well detection engine: a single aggregation over the per-user
+# consumption totals (from the raw readings, the monthly rollup or the bucketed
+# layout, see rollups.py and bucketing.py) that scores every user against the population (z-score),
+# keeps the strongest outliers and joins their suspect wells, control
+# activities and owner on the server. $lookup sub-pipelines stop at the first
+# match, so the whole detection is one round trip whatever the data size. The
+# wells around each candidate (geo.spatial_evidence, one indexed $geoWithin per
+# candidate) are added to its evidence afterwards.
+
+DEFAULT_TOP_N = 10  # Highest consumers considered
+DEFAULT_MIN_Z = 2.0  # Minimum z-score for a consumer to be a candidate
+DEFAULT_SOURCE = 'auto'  # Buckets when they are the only layout loaded, else the rollup
+
+
+def consumption_totals_stages():
+    # Total consumption per user, as {_id: user_id, total}
+    return [
+        {
+            '$group': {
+                '_id': "$user_id",
+                'total': { '$sum': "$consumption_m3" }
+            }
+        }
+    ]
+
+
+def detection_pipeline(top_n=DEFAULT_TOP_N, min_z=DEFAULT_MIN_Z, totals_stages=None):
+    if totals_stages is None:
+        totals_stages = consumption_totals_stages()
+    return totals_stages + [
+        # Population statistics and the top consumers in one pass
+        {
+            '$facet': {
+                'stats': [
+                    {
+                        '$group': {
+                            '_id': None,
+                            'mean': { '$avg': "$total" },
+                            'std': { '$stdDevPop': "$total" },
+                            'users': { '$sum': 1 }
+                        }
+                    }
+                ],
+                'top': [
+                    { '$sort': { 'total': -1 } },
+                    { '$limit': top_n }
+                ]
+            }
+        },
+        { '$unwind': "$stats" },
+        { '$unwind': "$top" },
+        {
+            '$project': {
+                '_id': 0,
+                'user_id': "$top._id",
+                'total_consumption': "$top.total",
+                'population_mean': "$stats.mean",
+                'population_std': "$stats.std",
+                'population_users': "$stats.users",
+                'z_score': {
+                    '$cond': [
+                        { '$gt': ["$stats.std", 0] },
+                        { '$divide': [{ '$subtract': ["$top.total", "$stats.mean"] }, "$stats.std"] },
+                        0
+                    ]
+                }
+            }
+        },
+        { '$match': { 'z_score': { '$gte': min_z } } },
+        # Suspect wells of each outlier (inactive or never authorized) that were
+        # never inspected; the inner lookup only needs to find one activity
+        {
+            '$lookup': {
+                'from': "registered_wells",
+                'let': { 'user_id': "$user_id" },
+                'pipeline': [
+                    { '$match': { '$expr': { '$eq': ["$owner_user_id", "$$user_id"] } } },
+                    { '$match': { '$or': [{ 'status': "Inactive" }, { 'authorization_date': None }] } },
+                    {
+                        '$lookup': {
+                            'from': "control_activities",
+                            'let': { 'well_id': "$well_id" },
+                            'pipeline': [
+                                { '$match': { '$expr': { '$eq': ["$well_id", "$$well_id"] } } },
+                                { '$limit': 1 },
+                                { '$project': { '_id': 1 } }
+                            ],
+                            'as': "controls"
+                        }
+                    },
+                    { '$match': { 'controls': { '$size': 0 } } },
+                    {
+                        '$project': {
+                            '_id': 0,
+                            'well_id': 1,
+                            'status': 1,
+                            'authorization_date': 1,
+                            'last_status_change': 1,
+                            'location': 1
+                        }
+                    }
+                ],
+                'as': "suspect_wells"
+            }
+        },
+        { '$unwind': "$suspect_wells" },
+        {
+            '$lookup': {
+                'from': "users",
+                'let': { 'user_id': "$user_id" },
+                'pipeline': [
+                    { '$match': { '$expr': { '$eq': ["$user_id", "$$user_id"] } } },
+                    { '$limit': 1 },
+                    { '$project': { '_id': 0, 'name': 1, 'address': 1 } }
+                ],
+                'as': "owner"
+            }
+        },
+        { '$unwind': { 'path': "$owner", 'preserveNullAndEmptyArrays': True } },
+        {
+            '$addFields': {
+                'unauthorized': { '$eq': [{ '$ifNull': ["$suspect_wells.authorization_date", None] }, None] }
+            }
+        },
+        # Unauthorized wells first, then by how extreme the consumption is
+        { '$sort': { 'unauthorized': -1, 'z_score': -1 } }
+    ]
+
+
+def to_candidate(rank, doc):
+    well = doc['suspect_wells']
+    owner = doc.get('owner') or {}
+    return {
+        'rank': rank,
+        'well_id': well['well_id'],
+        'owner_user_id': doc['user_id'],
+        'owner_name': owner.get('name'),
+        'owner_address': owner.get('address'),
+        'location': well.get('location'),
+        'score': doc['z_score'],
+        'evidence': {
+            'total_consumption': doc['total_consumption'],
+            'z_score': doc['z_score'],
+            'population_mean': doc['population_mean'],
+            'population_std': doc['population_std'],
+            'population_users': doc['population_users'],
+            'unauthorized': doc['unauthorized'],
+            'status': well.get('status'),
+            'authorization_date': well.get('authorization_date'),
+            'last_status_change': well.get('last_status_change'),
+            'control_activities': 0,
+        },
+    }
+
+
+# Where per-user totals come from: the raw readings, the monthly rollup or the
+# bucketed layout
+SOURCES = {
+    'raw': ('water_consumption', consumption_totals_stages),
+    'rollup': (rollups.ROLLUP_COLLECTION, rollups.user_totals_stages),
+    'buckets': (bucketing.BUCKET_COLLECTION, bucketing.user_totals_stages),
+}
+
+
+def resolve_source(db, source):
+    if source != 'auto':
+        return source
+    return 'buckets' if bucketing.loaded_layout(db) == 'buckets' else 'rollup'
+
+
+def refresh_source(db, source=DEFAULT_SOURCE, out=print):
+    # Bring the rollup up to date before detection reads it. A separate step,
+    # run by the scripts before their checks: the refresh writes on the primary
+    # and can take a while after a large load, which no check should pay for.
+    source = resolve_source(db, source)
+    if source == 'rollup':
+        rollups.refresh(db, out)
+    return source
+
+
+def detect_illegal_wells(db, top_n=DEFAULT_TOP_N, min_z=DEFAULT_MIN_Z, source=DEFAULT_SOURCE,
+                         radius_m=geo.DEFAULT_RADIUS_M):
+    source = resolve_source(db, source)
+    collection, totals_stages = SOURCES[source]
+    source_db = db
+    if source == 'rollup':
+        # Refreshed on the primary (refresh_source); a secondary may not have it yet
+        source_db = connection.primary(db)
+    pipeline = detection_pipeline(top_n, min_z, totals_stages())
+    cursor = source_db[collection].aggregate(pipeline, allowDiskUse=True)
+    candidates = [to_candidate(rank, doc) for rank, doc in enumerate(cursor, start=1)]
+    return geo.spatial_evidence(db, candidates, radius_m) if radius_m else candidates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank illegal well candidates.')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_N, help='Highest consumers considered')
+    parser.add_argument('--min-z', type=float, default=DEFAULT_MIN_Z, help='Minimum consumption z-score')
+    parser.add_argument('--source', choices=['auto'] + list(SOURCES), default=DEFAULT_SOURCE,
+                        help='Read consumption totals from the raw readings, the monthly rollup or the buckets')
+    parser.add_argument('--radius', type=float, default=geo.DEFAULT_RADIUS_M,
+                        help='Radius in metres for the nearby wells evidence (0 to skip)')
+    args = parser.parse_args()
+
+    db = connection.get_database('validation')
+    source = refresh_source(db, args.source)
+    for candidate in detect_illegal_wells(db, args.top, args.min_z, source, radius_m=args.radius):
+        evidence = candidate['evidence']
+        nearby = f", nearby wells={evidence['nearby_wells']} ({evidence['nearby_owner_wells']} same owner)" \
+            if 'nearby_wells' in evidence else ''
+        print(f"#{candidate['rank']} well {candidate['well_id']} owner {candidate['owner_user_id']} "
+              f"({candidate['owner_name']}): z={evidence['z_score']:.2f}, "
+              f"total={evidence['total_consumption']:.1f} m3, unauthorized={evidence['unauthorized']}{nearby}")
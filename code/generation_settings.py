@@ -0,0 +1,8 @@
+# Dataset parameters shared by the two generation engines (data_generation.py
+# and vector_engine.py). They live apart from data_generation so the NumPy
+# engine can import them without importing the script that loads it.
+
+CHUNK_SIZE = 1000  # Users per deterministic generation chunk
+CONTROL_COVERAGE = 0.9  # Share of legal wells that get a control activity
+FIVE_YEARS_DAYS = 5 * 365
+THIRTY_YEARS_DAYS = 30 * 365
@@ -0,0 +1,214 @@
+from pymongo import GEOSPHERE, IndexModel
+import argparse
+import math
+import time
+
+import numpy as np
+
+import connection
+
+# Geospatial helpers. Well locations are GeoJSON points ([longitude, latitude])
+# with a 2dsphere index, so the server answers radius questions ($geoWithin /
+# $centerSphere) from the index. For batch questions over every well (how many
+# neighbours each well has, where uninspected wells cluster) GridIndex buckets
+# the points into square cells the size of the search radius: a radius query
+# only looks at the surrounding cells, so a proximity join costs about
+# points x neighbours instead of points x points.
+#
+# Cells come from an equirectangular projection around the mean latitude,
+# which is exact enough for a village-sized area; candidate pairs are always
+# confirmed with the haversine distance.
+
+EARTH_RADIUS_M = 6378100  # Radius MongoDB's docs use for $centerSphere
+DEFAULT_RADIUS_M = 250
+DEFAULT_TOP_CLUSTERS = 10
+CHUNK_SIZE = 50000  # Query points per batch in proximity joins
+STRIDE = 2 ** 32  # Cell key = column * STRIDE + row
+
+LOCATION_INDEX = IndexModel([('location', GEOSPHERE)], name='location_2dsphere')
+
+
+def point(latitude, longitude):
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+
+def coordinates(location):
+    # (latitude, longitude) of a GeoJSON point or of the older {latitude, longitude} shape
+    if not location:
+        return math.nan, math.nan
+    if 'coordinates' in location:
+        longitude, latitude = location['coordinates']
+        return latitude, longitude
+    return location.get('latitude', math.nan), location.get('longitude', math.nan)
+
+
+def within_query(latitude, longitude, radius_m):
+    return { '$geoWithin': { '$centerSphere': [[longitude, latitude], radius_m / EARTH_RADIUS_M] } }
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# In-memory grid index
+
+
+class GridIndex:
+    def __init__(self, latitudes, longitudes, cell_m=DEFAULT_RADIUS_M):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_m = cell_m
+        valid = ~(np.isnan(self.latitudes) | np.isnan(self.longitudes))
+        self.x_scale = math.cos(math.radians(float(self.latitudes[valid].mean()))) if valid.any() else 1.0
+        keys = self.cell_keys(self.latitudes, self.longitudes)
+        # Points without a location never match
+        self.order = np.flatnonzero(valid)[np.argsort(keys[valid], kind='stable')]
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def cell_keys(self, latitudes, longitudes):
+        x = np.radians(np.nan_to_num(longitudes)) * EARTH_RADIUS_M * self.x_scale
+        y = np.radians(np.nan_to_num(latitudes)) * EARTH_RADIUS_M
+        return np.floor(x / self.cell_m).astype(np.int64) * STRIDE + np.floor(y / self.cell_m).astype(np.int64)
+
+    def candidates(self, latitudes, longitudes, radius_m):
+        # (query position, point index) pairs from the cells around each query point
+        keys = self.cell_keys(latitudes, longitudes)
+        reach = math.ceil(radius_m / self.cell_m)
+        queries, points = [], []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                target = keys + dx * STRIDE + dy
+                start = np.searchsorted(self.sorted_keys, target, 'left')
+                counts = np.searchsorted(self.sorted_keys, target, 'right') - start
+                total = int(counts.sum())
+                if not total:
+                    continue
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                queries.append(np.repeat(np.arange(len(keys)), counts))
+                points.append(self.order[np.repeat(start, counts) + offsets])
+        if not queries:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(queries), np.concatenate(points)
+
+    def join(self, latitudes, longitudes, radius_m):
+        # Every (query position, point index, distance) within radius_m
+        latitudes, longitudes = np.atleast_1d(latitudes), np.atleast_1d(longitudes)
+        queries, points = self.candidates(latitudes, longitudes, radius_m)
+        distances = haversine_m(latitudes[queries], longitudes[queries], self.latitudes[points], self.longitudes[points])
+        close = distances <= radius_m
+        return queries[close], points[close], distances[close]
+
+    def within(self, latitude, longitude, radius_m):
+        _, points, _ = self.join(latitude, longitude, radius_m)
+        return np.sort(points)
+
+    def neighbour_counts(self, radius_m, chunk_size=CHUNK_SIZE):
+        # Points within radius_m of each point, itself excluded; in chunks so
+        # the candidate pairs of dense areas stay bounded
+        counts = np.zeros(len(self), dtype=np.int64)
+        for first in range(0, len(self), chunk_size):
+            last = min(first + chunk_size, len(self))
+            queries, points, _ = self.join(self.latitudes[first:last], self.longitudes[first:last], radius_m)
+            others = points != queries + first
+            counts[first:last] = np.bincount(queries[others], minlength=last - first)
+        return counts
+
+    def clusters(self, radius_m, top=DEFAULT_TOP_CLUSTERS):
+        # Densest neighbourhoods first; points already in a reported cluster
+        # cannot start another one
+        counts = self.neighbour_counts(radius_m)
+        taken = np.zeros(len(self), dtype=bool)
+        found = []
+        for index in np.argsort(-counts, kind='stable'):
+            if len(found) >= top or counts[index] == 0:
+                break
+            if taken[index]:
+                continue
+            members = self.within(self.latitudes[index], self.longitudes[index], radius_m)
+            members = members[~taken[members]]
+            taken[members] = True
+            found.append({
+                'latitude': float(self.latitudes[index]),
+                'longitude': float(self.longitudes[index]),
+                'radius_m': radius_m,
+                'wells': int(len(members)),
+                'members': members.tolist(),
+            })
+        return found
+
+# Detection evidence: what else lies around each candidate well
+
+
+def spatial_evidence(db, candidates, radius_m=DEFAULT_RADIUS_M):
+    # One indexed $geoWithin per candidate well (the candidate list is short)
+    for candidate in candidates:
+        latitude, longitude = coordinates(candidate.get('location'))
+        if math.isnan(latitude):
+            continue
+        query = { 'location': within_query(latitude, longitude, radius_m), 'well_id': { '$ne': candidate['well_id'] } }
+        nearby = list(db.registered_wells.find(query, { '_id': 0, 'well_id': 1, 'owner_user_id': 1 }))
+        candidate['evidence'].update({
+            'radius_m': radius_m,
+            'nearby_wells': len(nearby),
+            'nearby_owner_wells': sum(well['owner_user_id'] == candidate['owner_user_id'] for well in nearby),
+        })
+    return candidates
+
+# Migration of existing {latitude, longitude} locations
+
+
+def migrate(db, out=print):
+    started = time.perf_counter()
+    result = db.registered_wells.update_many(
+        { 'location.latitude': { '$exists': True } },
+        [
+            {
+                '$set': {
+                    'location': { 'type': "Point", 'coordinates': ["$location.longitude", "$location.latitude"] }
+                }
+            }
+        ]
+    )
+    db.registered_wells.create_indexes([LOCATION_INDEX])
+    out(f"Converted {result.modified_count} well locations to GeoJSON and built {LOCATION_INDEX.document['name']} "
+        f"({time.perf_counter() - started:.1f}s)")
+    return result.modified_count
+
+# Uninspected clusters
+
+
+def uninspected_wells(db):
+    inspected = {doc['_id'] for doc in db.control_activities.aggregate([{ '$group': { '_id': "$well_id" } }],
+                                                                       allowDiskUse=True)}
+    wells = [well for well in db.registered_wells.find({}, { '_id': 0, 'well_id': 1, 'location': 1 })
+             if well['well_id'] not in inspected]
+    points = [coordinates(well.get('location')) for well in wells]
+    return [well['well_id'] for well in wells], [p[0] for p in points], [p[1] for p in points]
+
+
+def print_clusters(clusters, well_ids, out=print):
+    for rank, cluster in enumerate(clusters, start=1):
+        sample = ', '.join(well_ids[member] for member in cluster['members'][:3])
+        out(f"#{rank} {cluster['wells']} uninspected wells within {cluster['radius_m']} m of "
+            f"({cluster['latitude']:.6f}, {cluster['longitude']:.6f}): {sample}{', ...' if cluster['wells'] > 3 else ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Well location tools.')
+    parser.add_argument('command', choices=['migrate', 'clusters'])
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_M, help='Neighbourhood radius in metres')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_CLUSTERS, help='Clusters reported')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate(connection.get_database())
+    else:
+        well_ids, latitudes, longitudes = uninspected_wells(connection.get_database('validation'))
+        started = time.perf_counter()
+        clusters = GridIndex(latitudes, longitudes, args.radius).clusters(args.radius, args.top)
+        print(f"{len(well_ids)} uninspected wells, clustered in {time.perf_counter() - started:.2f}s")
+        print_clusters(clusters, well_ids)
@@ -0,0 +1,277 @@
+from bson import ObjectId
+import argparse
+import re
+import time
+
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import OperationFailure
+
+import connection
+import data_validation
+from checkpoints import load_checkpoint, reset_checkpoints, save_checkpoint
+from report_sink import ReportSink
+
+# Incremental and continuous validation. Per-document checks only look at the
+# documents that arrived since their last checkpoint (by _id) and at the ones
+# updated or replaced since the last run (read back from a change stream, from
+# the position the previous run saved), or, in continuous mode, at each
+# document as a change stream reports it. Validation cost follows the amount of
+# change instead of the size of the data. Without a replica set there is no
+# change stream: updates are then only caught by a full validation.
+#
+# ObjectIds grow with time per client but are not strictly ordered across
+# concurrent writers (the parallel loader, load_generator): a document with a
+# smaller _id can land after a run has moved past it. As in rollups, each run
+# therefore stops at the documents created more than GRACE_SECONDS ago; newer
+# ones wait for a later run.
+
+# Per-document checks and the collection whose documents they validate
+INCREMENTAL_CHECKS = {
+    'last_status_change_dates': ('registered_wells', data_validation.check_last_status_change_dates),
+    'dates_in_future_in_registered_wells': ('registered_wells', data_validation.check_dates_in_future_in_registered_wells),
+    'future_user_registration_dates': ('users', data_validation.check_future_user_registration_dates),
+    'names_length': ('users', data_validation.check_names_length),
+    'control_activity_dates': ('control_activities', data_validation.check_control_activity_dates),
+}
+
+# Checks over the whole dataset; cheap enough to rerun after any change
+GLOBAL_CHECKS = {
+    'control_activities_coverage': data_validation.check_control_activities_coverage,
+    'no_control_activities_for_illegal_well': data_validation.check_no_control_activities_for_illegal_well,
+}
+
+CHECKPOINT_PREFIX = 'validation:'
+STREAM_CHECKPOINT = 'validation:change_stream'
+UPDATES_CHECKPOINT = 'validation:updates'  # Change stream position of the incremental runs
+UPDATES_BATCH = 10000  # Changes validated per query
+UPDATES_WAIT_MS = 500  # How long a run waits for more changes before it stops reading them
+STREAM_CHECKPOINT_INTERVAL = 5  # Seconds between resume token saves
+GRACE_SECONDS = 60  # Age a document's _id must reach before a run includes it
+
+
+def checkpoint_key(check, collection):
+    return f"{CHECKPOINT_PREFIX}{check}:{collection}"
+
+# Incremental mode
+
+
+def run_incremental(db, out=print, sink=None, include_global=True, grace=GRACE_SECONDS):
+    results = {name: {'outcome': 'PASS', 'violations': 0, 'checked': 0} for name in INCREMENTAL_CHECKS}
+    started = time.time()
+    settled = {}  # grace 0: everything, including this second's documents
+    if grace:
+        settled = {'_id': {'$lt': ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=grace))}}
+    for name, (collection, func) in INCREMENTAL_CHECKS.items():
+        key = checkpoint_key(name, collection)
+        last_id = load_checkpoint(db, key).get('last_id')
+        newest = db[collection].find_one(settled, {'_id': 1}, sort=[('_id', -1)])
+        if newest is None or (last_id is not None and newest['_id'] <= last_id):
+            out(f"\n{name}: no new documents in {collection}")
+            continue
+
+        window = {'$lte': newest['_id']}
+        if last_id is not None:
+            window['$gt'] = last_id
+        scope = {'_id': window}
+        result = func(out=out, sink=sink, scope=scope, db=db)
+        result['checked'] = db[collection].count_documents(scope)
+        add_result(results[name], result)
+        save_checkpoint(db, key, last_id=newest['_id'], outcome=result['outcome'],
+                        violations=result['violations'])
+
+    try:
+        for name, result in validate_updates(db, started, out, sink).items():
+            add_result(results[name], result)
+    except OperationFailure as exc:
+        out(f"\nWARN: updated documents not revalidated (no change stream: {exc})")
+
+    if include_global:
+        for name, func in GLOBAL_CHECKS.items():
+            results[name] = func(out=out, sink=sink, db=db)
+    return results
+
+
+def add_result(total, result):
+    total['violations'] += result['violations']
+    if result['outcome'] == 'FAIL':
+        total['outcome'] = 'FAIL'
+    for key in ('checked', 'updated'):
+        total[key] = total.get(key, 0) + result.get(key, 0)
+
+
+def merge_scopes(scopes):
+    # [{'_id': a}, {'_id': b}, {'well_id': w}] -> one query matching any of them
+    values = {}
+    for scope in scopes:
+        for field, value in scope.items():
+            values.setdefault(field, {})[value] = None
+    clauses = [{field: {'$in': list(distinct)}} for field, distinct in values.items()]
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def validate_changes(db, changes, out, sink):
+    # The checks concerned by a batch of changes, one query each
+    scopes = {}
+    for change in changes:
+        for name, scope_for in WATCHED[change['ns']['coll']]:
+            scope = scope_for(change)
+            if scope is not None:
+                scopes.setdefault(name, []).append(scope)
+    results = {}
+    for name, check_scopes in scopes.items():
+        result = INCREMENTAL_CHECKS[name][1](out=out, sink=sink, scope=merge_scopes(check_scopes), db=db)
+        result['updated'] = len(check_scopes)
+        results[name] = result
+    return results
+
+
+def validate_updates(db, until, out=print, sink=None):
+    # Updates and replacements since the previous run, up to the start of this
+    # one (epoch seconds `until`); inserts are covered by the _id windows. The
+    # first run only records where the stream starts.
+    pipeline = [
+        {
+            '$match': {
+                'operationType': {'$in': ['update', 'replace']},
+                'ns.coll': {'$in': list(WATCHED)}
+            }
+        }
+    ]
+    resume_token = load_checkpoint(db, UPDATES_CHECKPOINT).get('resume_token')
+    results = {}
+    with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token,
+                  max_await_time_ms=UPDATES_WAIT_MS) as stream:
+        if resume_token is None:
+            save_checkpoint(db, UPDATES_CHECKPOINT, resume_token=stream.resume_token)
+            out("\nTracking updated documents from now on")
+            return results
+
+        batch = []
+        while True:
+            change = stream.try_next()
+            done = change is None or change['clusterTime'].time >= until
+            if not done:
+                batch.append(change)
+            if batch and (done or len(batch) >= UPDATES_BATCH):
+                for name, result in validate_changes(db, batch, out, sink).items():
+                    add_result(results.setdefault(name, {'outcome': 'PASS', 'violations': 0}), result)
+                save_checkpoint(db, UPDATES_CHECKPOINT, resume_token=batch[-1]['_id'])
+                batch = []
+            if done:
+                break
+        if change is None:
+            # Caught up: move past the changes the $match filtered out as well
+            save_checkpoint(db, UPDATES_CHECKPOINT, resume_token=stream.resume_token)
+    return results
+
+# Continuous mode: tail one change stream over the village database and run the
+# checks concerned by every insert, update or replace. Needs a replica set or a
+# sharded cluster; a local single-node replica set works
+# (mongod --replSet rs0, then rs.initiate()).
+
+
+def _by_id(change):
+    return {'_id': change['documentKey']['_id']}
+
+
+def _activities_of_well(change):
+    # A well's last_status_change moved: recheck the control activities of that well
+    well = change.get('fullDocument')
+    return {'well_id': well['well_id']} if well else None
+
+
+# collection -> [(check, scope for a change)]
+WATCHED = {
+    'users': [
+        ('future_user_registration_dates', _by_id),
+        ('names_length', _by_id),
+    ],
+    'registered_wells': [
+        ('last_status_change_dates', _by_id),
+        ('dates_in_future_in_registered_wells', _by_id),
+        ('control_activity_dates', _activities_of_well),
+    ],
+    'control_activities': [
+        ('control_activity_dates', _by_id),
+    ],
+}
+
+
+def watch(db, out=print, sink=None, max_events=None):
+    pipeline = [
+        {
+            '$match': {
+                'operationType': {'$in': ['insert', 'update', 'replace']},
+                'ns.coll': {'$in': list(WATCHED)}
+            }
+        }
+    ]
+    resume_token = load_checkpoint(db, STREAM_CHECKPOINT).get('resume_token')
+    events = violations = 0
+    last_saved = time.monotonic()
+    out("Watching for changes" + (" (resuming)" if resume_token else "") + "...")
+    with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+        for change in stream:
+            collection = change['ns']['coll']
+            for name, scope_for in WATCHED[collection]:
+                scope = scope_for(change)
+                if scope is None:
+                    continue
+                lines = []
+                result = INCREMENTAL_CHECKS[name][1](out=lines.append, sink=sink, scope=scope, db=db)
+                if result['outcome'] == 'FAIL':
+                    # Only failures are worth printing at change stream rates
+                    violations += result['violations']
+                    for line in lines:
+                        out(line)
+            events += 1
+
+            if time.monotonic() - last_saved >= STREAM_CHECKPOINT_INTERVAL:
+                save_checkpoint(db, STREAM_CHECKPOINT, resume_token=stream.resume_token,
+                                events=events, violations=violations)
+                last_saved = time.monotonic()
+            if max_events is not None and events >= max_events:
+                break
+        save_checkpoint(db, STREAM_CHECKPOINT, resume_token=stream.resume_token, events=events,
+                        violations=violations)
+    return events, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate only what changed since the last run.')
+    parser.add_argument('--watch', action='store_true', help='Validate continuously from a change stream')
+    parser.add_argument('--reset', action='store_true', help='Forget all validation checkpoints first')
+    parser.add_argument('--no-global', action='store_true', help='Skip the whole-dataset checks')
+    parser.add_argument('--violations', default=None, help='Stream every violation as NDJSON to this path')
+    parser.add_argument('--grace', type=float, default=GRACE_SECONDS,
+                        help='Leave out documents created in the last GRACE seconds (0 once writers have stopped)')
+    args = parser.parse_args()
+
+    # Checkpoint windows are closed at the newest _id on the primary; a
+    # lagging secondary could miss part of the window the checks then skip
+    db = connection.primary(connection.get_database())
+    if args.reset:
+        removed = reset_checkpoints(db, re.escape(CHECKPOINT_PREFIX))
+        print(f"Removed {removed} checkpoint(s)")
+
+    sink = ReportSink(args.violations) if args.violations else None
+    try:
+        if args.watch:
+            try:
+                watch(db, sink=sink)
+            except KeyboardInterrupt:
+                print("\nStopped; the change stream position is saved.")
+        else:
+            results = run_incremental(db, sink=sink, include_global=not args.no_global, grace=args.grace)
+            print("\n=== Incremental validation summary ===")
+            for name, result in results.items():
+                checked = f", {result['checked']} new doc(s)" if 'checked' in result else ''
+                updated = f", {result['updated']} updated" if result.get('updated') else ''
+                print(f"{result['outcome']:<5} {name}: {result['violations']} violation(s){checked}{updated}")
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+if __name__ == '__main__':
+    main()
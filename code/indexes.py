@@ -0,0 +1,173 @@
+from pymongo import ASCENDING, IndexModel
+from bson.son import SON
+import argparse
+import sys
+import time
+
+import bucketing
+import connection
+import geo
+
+# Index manager: declares the indexes the validation checks rely on, builds
+# them once the bulk load is done (cheaper than maintaining them during the
+# inserts) and verifies with explain() that every check actually uses them.
+
+INDEXES = {
+    'users': [
+        # identify_illegal_well_and_owner: owner $lookup
+        IndexModel([('user_id', ASCENDING)], name='user_id'),
+        # check_future_user_registration_dates
+        IndexModel([('registration_date', ASCENDING)], name='registration_date'),
+    ],
+    'registered_wells': [
+        # $lookup from control_activities.well_id and well lookups by id
+        IndexModel([('well_id', ASCENDING)], name='well_id'),
+        # Suspect wells of the high consumption users (detection $lookup)
+        IndexModel([('owner_user_id', ASCENDING)], name='owner_user_id'),
+        # Coverage count, illegal well lookup and future date checks
+        IndexModel([('authorization_date', ASCENDING)], name='authorization_date'),
+        IndexModel([('last_status_change', ASCENDING)], name='last_status_change'),
+        # Wells around a detection candidate ($geoWithin)
+        geo.LOCATION_INDEX,
+    ],
+    'water_consumption': [
+        # Per-user consumption, in reading order
+        IndexModel([('user_id', ASCENDING), ('date', ASCENDING)], name='user_id_date'),
+    ],
+    # Monthly buckets of a user, also the $merge key of the migration
+    bucketing.BUCKET_COLLECTION: bucketing.BUCKET_INDEXES,
+    'control_activities': [
+        # Distinct inspected wells and control activities of a well
+        IndexModel([('well_id', ASCENDING)], name='well_id'),
+    ],
+}
+
+PROBE_ID = '__index_probe__'  # Placeholder value for equality probes
+PROBE_POINT = (42.8, -5.63)  # Placeholder location for radius probes
+
+
+def create_indexes(db, out=print):
+    for collection, models in INDEXES.items():
+        started = time.perf_counter()
+        names = db[collection].create_indexes(models)
+        out(f"Created indexes on {collection}: {', '.join(names)} ({time.perf_counter() - started:.1f}s)")
+
+# Explain-plan verification. Every entry describes one query a check sends and
+# whether an index is expected to serve it; queries comparing two fields of the
+# same document ($expr) or scanning everything on purpose ($group) expect a
+# collection scan.
+
+
+def plan_checks():
+    import data_validation  # Only needed for verification
+    import detection
+    import rollups
+
+    return [
+        {'name': 'last_status_change_dates', 'collection': 'registered_wells', 'expect_index': False,
+         'command': lambda: {'find': data_validation.last_status_change_query()}},
+        {'name': 'control_activities_coverage (legal wells)', 'collection': 'registered_wells', 'expect_index': True,
+         'command': lambda: {'count': data_validation.legal_wells_query()}},
+        {'name': 'control_activities_coverage (inspected wells)', 'collection': 'control_activities',
+         'expect_index': True, 'command': lambda: {'aggregate': data_validation.inspected_wells_pipeline()}},
+        {'name': 'no_control_activities_for_illegal_well (illegal well)', 'collection': 'registered_wells',
+         'expect_index': True, 'command': lambda: {'find': data_validation.illegal_well_query()}},
+        {'name': 'no_control_activities_for_illegal_well (activities)', 'collection': 'control_activities',
+         'expect_index': True, 'command': lambda: {'find': {'well_id': PROBE_ID}}},
+        {'name': 'control_activity_dates', 'collection': 'control_activities', 'expect_index': False,
+         'command': lambda: {'aggregate': data_validation.control_activity_dates_pipeline()}},
+        # The $lookup sub-pipeline of control_activity_dates: one equality probe per activity
+        {'name': 'control_activity_dates ($lookup)', 'collection': 'registered_wells', 'expect_index': True,
+         'command': lambda: {'find': {'well_id': PROBE_ID}}},
+        {'name': 'future_user_registration_dates', 'collection': 'users', 'expect_index': True,
+         'command': lambda: {'find': data_validation.future_registration_query()}},
+        {'name': 'dates_in_future_in_registered_wells', 'collection': 'registered_wells', 'expect_index': True,
+         'command': lambda: {'find': data_validation.future_wells_query()}},
+        {'name': 'names_length', 'collection': 'users', 'expect_index': False,
+         'command': lambda: {'find': data_validation.short_names_query()}},
+        # identify_illegal_well_and_owner: the consumption totals scan everything,
+        # each $lookup sub-pipeline is an equality probe
+        {'name': 'illegal_well_and_owner', 'collection': rollups.ROLLUP_COLLECTION, 'expect_index': False,
+         'command': lambda: {'aggregate': detection.detection_pipeline(totals_stages=rollups.user_totals_stages())}},
+        {'name': 'illegal_well_and_owner (buckets)', 'collection': bucketing.BUCKET_COLLECTION, 'expect_index': False,
+         'command': lambda: {'aggregate': detection.detection_pipeline(totals_stages=bucketing.user_totals_stages())}},
+        {'name': 'illegal_well_and_owner (suspect wells)', 'collection': 'registered_wells', 'expect_index': True,
+         'command': lambda: {'find': {'owner_user_id': PROBE_ID}}},
+        {'name': 'illegal_well_and_owner (control activities)', 'collection': 'control_activities',
+         'expect_index': True, 'command': lambda: {'find': {'well_id': PROBE_ID}}},
+        {'name': 'illegal_well_and_owner (owner)', 'collection': 'users', 'expect_index': True,
+         'command': lambda: {'find': {'user_id': PROBE_ID}}},
+        {'name': 'illegal_well_and_owner (nearby wells)', 'collection': 'registered_wells', 'expect_index': True,
+         'command': lambda: {'find': {'location': geo.within_query(*PROBE_POINT, geo.DEFAULT_RADIUS_M)}}},
+    ]
+
+
+def explain(db, collection, command):
+    kind, argument = next(iter(command.items()))
+    if kind == 'find':
+        cmd = SON([('find', collection), ('filter', argument)])
+    elif kind == 'count':
+        cmd = SON([('count', collection), ('query', argument)])
+    else:
+        cmd = SON([('aggregate', collection), ('pipeline', argument), ('cursor', {})])
+    return db.command('explain', cmd, verbosity='queryPlanner')
+
+
+def plan_stages(explain_output):
+    # Every stage name of the winning plans (on every shard), skipping the
+    # rejected alternatives
+    stages = []
+    if isinstance(explain_output, dict):
+        for key, value in explain_output.items():
+            if key == 'rejectedPlans':
+                continue
+            if key == 'stage' and isinstance(value, str):
+                stages.append(value)
+            else:
+                stages.extend(plan_stages(value))
+    elif isinstance(explain_output, list):
+        for item in explain_output:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def plan_summaries(db):
+    # Winning plan of every check query, as distinct stage names
+    summaries = []
+    for entry in plan_checks():
+        stages = plan_stages(explain(db, entry['collection'], entry['command']()))
+        summaries.append({
+            'name': entry['name'],
+            'collection': entry['collection'],
+            'stages': list(dict.fromkeys(stages)),
+            'expect_index': entry['expect_index'],
+            'ok': not (entry['expect_index'] and 'COLLSCAN' in stages),
+        })
+    return summaries
+
+
+def verify_plans(db, out=print):
+    failures = []
+    for summary in plan_summaries(db):
+        status = 'OK  ' if summary['ok'] else 'FAIL'
+        out(f"[{status}] {summary['name']} ({summary['collection']}): {' > '.join(summary['stages']) or 'no plan'}")
+        if not summary['ok']:
+            failures.append(summary['name'])
+    if failures:
+        out(f"FAIL: {len(failures)} check(s) fall back to a collection scan: {', '.join(failures)}")
+    else:
+        out("PASS: Every check uses the expected indexes.")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create and verify the village indexes.')
+    parser.add_argument('--create', action='store_true', help='Create the declared indexes')
+    parser.add_argument('--verify', action='store_true', help="Explain every check's queries and fail on COLLSCAN")
+    args = parser.parse_args()
+
+    db = connection.get_database()
+    if args.create or not args.verify:
+        create_indexes(db)
+    if args.verify and verify_plans(db):
+        sys.exit(1)
@@ -0,0 +1,313 @@
+from pymongo import monitoring
+import bson
+import contextvars
+import json
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime
+
+# Command-level instrumentation for all MongoDB traffic. pymongo command and
+# connection-pool listeners record, per tag and command: a latency histogram,
+# failures, documents and bytes returned in cursor batches, batches fetched
+# and the time spent waiting for a pooled connection. The tag is a context
+# variable set by the code issuing the commands (a generation phase, a
+# validation check), so every cost is traced back to the function behind it.
+#
+# install() must run before the first client is created (see connection.py);
+# the scripts call it from main when --metrics or --prometheus is given.
+
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+UNTAGGED = 'untagged'
+CURSOR_COMMANDS = {'find', 'aggregate', 'getMore'}
+
+current_tag = contextvars.ContextVar('instrumentation_tag', default=UNTAGGED)
+
+
+@contextmanager
+def tagged(tag):
+    token = current_tag.set(tag)
+    try:
+        yield
+    finally:
+        current_tag.reset(token)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # Last one is +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        index = next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + [self.max_ms], self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+            'max_ms': self.max_ms,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS_MS + ['+Inf'], self.counts)},
+        }
+
+
+def batch_of(reply):
+    cursor = reply.get('cursor') if isinstance(reply, dict) else None
+    if not isinstance(cursor, dict):
+        return None
+    return cursor.get('firstBatch', cursor.get('nextBatch'))
+
+
+class CommandStats(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+
+    def _entry(self, command_name):
+        key = (current_tag.get(), command_name)
+        if key not in self.commands:
+            self.commands[key] = {'latency': Histogram(), 'failures': 0, 'documents': 0, 'bytes': 0, 'batches': 0}
+        return self.commands[key]
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        # Events are published on the thread that ran the command, so the
+        # current tag is the caller's
+        batch = batch_of(event.reply) if event.command_name in CURSOR_COMMANDS else None
+        size = len(bson.encode(event.reply)) if batch is not None else 0
+        with self._lock:
+            entry = self._entry(event.command_name)
+            entry['latency'].observe(event.duration_micros / 1000)
+            if batch is not None:
+                entry['documents'] += len(batch)
+                entry['bytes'] += size
+                entry['batches'] += 1
+
+    def failed(self, event):
+        with self._lock:
+            entry = self._entry(event.command_name)
+            entry['latency'].observe(event.duration_micros / 1000)
+            entry['failures'] += 1
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = {}
+        self.connections_created = 0
+        self.checkout_failures = 0
+
+    def _wait(self, event):
+        if event.duration is None:
+            return
+        with self._lock:
+            self.waits.setdefault(current_tag.get(), Histogram()).observe(event.duration * 1000)
+
+    def connection_checked_out(self, event):
+        self._wait(event)
+
+    def connection_check_out_failed(self, event):
+        self._wait(event)
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+command_stats = CommandStats()
+pool_stats = PoolStats()
+_installed = False
+
+
+def install():
+    global _installed
+    if not _installed:
+        monitoring.register(command_stats)
+        monitoring.register(pool_stats)
+        _installed = True
+
+
+def installed():
+    return _installed
+
+# Worker processes record into their own listeners; take() hands their
+# numbers over (picklable) and merge() folds them into the parent's
+
+
+def take():
+    with command_stats._lock, pool_stats._lock:
+        taken = {
+            'commands': command_stats.commands,
+            'waits': pool_stats.waits,
+            'connections_created': pool_stats.connections_created,
+            'checkout_failures': pool_stats.checkout_failures,
+        }
+        command_stats.commands = {}
+        pool_stats.waits = {}
+        pool_stats.connections_created = pool_stats.checkout_failures = 0
+    return taken
+
+
+def merge_histogram(target, source):
+    target.counts = [a + b for a, b in zip(target.counts, source.counts)]
+    target.count += source.count
+    target.total_ms += source.total_ms
+    target.max_ms = max(target.max_ms, source.max_ms)
+
+
+def merge(taken):
+    with command_stats._lock, pool_stats._lock:
+        for key, entry in taken['commands'].items():
+            if key not in command_stats.commands:
+                command_stats.commands[key] = entry
+                continue
+            target = command_stats.commands[key]
+            merge_histogram(target['latency'], entry['latency'])
+            for field in ('failures', 'documents', 'bytes', 'batches'):
+                target[field] += entry[field]
+        for tag, histogram in taken['waits'].items():
+            if tag in pool_stats.waits:
+                merge_histogram(pool_stats.waits[tag], histogram)
+            else:
+                pool_stats.waits[tag] = histogram
+        pool_stats.connections_created += taken['connections_created']
+        pool_stats.checkout_failures += taken['checkout_failures']
+
+# Reports
+
+
+def report(plans=None):
+    with command_stats._lock:
+        commands = [
+            {'tag': tag, 'command': command, 'failures': entry['failures'], 'documents': entry['documents'],
+             'bytes': entry['bytes'], 'batches': entry['batches'], **entry['latency'].to_dict()}
+            for (tag, command), entry in sorted(command_stats.commands.items())
+        ]
+    with pool_stats._lock:
+        pool = {
+            'connections_created': pool_stats.connections_created,
+            'checkout_failures': pool_stats.checkout_failures,
+            'waits': [{'tag': tag, **histogram.to_dict()} for tag, histogram in sorted(pool_stats.waits.items())],
+        }
+    result = {'generated_at': datetime.now().isoformat(), 'commands': commands, 'pool': pool}
+    if plans is not None:
+        result['plans'] = plans
+    return result
+
+
+def write_json(path, plans=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report(plans), f, indent=2, default=str)
+
+
+def prometheus_labels(**labels):
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"') for key, value in labels.items()}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped.items()) + '}'
+
+
+def prometheus_histogram(lines, name, histogram, **labels):
+    cumulative = 0
+    for bound, count in zip(BUCKETS_MS + ['+Inf'], histogram.counts):
+        cumulative += count
+        le = bound if bound == '+Inf' else bound / 1000
+        lines.append(f"{name}_bucket{prometheus_labels(**labels, le=le)} {cumulative}")
+    lines.append(f"{name}_sum{prometheus_labels(**labels)} {histogram.total_ms / 1000}")
+    lines.append(f"{name}_count{prometheus_labels(**labels)} {histogram.count}")
+
+
+def write_prometheus(path):
+    lines = []
+    with command_stats._lock:
+        commands = sorted(command_stats.commands.items())
+        lines += ["# HELP village_mongo_command_duration_seconds MongoDB command latency.",
+                  "# TYPE village_mongo_command_duration_seconds histogram"]
+        for (tag, command), entry in commands:
+            prometheus_histogram(lines, 'village_mongo_command_duration_seconds', entry['latency'],
+                                 tag=tag, command=command)
+        for metric, key, help_text in [
+                ('village_mongo_command_failures_total', 'failures', 'Failed MongoDB commands.'),
+                ('village_mongo_documents_returned_total', 'documents', 'Documents returned in cursor batches.'),
+                ('village_mongo_bytes_returned_total', 'bytes', 'BSON bytes of the cursor replies.'),
+                ('village_mongo_batches_total', 'batches', 'Cursor batches fetched.')]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for (tag, command), entry in commands:
+                lines.append(f"{metric}{prometheus_labels(tag=tag, command=command)} {entry[key]}")
+    with pool_stats._lock:
+        lines += ["# HELP village_mongo_pool_wait_seconds Time spent checking a connection out of the pool.",
+                  "# TYPE village_mongo_pool_wait_seconds histogram"]
+        for tag, histogram in sorted(pool_stats.waits.items()):
+            prometheus_histogram(lines, 'village_mongo_pool_wait_seconds', histogram, tag=tag)
+        lines += ["# HELP village_mongo_connections_created_total Connections opened.",
+                  "# TYPE village_mongo_connections_created_total counter",
+                  f"village_mongo_connections_created_total {pool_stats.connections_created}"]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+# Command line plumbing shared by the scripts
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', default=None, help='Write a JSON report of every MongoDB command to this path')
+    parser.add_argument('--prometheus', default=None, help='Write the same metrics in Prometheus text format')
+
+
+def enabled(args):
+    return bool(args.metrics or args.prometheus)
+
+
+def write_outputs(args, plans=None, out=print):
+    if args.metrics:
+        write_json(args.metrics, plans)
+        out(f"Metrics written to {args.metrics}")
+    if args.prometheus:
+        write_prometheus(args.prometheus)
+        out(f"Prometheus metrics written to {args.prometheus}")
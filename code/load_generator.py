@@ -0,0 +1,337 @@
+from faker import Faker
+from pymongo.errors import PyMongoError
+import argparse
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+from datetime import datetime
+
+import bucketing
+import connection
+import data_generation
+import geo
+import instrumentation
+import text_pools
+
+# Continuous mixed load against an already loaded village: new meter readings
+# and control activities keep arriving (same document shapes as
+# data_generation, bucket upserts when the readings are bucketed) while
+# validation-style reads run alongside. Worker threads share one client and a
+# pacer that hands out start times at the target rate; a latency is measured
+# from the time the operation was due, not from when a worker got to it, so a
+# cluster that falls behind shows up as growing latency instead of a quietly
+# lower rate. With --ramp the target rate grows every interval: the saturation
+# point is where the achieved rate stops following the target.
+#
+# Every interval prints the achieved rate and exact p50/p95/p99 per operation;
+# --output keeps the whole timeline as JSON.
+
+DEFAULT_MIX = 'reading=60,control=5,user_readings=20,well_activities=10,nearby_wells=5'
+DEFAULT_RATE = 200  # Target operations per second, all workers together (0: as fast as possible)
+DEFAULT_WORKERS = 16
+DEFAULT_DURATION = 60  # Seconds
+DEFAULT_INTERVAL = 5  # Seconds between reports
+DEFAULT_SAMPLE = 1000  # Users and wells drawn from the collections to write and read
+RECENT_READINGS = 10  # Readings returned by the user_readings read
+QUANTILES = (50, 95, 99)
+
+# Writes
+
+
+def insert_reading(ctx, state, rng):
+    user = rng.choice(state['users'])
+    with user['lock']:  # One reading at a time per meter, so readings keep increasing
+        now = datetime.now()
+        reading = data_generation.reading(user['user_id'], now, user['current_reading'],
+                                          user['current_reading'] + rng.uniform(0, 10))
+        if 'water_consumption' in ctx['collections']:
+            ctx['db'].water_consumption.insert_one(reading)
+        if bucketing.BUCKET_COLLECTION in ctx['collections']:
+            ctx['db'][bucketing.BUCKET_COLLECTION].update_one(*bucketing.reading_update(reading), upsert=True)
+        user['current_reading'] = reading['current_reading']
+
+
+def insert_control(ctx, state, rng):
+    # Only authorized wells are sampled: the illegal well must stay uninspected
+    well = rng.choice(state['wells'])
+    with ctx['text_lock']:
+        activity = data_generation.control_activity(well['well_id'], datetime.now(), rng, ctx['text'])
+    ctx['db'].control_activities.insert_one(activity)
+
+# Reads
+
+
+def user_readings(ctx, state, rng):
+    user_id = rng.choice(state['users'])['user_id']
+    if 'water_consumption' in ctx['collections']:
+        cursor = ctx['db'].water_consumption.find({ 'user_id': user_id }).sort('date', -1).limit(RECENT_READINGS)
+    else:
+        cursor = ctx['db'][bucketing.BUCKET_COLLECTION].find({ 'user_id': user_id }).sort('month', -1).limit(1)
+    return list(cursor)
+
+
+def well_activities(ctx, state, rng):
+    return list(ctx['db'].control_activities.find({ 'well_id': rng.choice(state['wells'])['well_id'] }))
+
+
+def nearby_wells(ctx, state, rng):
+    latitude, longitude = geo.coordinates(rng.choice(state['wells']).get('location'))
+    query = { 'location': geo.within_query(latitude, longitude, geo.DEFAULT_RADIUS_M) }
+    return list(ctx['db'].registered_wells.find(query, { '_id': 0, 'well_id': 1, 'owner_user_id': 1 }))
+
+
+OPERATIONS = {
+    'reading': insert_reading,
+    'control': insert_control,
+    'user_readings': user_readings,
+    'well_activities': well_activities,
+    'nearby_wells': nearby_wells,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r} (known: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+# Working set: a sample of the existing users (with their latest meter reading)
+# and authorized wells
+
+
+def resolve_layout(db, layout):
+    return bucketing.loaded_layout(db) if layout == 'auto' else layout
+
+
+def latest_reading(db, user_id, collections):
+    if 'water_consumption' in collections:
+        last = db.water_consumption.find_one({ 'user_id': user_id }, sort=[('date', -1)])
+        if last is not None:
+            return last['current_reading']
+    if bucketing.BUCKET_COLLECTION in collections:
+        last = db[bucketing.BUCKET_COLLECTION].find_one({ 'user_id': user_id }, sort=[('month', -1)])
+        if last is not None and last['readings']:
+            return last['readings'][-1]
+    return 0.0
+
+
+def sample_state(db, size, collections, out=print):
+    started = time.perf_counter()
+    users = [
+        {'user_id': doc['user_id'], 'lock': threading.Lock()}
+        for doc in db.users.aggregate([{ '$sample': { 'size': size } }, { '$project': { '_id': 0, 'user_id': 1 } }])
+    ]
+    for user in users:
+        user['current_reading'] = latest_reading(db, user['user_id'], collections)
+    wells = list(db.registered_wells.aggregate([
+        { '$match': { 'authorization_date': { '$ne': None } } },
+        { '$sample': { 'size': size } },
+        { '$project': { '_id': 0, 'well_id': 1, 'location': 1 } }
+    ]))
+    if not users or not wells:
+        raise SystemExit("No users or authorized wells found: load the village first (data_generation.py)")
+    out(f"Sampled {len(users)} users and {len(wells)} wells ({time.perf_counter() - started:.1f}s)")
+    return {'users': users, 'wells': wells}
+
+# Pacing and recording
+
+
+class Pacer:
+    # Start times at `rate` per second for all workers together; rate 0 means
+    # no pacing (each worker starts the next operation right away)
+    def __init__(self, rate):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._next = time.perf_counter()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._next = max(self._next, time.perf_counter())
+
+    def next_slot(self):
+        with self._lock:
+            if not self.rate:
+                return None
+            slot = self._next
+            self._next += 1 / self.rate
+        return slot
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.interval = {}
+        self.totals = {}
+
+    def record(self, op, seconds, ok):
+        with self._lock:
+            entry = self.interval.setdefault(op, {'latencies_ms': [], 'errors': 0})
+            entry['latencies_ms'].append(seconds * 1000)
+            if not ok:
+                entry['errors'] += 1
+            total = self.totals.setdefault(op, {'latency': instrumentation.Histogram(), 'errors': 0})
+            total['latency'].observe(seconds * 1000)
+            if not ok:
+                total['errors'] += 1
+
+    def take_interval(self):
+        with self._lock:
+            interval, self.interval = self.interval, {}
+        return interval
+
+
+def interval_stats(interval, seconds):
+    stats = {}
+    for op, entry in sorted(interval.items()):
+        latencies = np.array(entry['latencies_ms'])
+        stats[op] = {
+            'count': len(latencies),
+            'errors': entry['errors'],
+            'ops_per_s': len(latencies) / seconds if seconds else 0.0,
+            **{f"p{q}_ms": float(value) for q, value in zip(QUANTILES, np.percentile(latencies, QUANTILES))},
+        }
+    return stats
+
+
+def print_interval(point, out=print):
+    done = sum(stats['ops_per_s'] for stats in point['ops'].values())
+    target = f"{point['target_rate']:,.0f}" if point['target_rate'] else 'max'
+    out(f"[{point['elapsed_s']:>6.1f}s] target {target} ops/s, achieved {done:,.0f} ops/s")
+    for op, stats in point['ops'].items():
+        errors = f", {stats['errors']} errors" if stats['errors'] else ''
+        out(f"    {op:<16} {stats['ops_per_s']:>9,.1f}/s  p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  "
+            f"p99 {stats['p99_ms']:>8.1f} ms{errors}")
+
+# Workers
+
+
+def run_worker(worker, ctx, state, mix, pacer, recorder, stop, seed):
+    rng = random.Random(f"{seed}:{worker}")
+    names, weights = list(mix), list(mix.values())
+    while not stop.is_set():
+        slot = pacer.next_slot()
+        if slot is not None:
+            delay = slot - time.perf_counter()
+            if delay > 0 and stop.wait(delay):
+                break
+        op = rng.choices(names, weights)[0]
+        started = time.perf_counter() if slot is None else slot
+        ok = True
+        try:
+            with instrumentation.tagged(f"loadgen:{op}"):
+                OPERATIONS[op](ctx, state, rng)
+        except PyMongoError:
+            ok = False
+        recorder.record(op, time.perf_counter() - started, ok)
+
+
+def run(db, collections, state, mix, rate, workers, duration, interval, ramp=0, seed=0, out=print):
+    ctx = {
+        'db': db,
+        'collections': collections,
+        'text': text_pools.FakerText(Faker(data_generation.LOCALE)),
+        'text_lock': threading.Lock(),  # Faker instances are not thread-safe
+    }
+    pacer = Pacer(rate)
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=run_worker, args=(worker, ctx, state, mix, pacer, recorder, stop, seed), daemon=True)
+        for worker in range(workers)
+    ]
+    timeline = []
+    started = last = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        while time.perf_counter() - started < duration:
+            time.sleep(min(interval, max(0.0, duration - (time.perf_counter() - started))))
+            now = time.perf_counter()
+            point = {'elapsed_s': now - started, 'target_rate': pacer.rate,
+                     'ops': interval_stats(recorder.take_interval(), now - last)}
+            timeline.append(point)
+            print_interval(point, out)
+            last = now
+            if ramp and pacer.rate:
+                pacer.set_rate(pacer.rate + ramp)
+    except KeyboardInterrupt:
+        out("Interrupted, stopping the workers...")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    summary = {
+        op: {'errors': total['errors'], 'ops_per_s': total['latency'].count / elapsed, **total['latency'].to_dict()}
+        for op, total in sorted(recorder.totals.items())
+    }
+    return timeline, summary
+
+
+def print_summary(summary, elapsed, out=print):
+    count = sum(stats['count'] for stats in summary.values())
+    out(f"\n{count} operations in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f} ops/s)")
+    for op, stats in summary.items():
+        out(f"    {op:<16} {stats['count']:>9} ops, {stats['errors']} errors, mean {stats['mean_ms']:.1f} ms, "
+            f"p99 <= {stats['p99_ms']:.0f} ms, max {stats['max_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sustained mixed read/write load against the village collections.')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='Target operations per second, all workers together (0: unthrottled)')
+    parser.add_argument('--ramp', type=float, default=0, help='Added to the target rate after every interval')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operation weights, e.g. {DEFAULT_MIX}")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent worker threads')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='Seconds to run')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='Seconds between reports')
+    parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE, help='Users and wells to draw the load from')
+    parser.add_argument('--layout', choices=['auto'] + list(bucketing.LAYOUTS), default='auto',
+                        help='Where new readings go (auto: the layout already loaded)')
+    parser.add_argument('--profile', choices=list(connection.PROFILES), default='default',
+                        help='Connection profile (see connection.py)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the operation sequence')
+    parser.add_argument('--output', default=None, help='Write the timeline and summary as JSON to this path')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if instrumentation.enabled(args):
+        instrumentation.install()
+
+    db = connection.get_database(args.profile)
+    layout = resolve_layout(db, args.layout)
+    collections = bucketing.LAYOUTS[layout]
+    state = sample_state(db, args.sample, collections)
+    print(f"Running {args.workers} workers for {args.duration:.0f}s, mix {mix}, readings to {', '.join(collections)}")
+
+    started = time.perf_counter()
+    timeline, summary = run(db, collections, state, mix, args.rate, args.workers, args.duration, args.interval,
+                            args.ramp, args.seed)
+    print_summary(summary, time.perf_counter() - started)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ('metrics', 'prometheus', 'output')}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'generated_at': datetime.now().isoformat(), 'config': config, 'layout': layout,
+                       'timeline': timeline, 'summary': summary}, f, indent=2, default=str)
+        print(f"Timeline written to {args.output}")
+    instrumentation.write_outputs(args)
+
+
+if __name__ == '__main__':
+    main()
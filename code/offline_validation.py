@@ -0,0 +1,320 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from datetime import datetime
+
+import data_validation
+import detection
+import geo
+import snapshot as snapshots
+from report_sink import ReportSink
+
+# Offline validation engine: the checks of data_validation.py and the
+# illegal-well detection of detection.py, run as vectorized filters and joins
+# over a columnar snapshot (see snapshot.py) instead of against the cluster.
+# Joins go through the dictionary codes: a code -> row array per joined
+# collection, then plain fancy indexing. Every check returns the same result
+# dict as its online counterpart; --verify-online runs both and diffs them.
+#
+# Null handling follows the server's ordering, where null sorts before any
+# date: a missing last_status_change is "before" an authorization date and a
+# missing activity date is "before" any status change.
+
+
+def date_value(value):
+    return value.item() if not np.isnat(value) else None  # datetime64[ms] -> datetime
+
+
+def rows_by_code(codes, size):
+    # code -> row of its first occurrence, -1 for codes without a row
+    rows = np.full(size + 1, -1, dtype=np.int64)
+    unique, first = np.unique(codes, return_index=True)
+    valid = unique >= 0
+    rows[unique[valid]] = first[valid]
+    return rows
+
+
+def violations(indices, row, sink):
+    if sink is None:
+        indices = indices[:data_validation.SAMPLE_SIZE]  # Nothing to do with the rest
+    return (row(i) for i in indices)
+
+
+def well_dates_row(snap):
+    wells, well_ids = snap['registered_wells'], snap['dictionaries']['well_id']
+    return lambda i: {
+        'well_id': str(well_ids[wells['well'][i]]),
+        'authorization_date': date_value(wells['authorization_date'][i]),
+        'last_status_change': date_value(wells['last_status_change'][i])
+    }
+
+
+# Checks; the messages and results come from data_validation, as online
+
+
+def check_last_status_change_dates(snap, now, out=print, sink=None):
+    data_validation.start_check('last_status_change_dates', out)
+    wells = snap['registered_wells']
+    authorization, last_change = wells['authorization_date'], wells['last_status_change']
+    bad = np.flatnonzero(~np.isnat(authorization) & (np.isnat(last_change) | (last_change < authorization)))
+    return data_validation.report_check('last_status_change_dates', len(bad),
+                                        lambda: violations(bad, well_dates_row(snap), sink), out, sink)
+
+
+def check_control_activities_coverage(snap, now, out=print, sink=None):
+    data_validation.start_check('control_activities_coverage', out)
+    total_legal_wells = int((~np.isnat(snap['registered_wells']['authorization_date'])).sum())
+    wells_with_activities = len(np.unique(snap['control_activities']['well']))
+    return data_validation.report_coverage(total_legal_wells, wells_with_activities, out)
+
+
+def check_no_control_activities_for_illegal_well(snap, now, out=print, sink=None):
+    data_validation.start_check('no_control_activities_for_illegal_well', out)
+    wells, activities = snap['registered_wells'], snap['control_activities']
+    unauthorized = np.flatnonzero(np.isnat(wells['authorization_date']))
+    if not len(unauthorized):
+        return data_validation.report_no_illegal_well(out)
+    bad = np.flatnonzero(activities['well'] == wells['well'][unauthorized[0]])
+    row = lambda i: {'control_id': str(activities['control_id'][i]), 'date': date_value(activities['date'][i])}
+    return data_validation.report_check('no_control_activities_for_illegal_well', len(bad),
+                                        lambda: violations(bad, row, sink), out, sink)
+
+
+def check_control_activity_dates(snap, now, out=print, sink=None):
+    data_validation.start_check('control_activity_dates', out)
+    wells, activities = snap['registered_wells'], snap['control_activities']
+    well_rows = rows_by_code(wells['well'], len(snap['dictionaries']['well_id']))
+    rows = well_rows[activities['well']]  # A null well_id (-1) lands on the extra slot: no row
+    joined = np.flatnonzero(rows >= 0)
+    last_change = wells['last_status_change'][rows[joined]]
+    date = activities['date'][joined]
+    before = (np.isnat(date) & ~np.isnat(last_change)) | (date < last_change)
+    bad = joined[before]
+    well_ids = snap['dictionaries']['well_id']
+    row = lambda i: {
+        'control_id': str(activities['control_id'][i]),
+        'date': date_value(activities['date'][i]),
+        'well_id': str(well_ids[activities['well'][i]]),
+        'last_status_change': date_value(wells['last_status_change'][rows[i]]),
+        'dateBeforeLastStatusChange': True
+    }
+    return data_validation.report_check('control_activity_dates', len(bad),
+                                        lambda: violations(bad, row, sink), out, sink)
+
+
+def check_future_user_registration_dates(snap, now, out=print, sink=None):
+    data_validation.start_check('future_user_registration_dates', out)
+    users = snap['users']
+    bad = np.flatnonzero(users['registration_date'] > np.datetime64(now, 'ms'))
+    user_ids = snap['dictionaries']['user_id']
+    row = lambda i: {'user_id': str(user_ids[users['user'][i]]),
+                     'registration_date': date_value(users['registration_date'][i])}
+    return data_validation.report_check('future_user_registration_dates', len(bad),
+                                        lambda: violations(bad, row, sink), out, sink)
+
+
+def check_dates_in_future_in_registered_wells(snap, now, out=print, sink=None):
+    data_validation.start_check('dates_in_future_in_registered_wells', out)
+    wells = snap['registered_wells']
+    today = np.datetime64(now, 'ms')
+    bad = np.flatnonzero((wells['last_status_change'] > today) | (wells['authorization_date'] > today))
+    return data_validation.report_check('dates_in_future_in_registered_wells', len(bad),
+                                        lambda: violations(bad, well_dates_row(snap), sink), out, sink)
+
+
+def check_names_length(snap, now, out=print, sink=None):
+    data_validation.start_check('names_length', out)
+    users = snap['users']
+    bad = np.flatnonzero(np.char.str_len(np.asarray(users['name'])) < 3)
+    user_ids = snap['dictionaries']['user_id']
+    row = lambda i: {'user_id': str(user_ids[users['user'][i]]), 'name': str(users['name'][i])}
+    return data_validation.report_check('names_length', len(bad), lambda: violations(bad, row, sink), out, sink)
+
+# Detection: detection.detection_pipeline, step by step
+
+
+def detect_illegal_wells(snap, top_n=detection.DEFAULT_TOP_N, min_z=detection.DEFAULT_MIN_Z,
+                         radius_m=geo.DEFAULT_RADIUS_M):
+    users, wells, readings, activities = (snap['users'], snap['registered_wells'], snap['water_consumption'],
+                                          snap['control_activities'])
+    user_ids, statuses = snap['dictionaries']['user_id'], snap['dictionaries']['status']
+    num_user_codes = len(user_ids)
+
+    # Per-user totals ($group); a null user_id is one more group, in the extra slot
+    slots = np.where(readings['user'] >= 0, readings['user'], num_user_codes)
+    totals = np.bincount(slots, weights=readings['consumption_m3'], minlength=num_user_codes + 1)
+    present = np.flatnonzero(np.bincount(slots, minlength=num_user_codes + 1) > 0)
+    if not len(present):
+        return []
+    values = totals[present]
+    mean, std = float(values.mean()), float(values.std())  # $avg, $stdDevPop
+
+    inspected = np.zeros(len(snap['dictionaries']['well_id']) + 1, dtype=bool)
+    inspected[activities['well']] = True  # -1 marks the extra slot, never a well code
+    inactive = np.flatnonzero(statuses == 'Inactive')
+    inactive_code = int(inactive[0]) if len(inactive) else -2
+    user_rows = rows_by_code(users['user'], num_user_codes)
+
+    docs = []
+    for slot in present[np.argsort(-values, kind='stable')[:top_n]]:
+        total = float(totals[slot])
+        z_score = (total - mean) / std if std > 0 else 0
+        if z_score < min_z:
+            continue
+        code = int(slot) if slot < num_user_codes else -1
+        owned = np.flatnonzero(wells['owner'] == code)
+        unauthorized = np.isnat(wells['authorization_date'][owned])
+        suspect = (wells['status'][owned] == inactive_code) | unauthorized
+        suspect &= ~inspected[wells['well'][owned]]
+        owner_row = user_rows[code] if code >= 0 else -1
+        owner = {'name': str(users['name'][owner_row]), 'address': str(users['address'][owner_row])} \
+            if owner_row >= 0 else None
+        for row, is_unauthorized in zip(owned[suspect], unauthorized[suspect]):
+            docs.append({
+                'user_id': str(user_ids[code]) if code >= 0 else None,
+                'total_consumption': total,
+                'population_mean': mean,
+                'population_std': std,
+                'population_users': len(present),
+                'z_score': z_score,
+                'suspect_wells': {
+                    'well_id': str(snap['dictionaries']['well_id'][wells['well'][row]]),
+                    'status': str(statuses[wells['status'][row]]) if wells['status'][row] >= 0 else None,
+                    'authorization_date': date_value(wells['authorization_date'][row]),
+                    'last_status_change': date_value(wells['last_status_change'][row]),
+                    'location': None if np.isnan(wells['latitude'][row]) else
+                    geo.point(float(wells['latitude'][row]), float(wells['longitude'][row]))
+                },
+                'owner': owner,
+                'unauthorized': bool(is_unauthorized)
+            })
+    docs.sort(key=lambda doc: (not doc['unauthorized'], -doc['z_score']))
+    candidates = [detection.to_candidate(rank, doc) for rank, doc in enumerate(docs, start=1)]
+    return spatial_evidence(snap, candidates, radius_m) if radius_m else candidates
+
+
+def spatial_evidence(snap, candidates, radius_m):
+    # Same evidence as geo.spatial_evidence, from a grid index over every well
+    if not candidates:
+        return candidates
+    wells = snap['registered_wells']
+    grid = geo.GridIndex(wells['latitude'], wells['longitude'], radius_m)
+    well_ids, user_ids = snap['dictionaries']['well_id'], snap['dictionaries']['user_id']
+    for candidate in candidates:
+        latitude, longitude = geo.coordinates(candidate.get('location'))
+        if np.isnan(latitude):
+            continue
+        nearby = grid.within(latitude, longitude, radius_m)
+        nearby = nearby[well_ids[wells['well'][nearby]] != candidate['well_id']]
+        owners = wells['owner'][nearby]
+        owners = owners[owners >= 0]
+        candidate['evidence'].update({
+            'radius_m': radius_m,
+            'nearby_wells': int(len(nearby)),
+            'nearby_owner_wells': int(np.sum(user_ids[owners] == candidate['owner_user_id'])),
+        })
+    return candidates
+
+
+def identify_illegal_well_and_owner(snap, now, out=print, sink=None, top_n=detection.DEFAULT_TOP_N,
+                                    min_z=detection.DEFAULT_MIN_Z):
+    data_validation.start_check('illegal_well_and_owner', out)
+    return data_validation.report_detection(detect_illegal_wells(snap, top_n, min_z), out, sink)
+
+
+# Same names as validation_runner.CHECKS
+CHECKS = {
+    'last_status_change_dates': check_last_status_change_dates,
+    'control_activities_coverage': check_control_activities_coverage,
+    'no_control_activities_for_illegal_well': check_no_control_activities_for_illegal_well,
+    'control_activity_dates': check_control_activity_dates,
+    'future_user_registration_dates': check_future_user_registration_dates,
+    'dates_in_future_in_registered_wells': check_dates_in_future_in_registered_wells,
+    'names_length': check_names_length,
+    'illegal_well_and_owner': identify_illegal_well_and_owner,
+}
+
+
+def run_checks(snap, now=None, out=print, sink=None):
+    now = now or datetime.now()
+    results = []
+    for name, func in CHECKS.items():
+        started = time.perf_counter()
+        result = {'name': name}
+        result.update(func(snap, now, out=out, sink=sink))
+        result['wall_ms'] = (time.perf_counter() - started) * 1000
+        results.append(result)
+    return results
+
+# Online comparison
+
+
+def comparable(result):
+    details = result.get('details') or {}
+    return {
+        'outcome': result['outcome'],
+        'violations': result['violations'],
+        'well_id': details.get('well_id'),
+        'owner_user_id': details.get('owner_user_id'),
+        'wells_with_activities': details.get('wells_with_activities'),
+        'total_legal_wells': details.get('total_legal_wells'),
+    }
+
+
+def verify_online(results, out=print):
+    import validation_runner  # Needs the cluster
+    online = {result['name']: result
+              for result in validation_runner.run_checks(validation_runner.CHECKS, sequential=False)}
+    mismatches = 0
+    for result in results:
+        offline_view = comparable(result)
+        online_view = comparable(online[result['name']]) if result['name'] in online else None
+        same = offline_view == online_view
+        mismatches += not same
+        out(f"{'SAME' if same else 'DIFF':<5} {result['name']}" + ('' if same else f": offline {offline_view}, online {online_view}"))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the validation checks against a columnar snapshot.')
+    parser.add_argument('path', help='Snapshot directory (see snapshot.py)')
+    parser.add_argument('--as-of', default=None, help="ISO date-time the future-date checks compare with (default: now)")
+    parser.add_argument('--report', default=None, help='Write a JSON report to this path')
+    parser.add_argument('--violations', default=None, help='Stream every violation as NDJSON to this path')
+    parser.add_argument('--quiet', action='store_true', help='Only print the summary')
+    parser.add_argument('--verify-online', action='store_true', help='Also run the checks on the cluster and diff')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snap = snapshots.load(args.path)
+    now = datetime.fromisoformat(args.as_of) if args.as_of else None
+    sink = ReportSink(args.violations) if args.violations else None
+    try:
+        results = run_checks(snap, now, out=(lambda line: None) if args.quiet else print, sink=sink)
+    finally:
+        if sink is not None:
+            sink.close()
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    print("\n=== Offline validation summary ===")
+    for result in results:
+        print(f"{result['outcome']:<8} {result['name']:<40} violations: {result['violations']:<8} "
+              f"wall: {result['wall_ms']:9.1f} ms")
+    print(f"Total wall time: {wall_ms:.1f} ms (snapshot exported {snap['manifest']['exported_at']})")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'generated_at': datetime.now().isoformat(), 'snapshot': snap['manifest'],
+                       'wall_ms': wall_ms, 'checks': results}, f, indent=2, default=str)
+        print(f"Report written to {args.report}")
+    if args.verify_online:
+        print("\n=== Offline vs online ===")
+        if verify_online(results):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
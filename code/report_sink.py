@@ -0,0 +1,28 @@
+import json
+import threading
+
+# Streaming report sink: every violation a check finds is appended as one JSON
+# line, so the report grows on disk instead of in memory. Safe to share
+# between the concurrently running checks.
+
+
+class ReportSink:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, check, row):
+        line = json.dumps({'check': check, **row}, default=str, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
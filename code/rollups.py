@@ -0,0 +1,227 @@
+from bson import ObjectId
+import argparse
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+
+import connection
+from checkpoints import load_checkpoint, replace_checkpoint
+
+# Consumption rollups: a materialized per-user, per-month view of
+# water_consumption kept up to date with $merge. Each refresh only aggregates
+# the readings added since the previous one (by _id) and adds them to the
+# existing month documents, so the top-consumer queries read a fraction of the
+# raw readings.
+#
+# ObjectIds come from the clients' clocks, so concurrent writers commit them
+# slightly out of order: a reading with a smaller _id can land after a refresh
+# has moved past it. A refresh therefore stops at the readings created more
+# than GRACE_SECONDS ago; newer ones wait for a later refresh.
+#
+# Refreshes are safe to repeat and to run concurrently. A refresh first claims
+# its window in the checkpoint with a compare-and-set ('pending'), so two
+# refreshes never add the same readings; a refresh that fails or times out
+# part way leaves the claim behind and the next one merges the same window
+# again. Every month document records the end of the last window added to it
+# ('through'), and the merge skips the months that already have it, so a
+# retried window only completes the months the failed attempt did not reach.
+# Until then verify() reports the half-merged window as mismatches.
+
+ROLLUP_COLLECTION = 'consumption_monthly'
+CHECKPOINT_KEY = 'rollup:consumption_monthly'
+DEFAULT_TOLERANCE = 1e-6  # Relative difference accepted between raw and rollup totals
+GRACE_SECONDS = 60  # Age a reading's _id must reach before a refresh includes it
+
+
+def month_expression(date_field):
+    # First day of the month ($dateTrunc needs MongoDB 5.0)
+    return {
+        '$dateFromParts': {
+            'year': { '$year': date_field },
+            'month': { '$month': date_field }
+        }
+    }
+
+
+def rollup_pipeline(window):
+    through = window['$lte']
+    return [
+        { '$match': { '_id': window } },
+        {
+            '$group': {
+                '_id': { 'user_id': "$user_id", 'month': month_expression("$date") },
+                'total_m3': { '$sum': "$consumption_m3" },
+                'readings': { '$sum': 1 }
+            }
+        },
+        { '$set': { 'through': through } },
+        {
+            '$merge': {
+                'into': ROLLUP_COLLECTION,
+                'on': "_id",
+                'whenMatched': [
+                    {
+                        # Add the window once: a month that already has it is left as is
+                        '$set': {
+                            'total_m3': {
+                                '$cond': [{ '$lt': ["$through", through] },
+                                          { '$add': ["$total_m3", "$$new.total_m3"] }, "$total_m3"]
+                            },
+                            'readings': {
+                                '$cond': [{ '$lt': ["$through", through] },
+                                          { '$add': ["$readings", "$$new.readings"] }, "$readings"]
+                            },
+                            'through': { '$max': ["$through", through] }
+                        }
+                    }
+                ],
+                'whenNotMatched': "insert"
+            }
+        }
+    ]
+
+
+def claim_window(db, grace):
+    # (start, end) of the window to merge: the one a failed refresh left
+    # claimed, or the readings since the checkpoint, claimed here. None when
+    # there is nothing to do or another refresh claimed the window first.
+    checkpoint = load_checkpoint(db, CHECKPOINT_KEY)
+    last_id = checkpoint.get('last_id')
+    if checkpoint.get('pending') is not None:
+        return last_id, checkpoint['pending']
+
+    settled = {}  # grace 0: everything, including this second's readings
+    if grace:
+        settled = { '_id': { '$lt': ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=grace)) } }
+    newest = db.water_consumption.find_one(settled, {'_id': 1}, sort=[('_id', -1)])
+    if newest is None or (last_id is not None and newest['_id'] <= last_id):
+        return None
+    if not replace_checkpoint(db, CHECKPOINT_KEY, {'last_id': last_id, 'pending': None}, upsert=True,
+                              pending=newest['_id']):
+        return None
+    return last_id, newest['_id']
+
+
+def refresh(db, out=print, grace=GRACE_SECONDS):
+    db = connection.primary(db)  # A lagging secondary would let the checkpoint skip readings
+    claimed = claim_window(db, grace)
+    if claimed is None:
+        return 0
+
+    start, end = claimed
+    window = { '$lte': end }
+    if start is not None:
+        window['$gt'] = start
+    started = time.perf_counter()
+    readings = db.water_consumption.count_documents({ '_id': window })
+    db.water_consumption.aggregate(rollup_pipeline(window), allowDiskUse=True)
+    replace_checkpoint(db, CHECKPOINT_KEY, {'pending': end}, last_id=end, pending=None)
+    out(f"Rolled up {readings} new reading(s) into {ROLLUP_COLLECTION} ({time.perf_counter() - started:.1f}s)")
+    return readings
+
+
+def rebuild(db, out=print, grace=GRACE_SECONDS):
+    db[ROLLUP_COLLECTION].drop()
+    db.checkpoints.delete_one({ '_id': CHECKPOINT_KEY })
+    return refresh(db, out, grace)
+
+# Reading the rollup
+
+
+def user_totals_stages():
+    # Total consumption per user from the rollup, as {_id: user_id, total}
+    return [
+        {
+            '$group': {
+                '_id': "$_id.user_id",
+                'total': { '$sum': "$total_m3" }
+            }
+        }
+    ]
+
+# Consistency check: per-user totals and reading counts from the raw readings
+# the rollup covers, side by side with the rollup's
+
+
+def verify(db, tolerance=DEFAULT_TOLERANCE, out=print):
+    last_id = load_checkpoint(db, CHECKPOINT_KEY).get('last_id')
+    if last_id is None:
+        out(f"WARN: {ROLLUP_COLLECTION} has not been built yet.")
+        return None
+
+    mismatches = list(db.water_consumption.aggregate([
+        { '$match': { '_id': { '$lte': last_id } } },
+        {
+            '$group': {
+                '_id': "$user_id",
+                'raw_total': { '$sum': "$consumption_m3" },
+                'raw_readings': { '$sum': 1 }
+            }
+        },
+        {
+            '$unionWith': {
+                'coll': ROLLUP_COLLECTION,
+                'pipeline': [
+                    {
+                        '$group': {
+                            '_id': "$_id.user_id",
+                            'rollup_total': { '$sum': "$total_m3" },
+                            'rollup_readings': { '$sum': "$readings" }
+                        }
+                    }
+                ]
+            }
+        },
+        {
+            '$group': {
+                '_id': "$_id",
+                'raw_total': { '$sum': "$raw_total" },
+                'raw_readings': { '$sum': "$raw_readings" },
+                'rollup_total': { '$sum': "$rollup_total" },
+                'rollup_readings': { '$sum': "$rollup_readings" }
+            }
+        },
+        {
+            '$match': {
+                '$expr': {
+                    '$or': [
+                        { '$ne': ["$raw_readings", "$rollup_readings"] },
+                        {
+                            '$gt': [
+                                { '$abs': { '$subtract': ["$raw_total", "$rollup_total"] } },
+                                { '$multiply': [tolerance, { '$max': [1, { '$abs': "$raw_total" }] }] }
+                            ]
+                        }
+                    ]
+                }
+            }
+        },
+        { '$limit': 20 }
+    ], allowDiskUse=True))
+
+    if not mismatches:
+        out(f"PASS: {ROLLUP_COLLECTION} matches water_consumption.")
+    else:
+        out(f"FAIL: {ROLLUP_COLLECTION} disagrees with water_consumption (first {len(mismatches)} users):")
+        for row in mismatches:
+            out(f" - User ID: {row['_id']}, Raw: {row['raw_total']:.3f} m3 / {row['raw_readings']} readings, "
+                f"Rollup: {row['rollup_total']:.3f} m3 / {row['rollup_readings']} readings")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the monthly consumption rollup.')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the rollup from scratch')
+    parser.add_argument('--verify', action='store_true', help='Compare the rollup against the raw readings')
+    parser.add_argument('--grace', type=float, default=GRACE_SECONDS,
+                        help='Leave out readings created in the last GRACE seconds (0 once writers have stopped)')
+    args = parser.parse_args()
+
+    db = connection.get_database()
+    if args.rebuild:
+        rebuild(db, grace=args.grace)
+    else:
+        refresh(db, grace=args.grace)
+    if args.verify and verify(db):
+        sys.exit(1)
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from datetime import datetime
+
+import bucketing
+import connection
+import geo
+
+# Columnar snapshot of the village collections for offline validation (see
+# offline_validation.py). Every field the checks read becomes one .npy file
+# per column: dates as datetime64[ms] (NaT for null), readings as float64,
+# text as fixed-width unicode and every id dictionary-encoded to int32 codes
+# shared across collections (owner_user_id and water_consumption.user_id use
+# the users dictionary, control_activities.well_id the wells one). Numeric
+# columns are written straight into memory-mapped files while the cursor
+# streams, so the readings never have to fit in memory, and load() maps them
+# back without reading them.
+#
+# Each collection is exported up to the newest _id seen when its export
+# starts, like the incremental checks, so rows inserted meanwhile are left out
+# instead of half-included.
+
+BATCH_SIZE = 100000  # Rows converted to arrays at a time
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+DATE = 'datetime64[ms]'
+MISSING = -1  # Code of a null id
+
+
+class Dictionary:
+    # Value -> int32 code, in order of first appearance
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def values(self):
+        return np.array(list(self.codes), dtype='U') if self.codes else np.array([], dtype='U1')
+
+
+def to_dates(values):
+    return np.array(values, dtype=DATE)  # None becomes NaT
+
+
+class ColumnWriter:
+    # Numeric columns go to memory-mapped .npy files sized up front; text
+    # columns are collected and written at the end (their width is only known
+    # then). The size is a count taken before the cursor runs, so documents
+    # inserted meanwhile below the _id bound can outnumber it: the files then
+    # grow.
+    def __init__(self, directory, capacity, numeric, text=()):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows = 0
+        self.numeric = {name: self._open(name, dtype, capacity) for name, dtype in numeric.items()}
+        self.text = {name: [] for name in text}
+
+    def _open(self, name, dtype, capacity, suffix=''):
+        return np.lib.format.open_memmap(os.path.join(self.directory, f"{name}.npy{suffix}"), mode='w+',
+                                         dtype=dtype, shape=(capacity,))
+
+    def _grow(self, needed):
+        for name in list(self.numeric):
+            column = self.numeric.pop(name)
+            grown = self._open(name, column.dtype, max(needed, 2 * len(column)), suffix='.tmp')
+            grown[:self.rows] = column[:self.rows]
+            grown.flush()
+            del column, grown  # Unmap both before the file is replaced
+            path = os.path.join(self.directory, f"{name}.npy")
+            os.replace(f"{path}.tmp", path)
+            self.numeric[name] = np.load(path, mmap_mode='r+')
+
+    def append(self, columns):
+        count = len(next(iter(columns.values())))
+        end = self.rows + count
+        if self.numeric and end > len(next(iter(self.numeric.values()))):
+            self._grow(end)
+        for name, values in columns.items():
+            if name in self.numeric:
+                self.numeric[name][self.rows:end] = values
+            else:
+                self.text[name].extend(values)
+        self.rows = end
+
+    def close(self):
+        for name in list(self.numeric):
+            column = self.numeric.pop(name)
+            column.flush()
+            if self.rows < len(column):  # Documents deleted while exporting, or room left by _grow
+                data = np.array(column[:self.rows])
+                del column  # Unmap before the file is rewritten
+                np.save(os.path.join(self.directory, f"{name}.npy"), data)
+        for name, values in self.text.items():
+            np.save(os.path.join(self.directory, f"{name}.npy"),
+                    np.array(values, dtype='U') if values else np.array([], dtype='U1'))
+        return self.rows
+
+
+def batches(cursor, size=BATCH_SIZE):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bounded(collection):
+    # Everything up to the newest _id right now
+    newest = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    return {} if newest is None else {'_id': {'$lte': newest['_id']}}
+
+
+def export_collection(collection, directory, projection, numeric, text, convert):
+    query = bounded(collection)
+    writer = ColumnWriter(directory, collection.count_documents(query), numeric, text)
+    cursor = collection.find(query, projection, batch_size=10000).sort('_id', 1)
+    for batch in batches(cursor):
+        writer.append(convert(batch))
+    return writer.close()
+
+# Per-collection conversions
+
+
+def convert_users(users):
+    def convert(batch):
+        return {
+            'user': np.array([users.encode(doc.get('user_id')) for doc in batch], dtype=np.int32),
+            'registration_date': to_dates([doc.get('registration_date') for doc in batch]),
+            'name': [doc.get('name') or '' for doc in batch],
+            'address': [doc.get('address') or '' for doc in batch],
+        }
+    return convert
+
+
+def convert_wells(users, wells, statuses):
+    def convert(batch):
+        points = [geo.coordinates(doc.get('location')) for doc in batch]  # GeoJSON or not yet migrated
+        return {
+            'well': np.array([wells.encode(doc.get('well_id')) for doc in batch], dtype=np.int32),
+            'owner': np.array([users.encode(doc.get('owner_user_id')) for doc in batch], dtype=np.int32),
+            'authorization_date': to_dates([doc.get('authorization_date') for doc in batch]),
+            'last_status_change': to_dates([doc.get('last_status_change') for doc in batch]),
+            'status': np.array([statuses.encode(doc.get('status')) for doc in batch], dtype=np.int8),
+            'latitude': np.array([latitude for latitude, _ in points], dtype=np.float64),
+            'longitude': np.array([longitude for _, longitude in points], dtype=np.float64),
+        }
+    return convert
+
+
+def convert_readings(users):
+    def convert(batch):
+        return {
+            'user': np.array([users.encode(doc.get('user_id')) for doc in batch], dtype=np.int32),
+            'date': to_dates([doc.get('date') for doc in batch]),
+            'consumption_m3': np.array([doc.get('consumption_m3', 0.0) for doc in batch], dtype=np.float64),
+        }
+    return convert
+
+
+def convert_buckets(users):
+    # Bucketed layout: expanded back to one row per reading
+    def convert(batch):
+        readings = [reading for bucket in batch for reading in bucketing.expand_bucket(bucket)]
+        return convert_readings(users)(readings) if readings else {
+            'user': np.array([], dtype=np.int32), 'date': to_dates([]), 'consumption_m3': np.array([])}
+    return convert
+
+
+def convert_activities(wells):
+    def convert(batch):
+        return {
+            'control_id': [doc.get('control_id') or '' for doc in batch],
+            'well': np.array([wells.encode(doc.get('well_id')) for doc in batch], dtype=np.int32),
+            'date': to_dates([doc.get('date') for doc in batch]),
+        }
+    return convert
+
+
+def export(db, path, out=print):
+    started = time.perf_counter()
+    users, wells, statuses = Dictionary(), Dictionary(), Dictionary()
+    rows = {}
+
+    def run(name, *args):
+        collection_started = time.perf_counter()
+        rows[name] = export_collection(*args)
+        out(f"Exported {rows[name]} {name} rows ({time.perf_counter() - collection_started:.1f}s)")
+
+    run('users', db.users, os.path.join(path, 'users'),
+        {'_id': 1, 'user_id': 1, 'name': 1, 'address': 1, 'registration_date': 1},
+        {'user': np.int32, 'registration_date': DATE}, ('name', 'address'), convert_users(users))
+    run('registered_wells', db.registered_wells, os.path.join(path, 'registered_wells'),
+        {'_id': 1, 'well_id': 1, 'owner_user_id': 1, 'authorization_date': 1, 'last_status_change': 1,
+         'status': 1, 'location': 1},
+        {'well': np.int32, 'owner': np.int32, 'authorization_date': DATE, 'last_status_change': DATE,
+         'status': np.int8, 'latitude': np.float64, 'longitude': np.float64}, (), convert_wells(users, wells, statuses))
+
+    reading_columns = {'user': np.int32, 'date': DATE, 'consumption_m3': np.float64}
+    if bucketing.loaded_layout(db) == 'buckets':
+        # Bucket counts are not reading counts: size the columns from the buckets
+        buckets = db[bucketing.BUCKET_COLLECTION]
+        query = bounded(buckets)
+        counted = list(buckets.aggregate([{'$match': query}, {'$group': {'_id': None, 'n': {'$sum': "$count"}}}]))
+        writer = ColumnWriter(os.path.join(path, 'water_consumption'), counted[0]['n'] if counted else 0,
+                              reading_columns)
+        for batch in batches(buckets.find(query, {'_id': 0}).sort('_id', 1), BATCH_SIZE // 4):
+            writer.append(convert_buckets(users)(batch))
+        rows['water_consumption'] = writer.close()
+        out(f"Exported {rows['water_consumption']} water_consumption rows (from {bucketing.BUCKET_COLLECTION})")
+    else:
+        run('water_consumption', db.water_consumption, os.path.join(path, 'water_consumption'),
+            {'_id': 1, 'user_id': 1, 'date': 1, 'consumption_m3': 1}, reading_columns, (), convert_readings(users))
+
+    run('control_activities', db.control_activities, os.path.join(path, 'control_activities'),
+        {'_id': 1, 'control_id': 1, 'well_id': 1, 'date': 1},
+        {'well': np.int32, 'date': DATE}, ('control_id',), convert_activities(wells))
+
+    os.makedirs(os.path.join(path, 'dictionaries'), exist_ok=True)
+    for name, dictionary in (('user_id', users), ('well_id', wells), ('status', statuses)):
+        np.save(os.path.join(path, 'dictionaries', f"{name}.npy"), dictionary.values())
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'exported_at': datetime.now().isoformat(),
+        'database': db.name,
+        'rows': rows,
+        'dictionaries': {'user_id': len(users.codes), 'well_id': len(wells.codes), 'status': len(statuses.codes)},
+    }
+    with open(os.path.join(path, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    out(f"Snapshot written to {path} ({time.perf_counter() - started:.1f}s)")
+    return manifest
+
+# Loading: every column memory-mapped, nothing read until used
+
+
+def load(path):
+    with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {path}")
+    snapshot = {'manifest': manifest}
+    for name in ('users', 'registered_wells', 'water_consumption', 'control_activities', 'dictionaries'):
+        directory = os.path.join(path, name)
+        snapshot[name] = {
+            filename[:-len('.npy')]: np.load(os.path.join(directory, filename), mmap_mode='r')
+            for filename in sorted(os.listdir(directory)) if filename.endswith('.npy')
+        }
+    return snapshot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the village collections to a columnar snapshot.')
+    parser.add_argument('path', help='Snapshot directory')
+    args = parser.parse_args()
+
+    export(connection.get_database('validation'), args.path)
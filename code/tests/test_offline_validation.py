@@ -0,0 +1,175 @@
+import numpy as np
+import pytest
+
+from datetime import datetime
+
+import geo
+import offline_validation
+import snapshot
+
+# A hand-built snapshot, converted with the same code as snapshot.export, and
+# the results the online checks give for the same documents. Null and missing
+# dates both become NaT in the snapshot; the expected counts follow the
+# server's ordering, where null and missing sort before any date.
+
+NOW = datetime(2025, 1, 1)
+MISSING = object()  # Field left out of the document
+
+
+def doc(**fields):
+    return {key: value for key, value in fields.items() if value is not MISSING}
+
+
+def near(point, metres_north):
+    latitude, longitude = point
+    return geo.point(latitude + metres_north / 111195, longitude)
+
+
+ORIGIN = (42.80, -5.63)
+
+USERS = [
+    doc(user_id='u1', name='Ana Lopez', address='Calle 1', registration_date=datetime(2020, 1, 1)),
+    doc(user_id='u2', name='Al', address='Calle 2', registration_date=datetime(2026, 1, 1)),  # Short, future
+    doc(user_id='u3', name='Bea Ruiz', address='Calle 3', registration_date=None),
+    doc(user_id='u4', name='Carlos Gil', address='Calle 4', registration_date=MISSING),
+]
+
+WELLS = [
+    # Consistent
+    doc(well_id='w1', owner_user_id='u1', status='Active', location=near(ORIGIN, 100),
+        authorization_date=datetime(2010, 1, 1), last_status_change=datetime(2012, 1, 1)),
+    # last_status_change before authorization_date
+    doc(well_id='w2', owner_user_id='u1', status='Active', location=near(ORIGIN, 5000),
+        authorization_date=datetime(2015, 1, 1), last_status_change=datetime(2014, 1, 1)),
+    # Null / missing last_status_change of an authorized well: before the authorization
+    doc(well_id='w3', owner_user_id='u2', status='Active', location=near(ORIGIN, 6000),
+        authorization_date=datetime(2010, 1, 1), last_status_change=None),
+    doc(well_id='w4', owner_user_id='u3', status='Active', location=near(ORIGIN, 7000),
+        authorization_date=datetime(2010, 1, 1), last_status_change=MISSING),
+    # The illegal well (first one without authorization), inspected
+    doc(well_id='w5', owner_user_id='u4', status='Inactive', location=near(ORIGIN, -50),
+        authorization_date=None, last_status_change=None),
+    # Missing authorization: neither legal nor a date violation; location not migrated to GeoJSON
+    doc(well_id='w6', owner_user_id='u3', status='Active',
+        location={'latitude': ORIGIN[0] + 0.1, 'longitude': ORIGIN[1]},
+        authorization_date=MISSING, last_status_change=datetime(2011, 1, 1)),
+    # Dates in the future
+    doc(well_id='w7', owner_user_id='u1', status='Active', location=near(ORIGIN, 9000),
+        authorization_date=datetime(2024, 6, 1), last_status_change=datetime(2026, 2, 1)),
+    doc(well_id='w8', owner_user_id='u2', status='Active', location=MISSING,
+        authorization_date=datetime(2026, 3, 1), last_status_change=datetime(2026, 4, 1)),
+    # Uninspected, unauthorized well of the heavy consumer
+    doc(well_id='w9', owner_user_id='u4', status='Inactive', location=geo.point(*ORIGIN),
+        authorization_date=None, last_status_change=None),
+]
+
+ACTIVITIES = [
+    doc(control_id='a1', well_id='w1', date=datetime(2013, 1, 1)),
+    doc(control_id='a2', well_id='w1', date=datetime(2011, 1, 1)),  # Before the status change
+    doc(control_id='a3', well_id='w2', date=None),  # Null date: before any status change
+    doc(control_id='a4', well_id='w2', date=MISSING),  # Same for a missing one
+    doc(control_id='a5', well_id='w3', date=datetime(2011, 1, 1)),  # Null status change: never after
+    doc(control_id='a6', well_id='w3', date=None),  # Null against null
+    doc(control_id='a7', well_id='w4', date=datetime(2011, 1, 1)),  # Missing status change
+    doc(control_id='a8', well_id='unknown', date=datetime(2011, 1, 1)),  # No well: dropped by the join
+    doc(control_id='a9', well_id='w5', date=datetime(2012, 1, 1)),  # Inspection of the illegal well
+]
+
+READINGS = [
+    doc(user_id='u1', date=datetime(2024, 1, 1), consumption_m3=10.0),
+    doc(user_id='u1', date=datetime(2024, 1, 8), consumption_m3=10.0),
+    doc(user_id='u2', date=datetime(2024, 1, 1), consumption_m3=12.0),
+    doc(user_id='u3', date=datetime(2024, 1, 1), consumption_m3=8.0),
+    doc(user_id='u4', date=datetime(2024, 1, 1), consumption_m3=100.0),
+    doc(user_id='u4', date=datetime(2024, 1, 8), consumption_m3=100.0),
+    doc(user_id=None, date=datetime(2024, 1, 1), consumption_m3=9.0),  # Grouped as one more user
+]
+
+EXPECTED = {
+    'last_status_change_dates': ('FAIL', 3),
+    'control_activities_coverage': ('WARN', 0),
+    'no_control_activities_for_illegal_well': ('FAIL', 1),
+    'control_activity_dates': ('FAIL', 3),
+    'future_user_registration_dates': ('FAIL', 1),
+    'dates_in_future_in_registered_wells': ('FAIL', 2),
+    'names_length': ('FAIL', 1),
+    'illegal_well_and_owner': ('WARN', 0),  # Nobody reaches the default z-score with 5 users
+}
+
+
+def columns(converted):
+    return {name: np.array(values, dtype='U') if isinstance(values, list) else values
+            for name, values in converted.items()}
+
+
+def build_snapshot():
+    users, wells, statuses = snapshot.Dictionary(), snapshot.Dictionary(), snapshot.Dictionary()
+    snap = {
+        'users': columns(snapshot.convert_users(users)(USERS)),
+        'registered_wells': columns(snapshot.convert_wells(users, wells, statuses)(WELLS)),
+        'water_consumption': columns(snapshot.convert_readings(users)(READINGS)),
+        'control_activities': columns(snapshot.convert_activities(wells)(ACTIVITIES)),
+    }
+    snap['dictionaries'] = {'user_id': users.values(), 'well_id': wells.values(), 'status': statuses.values()}
+    return snap
+
+
+class ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, check, row):
+        self.rows.append((check, row))
+
+
+@pytest.fixture
+def snap():
+    return build_snapshot()
+
+
+def test_checks_match_online_results(snap):
+    results = offline_validation.run_checks(snap, NOW, out=lambda line: None)
+    assert {result['name']: (result['outcome'], result['violations']) for result in results} == EXPECTED
+
+
+def test_coverage_counts_the_same_wells_as_the_server(snap):
+    result = offline_validation.check_control_activities_coverage(snap, NOW, out=lambda line: None)
+    # Every distinct well_id with an activity, unknown ones included, over the authorized wells
+    assert result['details']['wells_with_activities'] == 6
+    assert result['details']['total_legal_wells'] == 6
+
+
+def test_violations_report_null_dates_as_none(snap):
+    sink = ListSink()
+    offline_validation.check_last_status_change_dates(snap, NOW, out=lambda line: None, sink=sink)
+    rows = {row['well_id']: row for _, row in sink.rows}
+    assert sorted(rows) == ['w2', 'w3', 'w4']
+    assert rows['w3']['last_status_change'] is None
+    assert rows['w4']['last_status_change'] is None
+
+    sink = ListSink()
+    offline_validation.check_control_activity_dates(snap, NOW, out=lambda line: None, sink=sink)
+    rows = {row['control_id']: row for _, row in sink.rows}
+    assert sorted(rows) == ['a2', 'a3', 'a4']
+    assert rows['a3']['date'] is None and rows['a4']['date'] is None
+
+
+def test_locations_of_both_shapes_and_missing_ones(snap):
+    wells = snap['registered_wells']
+    assert wells['latitude'][5] == pytest.approx(ORIGIN[0] + 0.1)
+    assert np.isnan(wells['latitude'][7]) and np.isnan(wells['longitude'][7])
+
+
+def test_detection_ranks_the_uninspected_unauthorized_well(snap):
+    totals = np.array([20.0, 12.0, 8.0, 200.0, 9.0])
+    candidates = offline_validation.detect_illegal_wells(snap, min_z=1.0)
+
+    assert [candidate['well_id'] for candidate in candidates] == ['w9']  # w5 is inspected
+    best = candidates[0]
+    assert best['owner_user_id'] == 'u4' and best['owner_name'] == 'Carlos Gil'
+    assert best['evidence']['unauthorized'] is True
+    assert best['evidence']['population_users'] == 5
+    assert best['evidence']['z_score'] == pytest.approx((200.0 - totals.mean()) / totals.std())
+    # w5 (same owner, 50 m) and w1 (100 m) are within the default radius
+    assert best['evidence']['nearby_wells'] == 2
+    assert best['evidence']['nearby_owner_wells'] == 1
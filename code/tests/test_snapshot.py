@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+
+import snapshot
+
+
+def test_column_writer_grows_past_its_initial_size(tmp_path):
+    # More rows than counted when the export started (inserted meanwhile)
+    writer = snapshot.ColumnWriter(str(tmp_path), 2, {'value': np.float64}, ('label',))
+    for start in range(0, 7, 2):
+        values = np.arange(start, min(start + 2, 7), dtype=np.float64)
+        writer.append({'value': values, 'label': [f"row {int(v)}" for v in values]})
+
+    assert writer.close() == 7
+    assert np.load(os.path.join(tmp_path, 'value.npy')).tolist() == list(range(7))
+    assert np.load(os.path.join(tmp_path, 'label.npy')).tolist() == [f"row {i}" for i in range(7)]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_column_writer_trims_unused_rows(tmp_path):
+    # Fewer rows than counted (deleted meanwhile)
+    writer = snapshot.ColumnWriter(str(tmp_path), 10, {'value': np.int32})
+    writer.append({'value': np.array([1, 2, 3], dtype=np.int32)})
+
+    assert writer.close() == 3
+    assert np.load(os.path.join(tmp_path, 'value.npy')).tolist() == [1, 2, 3]
@@ -0,0 +1,144 @@
+from faker import Faker
+import json
+import math
+import os
+import random
+
+from functools import lru_cache
+
+# Synthetic text pools: names, addresses and observation sentences are
+# generated once with Faker, cached on disk keyed by locale, seed and size, and
+# then sampled by index. Per-record cost no longer depends on Faker.
+
+CACHE_DIR = os.environ.get('VILLAGE_TEXT_CACHE',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'text_pools'))
+DEFAULT_POOL_SIZE = 20000  # Entries per pool
+NAME_PART_SIZE = 5000  # Draws used to collect distinct first/last names
+
+# Pool building and on-disk cache
+
+
+def cache_path(locale, seed, size):
+    return os.path.join(CACHE_DIR, f"{locale}-{seed}-{size}.json")
+
+
+def build_pools(locale, seed, size):
+    fake = Faker(locale)
+    fake.seed_instance(seed)
+    return {
+        'names': [fake.name() for _ in range(size)],
+        'addresses': [fake.address().split('\n')[0].rstrip() for _ in range(size)],
+        'sentences': [fake.sentence(nb_words=10) for _ in range(size)],
+        # Name parts for collision-free names; sorted so the cache is stable
+        'first_names': sorted({fake.first_name() for _ in range(NAME_PART_SIZE)}),
+        'last_names': sorted({fake.last_name() for _ in range(NAME_PART_SIZE)}),
+    }
+
+
+@lru_cache(maxsize=None)
+def load_pools(locale, seed=0, size=DEFAULT_POOL_SIZE):
+    path = cache_path(locale, seed, size)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    pools = build_pools(locale, seed, size)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write then rename, so concurrent workers never read a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(pools, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return pools
+
+# Text sources. Both expose the same interface: single draws for the record by
+# record engine and batch draws for the vectorized one. `rng` is either a
+# random.Random or a numpy Generator.
+
+
+def _randbelow(rng, n):
+    if isinstance(rng, random.Random):
+        return rng.randrange(n)
+    return int(rng.integers(0, n))
+
+
+def _indexes(rng, n, count):
+    if isinstance(rng, random.Random):
+        return [rng.randrange(n) for _ in range(count)]
+    return rng.integers(0, n, count).tolist()
+
+
+class FakerText:
+    # Original behaviour: one Faker call per record
+    def __init__(self, fake):
+        self.fake = fake
+
+    def name(self, rng, user_index):
+        return self.fake.name()
+
+    def address(self, rng):
+        return self.fake.address().split('\n')[0].rstrip()
+
+    def sentence(self, rng):
+        return self.fake.sentence(nb_words=10)
+
+    def names(self, rng, user_indexes):
+        return [self.name(rng, user_index) for user_index in user_indexes]
+
+    def addresses(self, rng, count):
+        return [self.address(rng) for _ in range(count)]
+
+    def sentences(self, rng, count):
+        return [self.sentence(rng) for _ in range(count)]
+
+
+class PooledText:
+    def __init__(self, pools, unique_names=False, seed=0):
+        self.pools = pools
+        self.unique_names = unique_names
+        self.first_names = pools['first_names']
+        self.last_names = pools['last_names']
+        # Unique names map the global user index through a fixed permutation of
+        # every (first name, surname, surname) combination
+        self.name_capacity = len(self.first_names) * len(self.last_names) ** 2
+        permutation_rng = random.Random(f"names:{seed}")
+        self._offset = permutation_rng.randrange(self.name_capacity)
+        self._stride = permutation_rng.randrange(1, self.name_capacity)
+        while math.gcd(self._stride, self.name_capacity) != 1:
+            self._stride += 1
+
+    def unique_name(self, user_index):
+        if user_index >= self.name_capacity:
+            raise ValueError(f"Only {self.name_capacity} unique names are available")
+        k = (user_index * self._stride + self._offset) % self.name_capacity
+        k, second = divmod(k, len(self.last_names))
+        first, surname = divmod(k, len(self.last_names))
+        return f"{self.first_names[first]} {self.last_names[surname]} {self.last_names[second]}"
+
+    def name(self, rng, user_index):
+        if self.unique_names:
+            return self.unique_name(user_index)
+        names = self.pools['names']
+        return names[_randbelow(rng, len(names))]
+
+    def address(self, rng):
+        addresses = self.pools['addresses']
+        return addresses[_randbelow(rng, len(addresses))]
+
+    def sentence(self, rng):
+        sentences = self.pools['sentences']
+        return sentences[_randbelow(rng, len(sentences))]
+
+    def names(self, rng, user_indexes):
+        if self.unique_names:
+            return [self.unique_name(user_index) for user_index in user_indexes]
+        names = self.pools['names']
+        return [names[i] for i in _indexes(rng, len(names), len(user_indexes))]
+
+    def addresses(self, rng, count):
+        addresses = self.pools['addresses']
+        return [addresses[i] for i in _indexes(rng, len(addresses), count)]
+
+    def sentences(self, rng, count):
+        sentences = self.pools['sentences']
+        return [sentences[i] for i in _indexes(rng, len(sentences), count)]
@@ -0,0 +1,203 @@
+import argparse
+import json
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import pymongo
+from pymongo.errors import PyMongoError
+
+import data_validation
+import detection
+import indexes
+import instrumentation
+from report_sink import ReportSink
+
+# Validation runner: checks are registered as units with dependencies and run
+# concurrently on a thread pool as soon as their dependencies are done. Every
+# check runs under its own timeout (pymongo.timeout puts a deadline on each of
+# its queries) and ends up in a JSON report with its outcome, violation count,
+# wall time and time spent in database commands.
+#
+# The consumption rollup detection reads is refreshed first, as its own step
+# outside the per-check timeouts; if that fails, detection reads the rollup as
+# of its last refresh.
+
+DEFAULT_TIMEOUT = 120  # Seconds per check
+DEFAULT_WORKERS = 4
+
+
+def check(name, func, depends_on=(), timeout=DEFAULT_TIMEOUT):
+    return {'name': name, 'func': func, 'depends_on': list(depends_on), 'timeout': timeout}
+
+
+CHECKS = [
+    check('last_status_change_dates', data_validation.check_last_status_change_dates),
+    check('control_activities_coverage', data_validation.check_control_activities_coverage),
+    check('no_control_activities_for_illegal_well', data_validation.check_no_control_activities_for_illegal_well),
+    check('control_activity_dates', data_validation.check_control_activity_dates),
+    check('future_user_registration_dates', data_validation.check_future_user_registration_dates),
+    check('dates_in_future_in_registered_wells', data_validation.check_dates_in_future_in_registered_wells),
+    check('names_length', data_validation.check_names_length),
+    # Detection assumes the illegal well was never inspected
+    check('illegal_well_and_owner', data_validation.identify_illegal_well_and_owner,
+          depends_on=['no_control_activities_for_illegal_well']),
+]
+
+# Running a single check
+
+
+def run_check(unit, out=None, sink=None):
+    lines = []
+    started = time.perf_counter()
+    data_validation.command_timer.reset()
+    result = {'name': unit['name']}
+    try:
+        with pymongo.timeout(unit['timeout']), instrumentation.tagged(unit['name']):
+            result.update(unit['func'](out=out or lines.append, sink=sink))
+    except PyMongoError as exc:
+        result.update({'outcome': 'TIMEOUT' if exc.timeout else 'ERROR', 'violations': None, 'error': str(exc)})
+    except Exception as exc:
+        result.update({'outcome': 'ERROR', 'violations': None, 'error': repr(exc)})
+    result['wall_ms'] = (time.perf_counter() - started) * 1000
+    result['db_ms'] = data_validation.command_timer.elapsed_ms()  # Driver round trips
+    result['output'] = lines
+    return result
+
+
+def skipped(unit, reason):
+    return {'name': unit['name'], 'outcome': 'SKIPPED', 'violations': None, 'error': reason,
+            'wall_ms': 0.0, 'db_ms': 0.0, 'output': []}
+
+# Scheduling
+
+
+def run_checks(checks=CHECKS, workers=DEFAULT_WORKERS, sequential=False, on_result=None, sink=None):
+    names = {unit['name'] for unit in checks}
+    for unit in checks:
+        missing = [dep for dep in unit['depends_on'] if dep not in names]
+        if missing:
+            raise ValueError(f"Check {unit['name']} depends on unknown checks: {missing}")
+
+    results = {}
+
+    def finish(result):
+        results[result['name']] = result
+        if on_result:
+            on_result(result)
+
+    def blocked_by(unit):
+        return [dep for dep in unit['depends_on']
+                if dep in results and results[dep]['outcome'] in ('ERROR', 'TIMEOUT', 'SKIPPED')]
+
+    pending = list(checks)
+    if sequential:
+        # Original behaviour: one check after the other, printing as it goes
+        for unit in pending:
+            failed = blocked_by(unit)
+            finish(skipped(unit, f"dependency failed: {failed}") if failed else run_check(unit, out=print, sink=sink))
+        return [results[unit['name']] for unit in checks]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            for unit in list(pending):
+                if any(dep not in results for dep in unit['depends_on']):
+                    continue
+                pending.remove(unit)
+                failed = blocked_by(unit)
+                if failed:
+                    finish(skipped(unit, f"dependency failed: {failed}"))
+                else:
+                    running[pool.submit(run_check, unit, None, sink)] = unit
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle between checks: {[unit['name'] for unit in pending]}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                finish(future.result())
+    return [results[unit['name']] for unit in checks]
+
+# Reporting
+
+
+def write_report(results, path, wall_ms):
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'wall_ms': wall_ms,
+        'checks': [{key: value for key, value in result.items() if key != 'output'} for result in results],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+def print_summary(results, wall_ms):
+    print("\n=== Validation summary ===")
+    for result in sorted(results, key=lambda r: r['wall_ms'], reverse=True):
+        violations = '-' if result['violations'] is None else result['violations']
+        print(f"{result['outcome']:<8} {result['name']:<40} violations: {violations:<8} "
+              f"wall: {result['wall_ms']:9.1f} ms  db: {result['db_ms']:9.1f} ms")
+    print(f"Total wall time: {wall_ms:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the village data validation checks.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Checks running at the same time')
+    parser.add_argument('--sequential', action='store_true', help='Run checks one by one with live printed output')
+    parser.add_argument('--timeout', type=float, default=None, help='Override the per-check timeout (seconds)')
+    parser.add_argument('--report', default=None, help='Write a JSON report to this path')
+    parser.add_argument('--violations', default=None, help='Stream every violation as NDJSON to this path')
+    parser.add_argument('--sample', type=int, default=data_validation.SAMPLE_SIZE,
+                        help='Violations printed to the console per check')
+    parser.add_argument('--quiet', action='store_true', help='Only print the summary')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if instrumentation.enabled(args):
+        instrumentation.install()
+
+    data_validation.SAMPLE_SIZE = args.sample
+    checks = CHECKS
+    if args.timeout is not None:
+        checks = [dict(unit, timeout=args.timeout) for unit in CHECKS]
+
+    def on_result(result):
+        if not args.quiet and not args.sequential:
+            for line in result['output']:
+                print(line)
+        if result.get('error'):
+            print(f"{result['outcome']}: {result['name']}: {result['error']}")
+
+    print("Starting data validation and analysis...")
+    started = time.perf_counter()
+    try:
+        with instrumentation.tagged('rollup_refresh'):
+            detection.refresh_source(data_validation.get_db())
+    except PyMongoError as exc:
+        print(f"WARN: rollup refresh failed, detection reads the previous one: {exc}")
+    sink = ReportSink(args.violations) if args.violations else None
+    try:
+        results = run_checks(checks, args.workers, args.sequential, on_result, sink)
+    finally:
+        if sink is not None:
+            sink.close()
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    print_summary(results, wall_ms)
+    if args.report:
+        write_report(results, args.report, wall_ms)
+        print(f"Report written to {args.report}")
+    if sink is not None:
+        print(f"Violations written to {args.violations}")
+    if instrumentation.enabled(args):
+        # Winning plan of every check's queries, next to what they cost
+        with instrumentation.tagged('explain'):
+            plans = indexes.plan_summaries(data_validation.get_db())
+        instrumentation.write_outputs(args, plans)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+from bson.raw_bson import RawBSONDocument
+import os
+import time
+
+import numpy as np
+
+from datetime import timedelta
+
+import bucketing
+import geo
+from generation_settings import CHUNK_SIZE, CONTROL_COVERAGE, FIVE_YEARS_DAYS, THIRTY_YEARS_DAYS
+
+# Vectorized generation engine: every numeric field of a chunk (dates, well
+# locations, statuses, readings) is drawn as a NumPy array in one shot and only
+# turned into documents at the end. Chunks and seeds are the same as in
+# data_generation, so the dataset still only depends on the seed.
+#
+# Drawing the arrays is cheap; building one dict per reading (and pymongo
+# encoding it again) is what costs. When the writer can take raw BSON, the
+# readings - most of the documents - are written straight from the arrays
+# into BSON bytes with a fixed-layout structured dtype instead.
+
+MAX_LAT, MAX_LONG = 42.822458, -5.593844
+MIN_LAT, MIN_LONG = 42.788357, -5.669483
+
+STATUSES = np.array(['Active', 'Inactive'])
+CONTROL_TYPES = np.array(['Inspection', 'Verification', 'Audit'])
+CONTROL_RESULTS = np.array(['Legal', 'No anomalies'])
+
+UUID_LENGTH = 36
+OBJECT_ID_RANDOM = os.urandom(5)  # Per process, like bson.ObjectId
+_object_id_counter = int.from_bytes(os.urandom(3), 'big')
+
+# Helper functions
+
+
+def uuid_strings(rng, count):
+    raw = np.frombuffer(rng.bytes(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40  # Version 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80  # RFC 4122 variant
+    digits = raw.tobytes().hex()
+    return [f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+            for h in (digits[i:i + 32] for i in range(0, 32 * count, 32))]
+
+
+def to_datetimes(days):
+    return days.astype('datetime64[ms]').tolist()
+
+
+def days_after(rng, start_days, today):
+    # A day in (start, today], or start itself when start is today
+    delta = (today - start_days).astype(np.int64)
+    offsets = rng.integers(1, np.maximum(delta, 1) + 1)
+    return start_days + np.where(delta > 0, offsets, 0).astype('timedelta64[D]')
+
+# Array generation for one chunk
+
+
+def generate_chunk_arrays(plan, chunk_index):
+    rng = np.random.default_rng([plan['seed'], chunk_index])
+    now = plan['now']
+    today = np.datetime64(now.date(), 'D')
+    first_index = chunk_index * CHUNK_SIZE
+    last_index = min(first_index + CHUNK_SIZE, plan['num_users'])
+    num_users = last_index - first_index
+    num_readings = plan['num_records_per_user']
+
+    is_illegal_user = np.arange(first_index, last_index) == plan['illegal_index']
+
+    # 1. Users
+    registration_dates = today - rng.integers(0, FIVE_YEARS_DAYS + 1, num_users).astype('timedelta64[D]')
+
+    # 2. Registered wells: 1-10 per user, exactly one for the illegal user
+    wells_per_user = rng.integers(1, 11, num_users)
+    wells_per_user[is_illegal_user] = 1
+    owners = np.repeat(np.arange(num_users), wells_per_user)
+    num_wells = owners.size
+    is_illegal_well = is_illegal_user[owners]
+
+    old = rng.random(num_wells) < 0.5
+    authorization_offsets = np.where(old,
+                                     rng.integers(FIVE_YEARS_DAYS, THIRTY_YEARS_DAYS + 1, num_wells),
+                                     rng.integers(0, FIVE_YEARS_DAYS + 1, num_wells))
+    authorization_dates = today - authorization_offsets.astype('timedelta64[D]')
+    last_status_changes = days_after(rng, authorization_dates, today)
+    latitudes = rng.uniform(MIN_LAT, MAX_LAT, num_wells)
+    longitudes = rng.uniform(MIN_LONG, MAX_LONG, num_wells)
+    statuses = STATUSES[rng.integers(0, 2, num_wells)]
+    statuses[is_illegal_well] = 'Inactive'
+
+    # 3. Water consumption: running readings are a cumulative sum of the weekly
+    # increments, with a heavier distribution for the illegal user
+    increments = rng.uniform(0, 10, (num_users, num_readings))
+    increments[is_illegal_user] = rng.uniform(20, 50, (int(is_illegal_user.sum()), num_readings))
+    first_readings = rng.uniform(0, 100, num_users)
+    current_readings = first_readings[:, None] + np.cumsum(increments, axis=1)
+    previous_readings = np.concatenate([first_readings[:, None], current_readings[:, :-1]], axis=1)
+
+    # 4. Control activities for ~90% of the legal wells
+    controlled = ~is_illegal_well & (rng.random(num_wells) < CONTROL_COVERAGE)
+    controlled_wells = np.flatnonzero(controlled)
+    control_dates = days_after(rng, last_status_changes[controlled_wells], today)
+    control_types = CONTROL_TYPES[rng.integers(0, 3, controlled_wells.size)]
+    control_results = CONTROL_RESULTS[rng.integers(0, 2, controlled_wells.size)]
+
+    return {
+        'rng': rng,
+        'first_index': first_index,
+        'num_users': num_users,
+        'is_illegal_user': is_illegal_user,
+        'registration_dates': registration_dates,
+        'owners': owners,
+        'is_illegal_well': is_illegal_well,
+        'authorization_dates': authorization_dates,
+        'last_status_changes': last_status_changes,
+        'latitudes': latitudes,
+        'longitudes': longitudes,
+        'statuses': statuses,
+        'previous_readings': previous_readings,
+        'current_readings': current_readings,
+        'controlled_wells': controlled_wells,
+        'control_dates': control_dates,
+        'control_types': control_types,
+        'control_results': control_results,
+    }
+
+# Readings straight to BSON. Every reading document has the same layout,
+# field by field:
+#   {_id: ObjectId, user_id: 36-char string, date, consumption_m3,
+#    previous_reading, current_reading, variation}
+
+
+def element(type_code, key):
+    return bytes([type_code]) + key.encode() + b'\x00'
+
+
+READING_DOUBLES = ['consumption_m3', 'previous_reading', 'current_reading', 'variation']
+READING_FIELDS = [
+    ('size', '<i4'),
+    ('id_element', 'S5'), ('id', 'S12'),
+    ('user_element', 'S9'), ('user_length', '<i4'), ('user_id', f"S{UUID_LENGTH}"), ('user_end', 'S1'),
+    ('date_element', 'S6'), ('date', '<i8'),
+] + [
+    field for key in READING_DOUBLES for field in ((f"{key}_element", f"S{len(key) + 2}"), (key, '<f8'))
+] + [('end', 'S1')]
+READING_DTYPE = np.dtype(READING_FIELDS)
+READING_ELEMENTS = {
+    'id_element': element(0x07, '_id'),
+    'user_element': element(0x02, 'user_id'),
+    'date_element': element(0x09, 'date'),
+    **{f"{key}_element": element(0x01, key) for key in READING_DOUBLES},
+}
+
+
+def object_ids(count):
+    # Same layout as bson.ObjectId: 4-byte timestamp, 5 random bytes, 3-byte counter
+    global _object_id_counter
+    counters = (_object_id_counter + np.arange(count, dtype=np.int64)) % 0x1000000
+    _object_id_counter = int(counters[-1]) + 1 if count else _object_id_counter
+    raw = np.empty((count, 12), dtype=np.uint8)
+    raw[:, 0:4] = np.frombuffer(int(time.time()).to_bytes(4, 'big'), dtype=np.uint8)
+    raw[:, 4:9] = np.frombuffer(OBJECT_ID_RANDOM, dtype=np.uint8)
+    raw[:, 9] = counters >> 16
+    raw[:, 10] = (counters >> 8) & 0xFF
+    raw[:, 11] = counters & 0xFF
+    return raw.view('S12').ravel()
+
+
+def encode_readings(user_ids, reading_dates, previous_readings, current_readings):
+    num_users, num_readings = previous_readings.shape
+    docs = np.zeros(num_users * num_readings, dtype=READING_DTYPE)
+    docs['size'] = READING_DTYPE.itemsize
+    for name, value in READING_ELEMENTS.items():
+        docs[name] = value
+    docs['id'] = object_ids(len(docs))
+    docs['user_length'] = UUID_LENGTH + 1  # BSON string lengths count the trailing NUL
+    docs['user_id'] = np.repeat(np.array(user_ids, dtype=f"S{UUID_LENGTH}"), num_readings)
+    docs['date'] = np.tile(np.array(reading_dates, dtype='datetime64[ms]').astype(np.int64), num_users)
+    previous, current = previous_readings.ravel(), current_readings.ravel()
+    docs['consumption_m3'] = docs['variation'] = current - previous
+    docs['previous_reading'] = previous
+    docs['current_reading'] = current
+    return [RawBSONDocument(raw) for raw in docs.view(f"V{READING_DTYPE.itemsize}").tolist()]
+
+# Document assembly for one chunk
+
+
+def build_chunk_documents(plan, arrays, text, raw_readings=False):
+    rng = arrays['rng']
+    now = plan['now']
+    num_users = arrays['num_users']
+
+    user_ids = uuid_strings(rng, num_users)
+    names = text.names(rng, range(arrays['first_index'], arrays['first_index'] + num_users))
+    addresses = text.addresses(rng, num_users)
+    users = [
+        {
+            'user_id': user_id,
+            'name': name,
+            'address': address,
+            'registration_date': registration_date
+        }
+        for user_id, name, address, registration_date in zip(
+            user_ids, names, addresses, to_datetimes(arrays['registration_dates']))
+    ]
+
+    owners = arrays['owners'].tolist()
+    is_illegal_well = arrays['is_illegal_well'].tolist()
+    well_ids = uuid_strings(rng, len(owners))
+    wells = []
+    for i, (owner, authorization_date, last_status_change, latitude, longitude, status) in enumerate(zip(
+            owners, to_datetimes(arrays['authorization_dates']), to_datetimes(arrays['last_status_changes']),
+            arrays['latitudes'].tolist(), arrays['longitudes'].tolist(), arrays['statuses'].tolist())):
+        illegal = is_illegal_well[i]
+        wells.append({
+            'well_id': well_ids[i],
+            'location': geo.point(latitude, longitude),
+            'owner_user_id': user_ids[owner],
+            'authorization_date': None if illegal else authorization_date,  # No authorization for illegal wells
+            'status': status,
+            'last_status_change': None if illegal else last_status_change
+        })
+
+    reading_dates = [now - timedelta(days=365) + timedelta(days=7 * k)
+                     for k in range(plan['num_records_per_user'])]  # Weekly readings
+    layout = bucketing.LAYOUTS[plan['consumption_layout']]
+    consumption = []
+    buckets = []
+    if raw_readings and 'water_consumption' in layout:
+        consumption = encode_readings(user_ids, reading_dates, arrays['previous_readings'],
+                                      arrays['current_readings'])
+    # Reading dicts: for the readings unless they went to BSON, and for the buckets
+    reading_dicts = 'water_consumption' in layout and not raw_readings
+    if reading_dicts or bucketing.BUCKET_COLLECTION in layout:
+        for user_id, previous_row, current_row in zip(user_ids, arrays['previous_readings'].tolist(),
+                                                      arrays['current_readings'].tolist()):
+            readings = [
+                {
+                    'user_id': user_id,
+                    'date': date,
+                    'consumption_m3': current_reading - previous_reading,
+                    'previous_reading': previous_reading,
+                    'current_reading': current_reading,
+                    'variation': current_reading - previous_reading
+                }
+                for date, previous_reading, current_reading in zip(reading_dates, previous_row, current_row)
+            ]
+            if reading_dicts:
+                consumption.extend(readings)
+            if bucketing.BUCKET_COLLECTION in layout:
+                buckets.extend(bucketing.bucket_readings(readings))
+
+    controlled_wells = arrays['controlled_wells'].tolist()
+    control_ids = uuid_strings(rng, len(controlled_wells))
+    observations = text.sentences(rng, len(controlled_wells))
+    activities = [
+        {
+            'control_id': control_id,
+            'date': date,
+            'control_type': control_type,
+            'result': result,
+            'observations': observation,
+            'well_id': well_ids[well]
+        }
+        for control_id, observation, well, date, control_type, result in zip(
+            control_ids, observations, controlled_wells, to_datetimes(arrays['control_dates']),
+            arrays['control_types'].tolist(), arrays['control_results'].tolist())
+    ]
+
+    illegal_user = illegal_well = None
+    if arrays['is_illegal_user'].any():
+        illegal_user = users[int(np.flatnonzero(arrays['is_illegal_user'])[0])]
+        illegal_well = wells[int(np.flatnonzero(arrays['is_illegal_well'])[0])]
+
+    documents = {'users': users, 'registered_wells': wells}
+    if 'water_consumption' in layout:
+        documents['water_consumption'] = consumption
+    if bucketing.BUCKET_COLLECTION in layout:
+        documents[bucketing.BUCKET_COLLECTION] = buckets
+    documents['control_activities'] = activities
+    return documents, illegal_user, illegal_well
+
+
+def load_chunk(writers, plan, chunk_index, text):
+    arrays = generate_chunk_arrays(plan, chunk_index)
+    # Raw BSON only for writers that pass documents to pymongo untouched
+    raw_readings = getattr(writers.get('water_consumption'), 'raw_bson', False)
+    documents, illegal_user, illegal_well = build_chunk_documents(plan, arrays, text, raw_readings)
+    for name, docs in documents.items():
+        writers[name].extend(docs)
+    return illegal_user, illegal_well